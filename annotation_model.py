@@ -0,0 +1,288 @@
+"""
+Annotation data model.
+
+Each tool has a compact record type. Pen strokes keep their points in a
+flat array rather than only as a QPainterPath, and every record converts
+to and from a plain dict for the stable serialization format.
+"""
+
+from array import array
+from PyQt5.QtCore import QPoint, QRectF
+from PyQt5.QtGui import QColor
+
+from strokes import stroke_path
+
+# Version of the serialized annotation format
+FORMAT_VERSION = 1
+
+
+class AnnotationTool:
+    """Base class for annotation tools."""
+    PEN = 0
+    TEXT = 1
+    ARROW = 2
+    RECTANGLE = 3
+    ELLIPSE = 4
+    PIXELATE = 5
+    BLUR = 6
+    SELECT = 7  # Selects and edits existing annotations; creates none
+
+
+class Annotation:
+    """Base record: a tool type plus the pen style shared by every tool."""
+
+    tool = None  # AnnotationTool constant, set by subclasses
+    name = None  # Name used in the serialized format
+
+    __slots__ = ('color', 'width', '_resources')
+
+    def __init__(self, color, width):
+        self.color = QColor(color)
+        self.width = width
+        self._resources = None  # Drawing resources cached by annotation_renderers
+
+    def translate(self, dx, dy):
+        """Move the annotation by whole pixels."""
+        raise NotImplementedError
+
+    def to_dict(self):
+        """Return a JSON-compatible dict describing this annotation."""
+        return {'type': self.name, 'color': self.color.name(QColor.HexArgb), 'width': self.width}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Create an annotation of whichever type data describes."""
+        try:
+            record_type = ANNOTATION_TYPES[data['type']]
+        except KeyError:
+            raise ValueError(f"Unknown annotation type: {data.get('type')!r}")
+        return record_type._from_dict(data, QColor(data['color']), int(data['width']))
+
+
+class PenStroke(Annotation):
+    """Freehand stroke stored as a flat x, y, x, y, ... point buffer."""
+
+    tool = AnnotationTool.PEN
+    name = 'pen'
+
+    __slots__ = ('points', 'smooth', '_path', '_bounds')
+
+    def __init__(self, color, width, points=(), smooth=False):
+        super().__init__(color, width)
+        self.points = array('f')
+        self.smooth = smooth
+        self._path = None
+        self._bounds = None
+        for x, y in points:
+            self.points.append(x)
+            self.points.append(y)
+
+    def __len__(self):
+        return len(self.points) // 2
+
+    def add_point(self, x, y):
+        """Append a point to the stroke."""
+        self.points.append(x)
+        self.points.append(y)
+        self._path = None
+        self._bounds = None
+
+    def last_point(self):
+        """Return the last point as an (x, y) tuple."""
+        return self.points[-2], self.points[-1]
+
+    def point_list(self):
+        """Return the points as a list of (x, y) tuples."""
+        points = self.points
+        return list(zip(points[0::2], points[1::2]))
+
+    def set_points(self, points, smooth=None):
+        """Replace the points, optionally changing whether they are smoothed."""
+        self.points = array('f', [coord for point in points for coord in point])
+        if smooth is not None:
+            self.smooth = smooth
+        self._path = None
+        self._bounds = None
+
+    def translate(self, dx, dy):
+        points = self.points
+        for index in range(0, len(points), 2):
+            points[index] += dx
+            points[index + 1] += dy
+        self._path = None
+        self._bounds = None
+
+    @property
+    def path(self):
+        """QPainterPath through the points, built on first use."""
+        if self._path is None:
+            self._path = stroke_path(self.point_list(), self.smooth)
+        return self._path
+
+    def bounding_rect(self):
+        """Return the QRectF enclosing every point."""
+        if self._bounds is None:
+            if not self.points:
+                self._bounds = QRectF()
+            else:
+                xs = self.points[0::2]
+                ys = self.points[1::2]
+                left, top = min(xs), min(ys)
+                self._bounds = QRectF(left, top, max(xs) - left, max(ys) - top)
+        return self._bounds
+
+    def to_dict(self):
+        data = super().to_dict()
+        data['points'] = [round(coord, 2) for coord in self.points]
+        data['smooth'] = self.smooth
+        return data
+
+    @classmethod
+    def _from_dict(cls, data, color, width):
+        stroke = cls(color, width, smooth=bool(data.get('smooth', False)))
+        stroke.points = array('f', data['points'])
+        return stroke
+
+
+class TextAnnotation(Annotation):
+    """Text drawn with its baseline starting at pos."""
+
+    tool = AnnotationTool.TEXT
+    name = 'text'
+
+    __slots__ = ('pos', 'text', 'font_size')
+
+    def __init__(self, color, width, pos, text, font_size=12):
+        super().__init__(color, width)
+        self.pos = QPoint(pos)
+        self.text = text
+        self.font_size = font_size
+
+    def translate(self, dx, dy):
+        self.pos += QPoint(dx, dy)
+
+    def to_dict(self):
+        data = super().to_dict()
+        data.update({'pos': [self.pos.x(), self.pos.y()], 'text': self.text,
+                     'font_size': self.font_size})
+        return data
+
+    @classmethod
+    def _from_dict(cls, data, color, width):
+        return cls(color, width, QPoint(*data['pos']), data['text'], int(data.get('font_size', 12)))
+
+
+class ShapeAnnotation(Annotation):
+    """Annotation defined by a drag from start to end."""
+
+    __slots__ = ('start', 'end')
+
+    def __init__(self, color, width, start, end=None):
+        super().__init__(color, width)
+        self.start = QPoint(start)
+        self.end = QPoint(end if end is not None else start)
+
+    def translate(self, dx, dy):
+        self.start += QPoint(dx, dy)
+        self.end += QPoint(dx, dy)
+
+    def to_dict(self):
+        data = super().to_dict()
+        data.update({'start': [self.start.x(), self.start.y()],
+                     'end': [self.end.x(), self.end.y()]})
+        return data
+
+    @classmethod
+    def _from_dict(cls, data, color, width):
+        return cls(color, width, QPoint(*data['start']), QPoint(*data['end']))
+
+
+class ArrowAnnotation(ShapeAnnotation):
+    """Line from start with an arrowhead at end."""
+
+    tool = AnnotationTool.ARROW
+    name = 'arrow'
+
+    __slots__ = ()
+
+
+class RectangleAnnotation(ShapeAnnotation):
+    """Rectangle outline spanning start and end."""
+
+    tool = AnnotationTool.RECTANGLE
+    name = 'rectangle'
+
+    __slots__ = ()
+
+
+class EllipseAnnotation(ShapeAnnotation):
+    """Ellipse outline inscribed in the rectangle spanning start and end."""
+
+    tool = AnnotationTool.ELLIPSE
+    name = 'ellipse'
+
+    __slots__ = ()
+
+
+class RedactionAnnotation(ShapeAnnotation):
+    """Region spanning start and end whose pixels are replaced, not covered.
+
+    The pen width sets the strength, in logical pixels.
+    """
+
+    STRENGTH_PER_WIDTH = 1
+
+    __slots__ = ()
+
+    @property
+    def strength(self):
+        return self.width * self.STRENGTH_PER_WIDTH
+
+
+class PixelateAnnotation(RedactionAnnotation):
+    """Region replaced by the average colour of square blocks."""
+
+    tool = AnnotationTool.PIXELATE
+    name = 'pixelate'
+    STRENGTH_PER_WIDTH = 4  # Block size
+
+    __slots__ = ()
+
+
+class BlurAnnotation(RedactionAnnotation):
+    """Region replaced by a blurred copy of itself."""
+
+    tool = AnnotationTool.BLUR
+    name = 'blur'
+    STRENGTH_PER_WIDTH = 3  # Blur radius
+
+    __slots__ = ()
+
+
+# Serialized type name -> record type
+ANNOTATION_TYPES = {record_type.name: record_type for record_type in
+                    (PenStroke, TextAnnotation, ArrowAnnotation, RectangleAnnotation, EllipseAnnotation,
+                     PixelateAnnotation, BlurAnnotation)}
+
+# AnnotationTool constant -> shape record type
+SHAPE_TYPES = {AnnotationTool.ARROW: ArrowAnnotation,
+               AnnotationTool.RECTANGLE: RectangleAnnotation,
+               AnnotationTool.ELLIPSE: EllipseAnnotation,
+               AnnotationTool.PIXELATE: PixelateAnnotation,
+               AnnotationTool.BLUR: BlurAnnotation}
+
+# AnnotationTool constants of the tools that redact pixels
+REDACTION_TOOLS = (AnnotationTool.PIXELATE, AnnotationTool.BLUR)
+
+
+def serialize(annotations):
+    """Return a JSON-compatible dict holding a list of annotations."""
+    return {'version': FORMAT_VERSION, 'annotations': [annotation.to_dict() for annotation in annotations]}
+
+
+def deserialize(data):
+    """Return the list of annotations stored by serialize()."""
+    version = data.get('version')
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported annotation format version: {version!r}")
+    return [Annotation.from_dict(item) for item in data['annotations']]
@@ -0,0 +1,232 @@
+"""
+Per-tool annotation renderers.
+
+Each annotation tool registers a Renderer that draws its annotations, and
+reports the bounds and outline they cover. AnnotationWindow looks the
+renderer up by tool, so a new tool needs a record type in
+annotation_model.py and a renderer here, not new branches in the window.
+
+A renderer builds the Qt objects an annotation is drawn with (pens,
+fonts, QStaticText, arrowhead polygons) once, and keeps them on the
+annotation for the layer rebuilds, region repaints and undos that redraw
+it. They are stored with the key() they were built for, the style and
+geometry they depend on, and rebuilt when it no longer matches, so
+restyling or moving an annotation invalidates them without any call.
+"""
+
+from PyQt5.QtCore import Qt, QPoint, QPointF, QRect, QRectF
+from PyQt5.QtGui import QPen, QFont, QFontMetrics, QPainterPath, QPolygonF, QStaticText, QTransform
+
+from annotation_model import AnnotationTool, REDACTION_TOOLS
+
+# AnnotationTool constant -> Renderer
+RENDERERS = {}
+
+
+def register(*tools):
+    """Class decorator registering one instance of a Renderer for the given tools."""
+    def decorator(renderer_type):
+        renderer = renderer_type()
+        for tool in tools:
+            RENDERERS[tool] = renderer
+        return renderer_type
+    return decorator
+
+
+def renderer_for(annotation):
+    """Return the renderer registered for an annotation's tool."""
+    try:
+        return RENDERERS[annotation.tool]
+    except KeyError:
+        raise ValueError(f"No renderer for annotation tool {annotation.tool!r}")
+
+
+class Renderer:
+    """Draws the annotations of one tool and caches what they are drawn with."""
+
+    def key(self, annotation):
+        """Return what the prepared resources depend on; by default the style."""
+        return annotation.color.rgba(), annotation.width
+
+    def prepare(self, annotation):
+        """Build the resources draw() uses; by default a plain pen."""
+        return QPen(annotation.color, annotation.width)
+
+    def resources(self, annotation):
+        """Return the annotation's prepared resources, rebuilding them if its key changed."""
+        key = self.key(annotation)
+        cached = annotation._resources
+        if cached is None or cached[0] != key:
+            cached = annotation._resources = (key, self.prepare(annotation))
+        return cached[1]
+
+    def margin(self, annotation):
+        """Pixels the drawing reaches beyond the annotation's geometry."""
+        return annotation.width // 2 + 2
+
+    def draw(self, painter, annotation, window):
+        """Draw the annotation in image coordinates; window is the AnnotationWindow."""
+        raise NotImplementedError
+
+    def bounds(self, annotation):
+        """Return the image QRect the drawing covers."""
+        raise NotImplementedError
+
+    def outline(self, annotation):
+        """Return the QPainterPath the pen follows, or None to pick anywhere inside the bounds."""
+        return None
+
+
+@register(AnnotationTool.PEN)
+class PenRenderer(Renderer):
+    """Freehand strokes; the path itself is cached by PenStroke."""
+
+    def prepare(self, annotation):
+        pen = QPen(annotation.color, annotation.width)
+        pen.setCapStyle(Qt.RoundCap)
+        pen.setJoinStyle(Qt.RoundJoin)
+        return pen
+
+    def draw(self, painter, annotation, window):
+        painter.setPen(self.resources(annotation))
+        painter.setBrush(Qt.NoBrush)
+        painter.drawPath(annotation.path)
+
+    def bounds(self, annotation):
+        margin = self.margin(annotation)
+        return annotation.bounding_rect().toAlignedRect().adjusted(-margin, -margin, margin, margin)
+
+    def outline(self, annotation):
+        return annotation.path
+
+
+@register(AnnotationTool.TEXT)
+class TextRenderer(Renderer):
+    """Text laid out once as QStaticText."""
+
+    def key(self, annotation):
+        return annotation.color.rgba(), annotation.font_size, annotation.text
+
+    def prepare(self, annotation):
+        font = QFont()
+        font.setPointSize(annotation.font_size)
+        metrics = QFontMetrics(font)
+        text = QStaticText(annotation.text)
+        text.setTextFormat(Qt.PlainText)
+        text.prepare(QTransform(), font)
+        # QStaticText is placed by its top-left corner, the annotation by its baseline
+        return QPen(annotation.color), font, text, metrics.boundingRect(annotation.text), metrics.ascent()
+
+    def draw(self, painter, annotation, window):
+        pen, font, text, _, ascent = self.resources(annotation)
+        painter.setPen(pen)
+        painter.setFont(font)
+        painter.drawStaticText(QPointF(annotation.pos.x(), annotation.pos.y() - ascent), text)
+
+    def bounds(self, annotation):
+        margin = self.margin(annotation)
+        rect = self.resources(annotation)[3].translated(annotation.pos)
+        return rect.adjusted(-margin, -margin, margin, margin)
+
+
+class ShapeRenderer(Renderer):
+    """Annotations spanning the rectangle from start to end."""
+
+    def rect(self, annotation):
+        return QRect(annotation.start, annotation.end).normalized()
+
+    def bounds(self, annotation):
+        margin = self.margin(annotation)
+        return self.rect(annotation).adjusted(-margin, -margin, margin, margin)
+
+
+@register(AnnotationTool.RECTANGLE)
+class RectangleRenderer(ShapeRenderer):
+
+    def draw(self, painter, annotation, window):
+        painter.setPen(self.resources(annotation))
+        painter.setBrush(Qt.NoBrush)
+        painter.drawRect(self.rect(annotation))
+
+    def outline(self, annotation):
+        path = QPainterPath()
+        path.addRect(QRectF(self.rect(annotation)))
+        return path
+
+
+@register(AnnotationTool.ELLIPSE)
+class EllipseRenderer(ShapeRenderer):
+
+    def draw(self, painter, annotation, window):
+        painter.setPen(self.resources(annotation))
+        painter.setBrush(Qt.NoBrush)
+        painter.drawEllipse(self.rect(annotation))
+
+    def outline(self, annotation):
+        path = QPainterPath()
+        path.addEllipse(QRectF(self.rect(annotation)))
+        return path
+
+
+@register(AnnotationTool.ARROW)
+class ArrowRenderer(ShapeRenderer):
+    """A line with a filled arrowhead at its end."""
+
+    HEAD_SIZE = 10
+
+    def key(self, annotation):
+        start, end = annotation.start, annotation.end
+        return annotation.color.rgba(), annotation.width, start.x(), start.y(), end.x(), end.y()
+
+    def prepare(self, annotation):
+        return QPen(annotation.color, annotation.width), self.head(annotation.start, annotation.end)
+
+    def head(self, start, end):
+        """Return the arrowhead triangle at end, or None if the line is too short to point."""
+        size = self.HEAD_SIZE
+        dx = end.x() - start.x()
+        dy = end.y() - start.y()
+        length = (dx*dx + dy*dy) ** 0.5
+        if length <= 1e-6:
+            return None
+
+        # Unit direction and its perpendicular
+        dx /= length
+        dy /= length
+        px, py = -dy, dx
+
+        p1 = QPoint(int(end.x() - size * dx + size/2 * px), int(end.y() - size * dy + size/2 * py))
+        p2 = QPoint(int(end.x() - size * dx - size/2 * px), int(end.y() - size * dy - size/2 * py))
+        return QPolygonF([QPointF(end), QPointF(p1), QPointF(p2)])
+
+    def draw(self, painter, annotation, window):
+        pen, head = self.resources(annotation)
+        painter.setPen(pen)
+        painter.setBrush(Qt.NoBrush)
+        painter.drawLine(annotation.start, annotation.end)
+        if head is not None:
+            painter.setBrush(annotation.color)
+            painter.drawPolygon(head)
+
+    def margin(self, annotation):
+        return super().margin(annotation) + self.HEAD_SIZE
+
+    def outline(self, annotation):
+        path = QPainterPath()
+        path.moveTo(QPointF(annotation.start))
+        path.lineTo(QPointF(annotation.end))
+        head = self.resources(annotation)[1]
+        if head is not None:
+            path.addPolygon(head)
+        return path
+
+
+@register(*REDACTION_TOOLS)
+class RedactionRenderer(ShapeRenderer):
+    """Regions whose pixels the window replaces from its redaction cache."""
+
+    def prepare(self, annotation):
+        return None
+
+    def draw(self, painter, annotation, window):
+        window.draw_redaction(painter, annotation)
@@ -2,50 +2,292 @@
 Annotation window for captured screenshots.
 """
 
+import os
+import math
+import time
+from concurrent.futures import wait
 from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QPushButton, 
                              QToolBar, QAction, QColorDialog, QInputDialog,
-                             QFileDialog, QApplication, QLabel, QSpinBox, QMessageBox)
-from PyQt5.QtCore import Qt, QPoint, QRect, pyqtSignal
+                             QFileDialog, QApplication, QLabel, QSpinBox, QMessageBox,
+                             QToolTip)
+from PyQt5.QtCore import Qt, QPoint, QPointF, QRect, QRectF, QSize, QTimer, pyqtSignal
 from PyQt5.QtGui import (QPainter, QPen, QColor, QPixmap, QImage, QCursor,
-                        QFont, QPainterPath, QPolygonF)
+                        QPainterPathStroker, QPolygonF, QKeySequence)
+from annotation_model import AnnotationTool, PenStroke, TextAnnotation, SHAPE_TYPES, REDACTION_TOOLS, serialize
+from annotation_renderers import renderer_for
+from clipboard_data import LazyImageMimeData
+from encoders import Exporter, FILE_FILTERS as IMAGE_FILTERS, PRESETS, save_with_preset
+from history import (UndoHistory, AddAnnotationCommand, TileSnapshot, MoveAnnotationsCommand,
+                     DeleteAnnotationsCommand, RestyleAnnotationsCommand)
+from image_saver import ImageSaver
+from memory_manager import CompressedImage, pixmap_nbytes
+from redaction import RedactionCache
+from spatial_index import GridIndex
+from session import write_session, FILE_FILTER as SESSION_FILTER, EXTENSION as SESSION_EXTENSION
+from strokes import simplify_points
+from tile_pyramid import ImagePyramid, TileCache
 
 
-class AnnotationTool:
-    """Base class for annotation tools."""
-    PEN = 0
-    TEXT = 1
-    ARROW = 2
-    RECTANGLE = 3
-    ELLIPSE = 4
+def scale_rect(rect, factor):
+    """Map a rectangle in logical pixels to the device pixels covering it."""
+    if factor == 1:
+        return QRect(rect)
+    
+    left = math.floor(rect.x() * factor)
+    top = math.floor(rect.y() * factor)
+    right = math.ceil((rect.x() + rect.width()) * factor)
+    bottom = math.ceil((rect.y() + rect.height()) * factor)
+    return QRect(left, top, right - left, bottom - top)
+
+
+def logical_size(pixmap):
+    """Return the size of a pixmap in logical pixels, honouring its device pixel ratio."""
+    ratio = pixmap.devicePixelRatio()
+    return QSize(round(pixmap.width() / ratio), round(pixmap.height() / ratio))
+
+
+class AnnotationCanvas(QWidget):
+    """Display surface for an AnnotationWindow.
+
+    Composites the window's cached annotation layer with the in-progress
+    annotation, repainting only the region Qt reports as dirty. The view
+    zooms and pans: at 100% the layer is drawn directly, at any other zoom
+    from tiles rendered out of a pyramid of reduced copies, so only what is
+    visible is ever scaled.
+
+    View coordinates are image coordinates (logical pixels) times zoom;
+    scroll_pos is the view point shown at the canvas's top-left corner.
+    """
+    
+    zoom_changed = pyqtSignal(float)
+    
+    MIN_ZOOM = 1 / 32
+    MAX_ZOOM = 16
+    ZOOM_STEP = 1.25  # Per wheel notch or shortcut press
+    BACKGROUND = QColor(45, 45, 48)  # Around an image smaller than the view
+    
+    def __init__(self, owner, size):
+        super().__init__(owner)
+        self.owner = owner
+        self.image_size = logical_size(owner.screenshot)
+        self.zoom = 1.0
+        self.scroll_pos = QPoint(0, 0)
+        self.pyramid = None  # Reduced copies of the layer, made on the first zoomed-out paint
+        self.tiles = TileCache()
+        self.setAttribute(Qt.WA_OpaquePaintEvent)
+        self.setMouseTracking(True)  # Hover outlines for the select tool
+        self.setFixedSize(size)
+        
+    @property
+    def nbytes(self):
+        return self.tiles.nbytes + (self.pyramid.nbytes if self.pyramid is not None else 0)
+        
+    def view_size(self, zoom=None):
+        """Return the size of the whole image in view pixels."""
+        zoom = self.zoom if zoom is None else zoom
+        return QSize(math.ceil(self.image_size.width() * zoom), math.ceil(self.image_size.height() * zoom))
+        
+    def view_rect(self, rect, zoom=None):
+        """Map a rectangle in image coordinates to the view pixels covering it."""
+        zoom = self.zoom if zoom is None else zoom
+        left = math.floor(rect.x() * zoom)
+        top = math.floor(rect.y() * zoom)
+        right = math.ceil((rect.x() + rect.width()) * zoom)
+        bottom = math.ceil((rect.y() + rect.height()) * zoom)
+        return QRect(left, top, right - left, bottom - top)
+        
+    def to_image(self, pos):
+        """Map a point on the canvas to image coordinates, as a QPointF."""
+        return QPointF((pos.x() + self.scroll_pos.x()) / self.zoom, (pos.y() + self.scroll_pos.y()) / self.zoom)
+        
+    def to_image_rect(self, rect):
+        """Map a rectangle on the canvas to image coordinates, as a QRectF."""
+        zoom = self.zoom
+        return QRectF((rect.x() + self.scroll_pos.x()) / zoom, (rect.y() + self.scroll_pos.y()) / zoom,
+                      rect.width() / zoom, rect.height() / zoom)
+        
+    def update_image_rect(self, rect):
+        """Repaint the part of the canvas showing a rectangle in image coordinates."""
+        self.update(self.view_rect(rect).translated(-self.scroll_pos))
+        
+    def layer_changed(self, rect):
+        """Refresh what shows a rectangle of the layer that was painted on, in image coordinates."""
+        if self.pyramid is not None:
+            layer = self.owner.base_layer
+            self.pyramid.update(scale_rect(rect, layer.devicePixelRatio()).intersected(layer.rect()))
+        self.tiles.invalidate(lambda zoom: self.view_rect(rect, zoom))
+        self.update_image_rect(rect)
+        
+    def reset_layer(self):
+        """Forget everything derived from a layer that was replaced or released."""
+        self.pyramid = None
+        self.tiles.clear()
+        
+    def clamp_scroll(self, pos):
+        """Keep the view on the image, centring an image smaller than the canvas."""
+        size = self.view_size()
+        
+        def clamp(value, content, view):
+            if content <= view:
+                return -((view - content) // 2)
+            return max(0, min(value, content - view))
+        
+        return QPoint(clamp(pos.x(), size.width(), self.width()), clamp(pos.y(), size.height(), self.height()))
+        
+    def pan_by(self, delta):
+        """Move the view by delta canvas pixels, redrawing only what comes into view."""
+        target = self.clamp_scroll(self.scroll_pos + delta)
+        moved = target - self.scroll_pos
+        if moved.isNull():
+            return
+        self.scroll_pos = target
+        self.scroll(-moved.x(), -moved.y())
+        
+    def set_zoom(self, zoom, anchor=None):
+        """Zoom so the image point under anchor (canvas pixels, default the centre) stays put."""
+        zoom = max(self.MIN_ZOOM, min(self.MAX_ZOOM, zoom))
+        if abs(zoom - 1) < 1e-3:
+            zoom = 1.0  # Land exactly on 100% so the layer is drawn unscaled
+        if zoom == self.zoom:
+            return
+        anchor = anchor if anchor is not None else self.rect().center()
+        point = self.to_image(anchor)
+        self.zoom = zoom
+        self.scroll_pos = self.clamp_scroll(QPoint(round(point.x() * zoom - anchor.x()),
+                                                   round(point.y() * zoom - anchor.y())))
+        self.update()
+        self.zoom_changed.emit(zoom)
+        
+    def zoom_by(self, steps, anchor=None):
+        self.set_zoom(self.zoom * self.ZOOM_STEP ** steps, anchor)
+        
+    def zoom_to_fit(self):
+        """Zoom so the whole image fits the canvas."""
+        self.set_zoom(min(self.width() / self.image_size.width(), self.height() / self.image_size.height()))
+        
+    def paintEvent(self, event):
+        """Paint the dirty region from the cached layer plus the live overlay."""
+        self.owner.ensure_resident(screenshot=False)
+        rect = event.rect()
+        base_layer = self.owner.base_layer
+        painter = QPainter(self)
+        
+        image_rect = QRect(-self.scroll_pos, self.view_size())
+        if not image_rect.contains(rect):
+            painter.fillRect(rect, self.BACKGROUND)
+        visible = rect.intersected(image_rect)
+        if self.zoom == 1:
+            source = visible.translated(self.scroll_pos)
+            painter.drawPixmap(visible, base_layer, scale_rect(source, base_layer.devicePixelRatio()))
+        elif not visible.isEmpty():
+            self.draw_tiles(painter, visible)
+        
+        # The live overlay is drawn in image coordinates
+        painter.translate(-self.scroll_pos)
+        painter.scale(self.zoom, self.zoom)
+        clip = self.to_image_rect(rect)
+        current = self.owner.current_annotation
+        if current and current.tool == AnnotationTool.PEN:
+            # Pen strokes are drawn incrementally onto their own layer
+            stroke_layer = self.owner.stroke_layer
+            ratio = stroke_layer.devicePixelRatio()
+            painter.drawPixmap(clip, stroke_layer, QRectF(clip.x() * ratio, clip.y() * ratio,
+                                                          clip.width() * ratio, clip.height() * ratio))
+        painter.setClipRect(clip)
+        painter.setRenderHint(QPainter.Antialiasing)
+        if current and current.tool != AnnotationTool.PEN:
+            self.owner.draw_annotation(painter, current)
+        for annotation in self.owner.floating:
+            self.owner.draw_annotation(painter, annotation)
+        self.owner.draw_selection(painter)
+            
+        painter.end()
+        
+    def draw_tiles(self, painter, visible):
+        """Draw the tiles under a canvas rectangle at the current zoom."""
+        if self.pyramid is None:
+            self.pyramid = ImagePyramid(self.owner.base_layer)
+        size = self.tiles.TILE_SIZE
+        ratio = self.devicePixelRatioF()
+        columns, rows = self.tiles.tile_range(visible.translated(self.scroll_pos))
+        for row in rows:
+            for column in columns:
+                tile = self.tiles.tile(self.pyramid, self.zoom, ratio, column, row)
+                painter.drawPixmap(QPoint(column * size, row * size) - self.scroll_pos, tile)
     
 
 class AnnotationWindow(QWidget):
     """Window for displaying and annotating captured screenshots."""
     
+    activated = pyqtSignal()  # Shown or interacted with
+    
     # Constants
     TOOLBAR_HEIGHT = 40
+    STROKE_MIN_DISTANCE = 2  # Pen points closer than this to the last one are dropped
+    STROKE_TOLERANCE = 0.75  # Max deviation in pixels when simplifying a finished stroke
+    STROKE_SMOOTHING = True  # Round off finished strokes with curves
+    HISTORY_MEMORY_LIMIT = 64 * 1024 * 1024  # Bytes of undo snapshots kept per window
+    HIT_TOLERANCE = 4  # Screen pixels around an outline that still select it
+    SELECTION_COLOR = QColor(0, 120, 215)
     
-    def __init__(self, screenshot, original_pos=None):
+    def __init__(self, screenshot, original_pos=None, annotations=None, session=None):
         super().__init__()
         self.screenshot = screenshot
+        # Open Session whose mapped pixels screenshot wraps; closed with the window
+        self.session = session
         self.original_pos = original_pos or QPoint(0, 0)
-        self.annotations = []  # List of annotation items
+        self.annotations = list(annotations or [])  # List of annotation items
         self.current_tool = AnnotationTool.PEN
         self.pen_color = QColor(255, 0, 0)
         self.pen_width = 3
         self.is_drawing = False
         self.last_point = None
         self.current_annotation = None
+        self.base_layer = None  # Screenshot with committed annotations flattened
+        self.stroke_layer = None  # Transparent layer holding the pen stroke in progress
+        self.pending_points = []  # Pen points received since the last frame
+        self.history = UndoHistory(self.HISTORY_MEMORY_LIMIT)
+        self.redactions = RedactionCache()  # Pixelated and blurred pixels of the screenshot
+        self.index = GridIndex()  # Bounds of committed annotations, for hit tests
+        self.selection = []  # Selected annotations, in list order
+        self.hover_annotation = None  # Annotation the select tool would pick at the cursor
+        self.floating = []  # Selected annotations lifted off the layer while being dragged
+        self.move_origin = None  # Image point where a move started
+        self.move_offset = QPoint(0, 0)  # How far the floating annotations have moved
+        self.band_origin = None  # Image point where a selection band started
+        self.band_rect = None
+        self.last_used = time.monotonic()
+        
+        # Pixmaps demoted by the memory budget, restored by ensure_resident()
+        self.compressed_screenshot = None
+        self.compressed_base_layer = None
+        
+        # Coalesces pen moves into at most one stroke update per display frame
+        self.frame_timer = QTimer(self)
+        self.frame_timer.setSingleShot(True)
+        self.frame_timer.setTimerType(Qt.PreciseTimer)
+        self.frame_timer.timeout.connect(self.flush_stroke)
+        
+        # Saves run in the background and report back through signals
+        self.saver = ImageSaver(self)
+        self.saver.saved.connect(self.on_save_finished)
+        self.saver.failed.connect(self.on_save_failed)
+        self.exporter = Exporter(self)
+        self.exporter.exported.connect(self.on_export_finished)
+        self.exporter.failed.connect(self.on_save_failed)
         
         # For moving the window
         self.dragging = False
         self.drag_position = None
+        self.pan_origin = None  # Last position of a middle-button drag panning the view
         
         self.setup_ui()
         
     def setup_ui(self):
         """Set up the annotation window UI."""
         self.setWindowFlags(Qt.WindowStaysOnTopHint | Qt.FramelessWindowHint | Qt.Tool)
+        self.setAttribute(Qt.WA_DeleteOnClose)  # Free the pixmaps once closed
+        self.setMouseTracking(True)
         
         # Set initial position
         self.move(self.original_pos)
@@ -59,15 +301,21 @@ class AnnotationWindow(QWidget):
         toolbar = self.create_toolbar()
         layout.addWidget(toolbar)
         
-        # Image label
-        self.image_label = QLabel()
+        # Image canvas, no larger than the screen; bigger captures are panned
+        size = logical_size(self.screenshot)
+        screen = QApplication.screenAt(self.original_pos) or QApplication.primaryScreen()
+        if screen is not None:
+            available = screen.availableGeometry().size()
+            size = size.boundedTo(QSize(available.width(), available.height() - self.TOOLBAR_HEIGHT))
+        self.canvas = AnnotationCanvas(self, size)
+        self.canvas.zoom_changed.connect(self.on_zoom_changed)
         self.update_image()
-        layout.addWidget(self.image_label)
+        layout.addWidget(self.canvas)
         
         self.setLayout(layout)
         
         # Set window size
-        self.resize(self.screenshot.width(), self.screenshot.height() + self.TOOLBAR_HEIGHT)
+        self.resize(size.width(), size.height() + self.TOOLBAR_HEIGHT)
         
     def create_toolbar(self):
         """Create the toolbar with annotation tools."""
@@ -95,6 +343,14 @@ class AnnotationWindow(QWidget):
             }
         """)
         
+        # Select tool
+        select_action = QAction("⬚ Select", self)
+        select_action.setCheckable(True)
+        select_action.setToolTip("Select annotations to move, restyle or delete (Del)")
+        select_action.triggered.connect(lambda: self.set_tool(AnnotationTool.SELECT))
+        toolbar.addAction(select_action)
+        self.select_action = select_action
+        
         # Pen tool
         pen_action = QAction("✏️ Pen", self)
         pen_action.setCheckable(True)
@@ -131,6 +387,22 @@ class AnnotationWindow(QWidget):
         toolbar.addAction(ellipse_action)
         self.ellipse_action = ellipse_action
         
+        # Pixelate tool
+        pixelate_action = QAction("▦ Pixelate", self)
+        pixelate_action.setCheckable(True)
+        pixelate_action.setToolTip("Pixelate a region; the width sets the block size")
+        pixelate_action.triggered.connect(lambda: self.set_tool(AnnotationTool.PIXELATE))
+        toolbar.addAction(pixelate_action)
+        self.pixelate_action = pixelate_action
+        
+        # Blur tool
+        blur_action = QAction("💧 Blur", self)
+        blur_action.setCheckable(True)
+        blur_action.setToolTip("Blur a region; the width sets the strength")
+        blur_action.triggered.connect(lambda: self.set_tool(AnnotationTool.BLUR))
+        toolbar.addAction(blur_action)
+        self.blur_action = blur_action
+        
         toolbar.addSeparator()
         
         # Color picker
@@ -165,6 +437,18 @@ class AnnotationWindow(QWidget):
         save_action.triggered.connect(self.save_image)
         toolbar.addAction(save_action)
         
+        # Export in every format at once, to compare size and encode time
+        export_action = QAction("📦 Export All", self)
+        export_action.setToolTip("Save in every format side by side and report each file's size")
+        export_action.triggered.connect(self.export_all)
+        toolbar.addAction(export_action)
+        
+        # Save session button
+        session_action = QAction("💼 Session", self)
+        session_action.setToolTip("Save the capture with editable annotations")
+        session_action.triggered.connect(self.save_session)
+        toolbar.addAction(session_action)
+        
         # Copy button
         copy_action = QAction("📋 Copy", self)
         copy_action.triggered.connect(self.copy_to_clipboard)
@@ -172,6 +456,57 @@ class AnnotationWindow(QWidget):
         
         toolbar.addSeparator()
         
+        # Undo/redo buttons
+        self.undo_action = QAction("↶ Undo", self)
+        self.undo_action.setShortcut(QKeySequence.Undo)
+        self.undo_action.triggered.connect(self.undo)
+        toolbar.addAction(self.undo_action)
+        
+        self.redo_action = QAction("↷ Redo", self)
+        self.redo_action.setShortcuts([QKeySequence.Redo, QKeySequence("Ctrl+Shift+Z")])
+        self.redo_action.triggered.connect(self.redo)
+        toolbar.addAction(self.redo_action)
+        self.update_history_actions()
+        
+        # Deletes the selected annotations
+        delete_action = QAction("Delete", self)
+        delete_action.setShortcuts([QKeySequence.Delete, QKeySequence(Qt.Key_Backspace)])
+        delete_action.triggered.connect(self.delete_selection)
+        self.addAction(delete_action)
+        
+        toolbar.addSeparator()
+        
+        # Zoom; Ctrl+wheel zooms around the cursor too
+        zoom_out_action = QAction("➖", self)
+        zoom_out_action.setToolTip("Zoom out (Ctrl+-)")
+        zoom_out_action.setShortcut(QKeySequence.ZoomOut)
+        zoom_out_action.triggered.connect(lambda: self.canvas.zoom_by(-1))
+        toolbar.addAction(zoom_out_action)
+        
+        self.zoom_label = QLabel("100%")
+        self.zoom_label.setToolTip("Ctrl+0 fits the window, Ctrl+1 is actual size; "
+                                   "scroll or drag with the middle button to pan")
+        self.zoom_label.setStyleSheet("color: white; padding: 0 4px;")
+        toolbar.addWidget(self.zoom_label)
+        
+        zoom_in_action = QAction("➕", self)
+        zoom_in_action.setToolTip("Zoom in (Ctrl++)")
+        zoom_in_action.setShortcuts([QKeySequence.ZoomIn, QKeySequence("Ctrl+=")])
+        zoom_in_action.triggered.connect(lambda: self.canvas.zoom_by(1))
+        toolbar.addAction(zoom_in_action)
+        
+        fit_action = QAction("Fit", self)
+        fit_action.setShortcut(QKeySequence("Ctrl+0"))
+        fit_action.triggered.connect(lambda: self.canvas.zoom_to_fit())
+        self.addAction(fit_action)
+        
+        actual_size_action = QAction("100%", self)
+        actual_size_action.setShortcut(QKeySequence("Ctrl+1"))
+        actual_size_action.triggered.connect(lambda: self.canvas.set_zoom(1.0))
+        self.addAction(actual_size_action)
+        
+        toolbar.addSeparator()
+        
         # Close button
         close_action = QAction("❌ Close", self)
         close_action.triggered.connect(self.close)
@@ -189,97 +524,582 @@ class AnnotationWindow(QWidget):
         self.arrow_action.setChecked(tool == AnnotationTool.ARROW)
         self.rect_action.setChecked(tool == AnnotationTool.RECTANGLE)
         self.ellipse_action.setChecked(tool == AnnotationTool.ELLIPSE)
+        self.pixelate_action.setChecked(tool == AnnotationTool.PIXELATE)
+        self.blur_action.setChecked(tool == AnnotationTool.BLUR)
+        self.select_action.setChecked(tool == AnnotationTool.SELECT)
+        if tool != AnnotationTool.SELECT:
+            self.set_selection([])
+            self.set_hover(None)
+        self.prepare_redaction()
         
     def choose_color(self):
         """Open color picker dialog."""
         color = QColorDialog.getColor(self.pen_color, self, "Choose Color")
         if color.isValid():
             self.pen_color = color
+            self.restyle_selection(color=color)
             
     def change_width(self, value):
         """Change pen width."""
         self.pen_width = value
+        self.restyle_selection(width=value)
+        self.prepare_redaction()
+        
+    def prepare_redaction(self):
+        """Start building the layer a redaction tool at the current width will draw from."""
+        if self.current_tool not in REDACTION_TOOLS:
+            return
+        self.ensure_resident(base_layer=False)
+        strength = self.pen_width * SHAPE_TYPES[self.current_tool].STRENGTH_PER_WIDTH
+        self.redactions.prepare(self.screenshot, self.current_tool, self.device_strength(strength))
+        
+    def device_strength(self, strength):
+        """Convert a redaction strength in logical pixels to whole device pixels."""
+        return max(1, round(strength * self.screenshot.devicePixelRatio()))
         
     def update_image(self):
-        """Update the displayed image with annotations."""
-        # Create a copy of the screenshot
-        result = QPixmap(self.screenshot)
+        """Rebuild the cached annotation layer and repaint the whole canvas.
+        
+        Only needed when committed annotations change in a way that cannot be
+        painted incrementally; new annotations go through commit_annotation().
+        """
+        # Flatten the screenshot and all committed annotations into one layer
+        self.ensure_resident(base_layer=False)
+        self.base_layer = QPixmap(self.screenshot)
+        self.index.clear()
+        for order, annotation in enumerate(self.annotations):
+            self.index.insert(annotation, self.annotation_bounds(annotation), order)
+        
+        # Without annotations the layer keeps sharing the screenshot's pixels
+        if self.annotations:
+            painter = QPainter(self.base_layer)
+            painter.setRenderHint(QPainter.Antialiasing)
+            
+            for annotation in self.annotations:
+                self.draw_annotation(painter, annotation)
+                
+            painter.end()
+        
+        self.canvas.reset_layer()
+        self.canvas.update()
+        
+    def commit_annotation(self, annotation):
+        """Add an annotation as an undoable step and paint it onto the cached layer."""
+        self.push_command(AddAnnotationCommand(annotation))
+        
+    def push_command(self, command):
+        """Apply a change as an undoable step."""
+        self.history.push(command, self)
+        self.update_history_actions()
+        
+    def paint_annotation(self, annotation, snapshot=None):
+        """Append an annotation and paint it onto the cached layer.
+        
+        Returns a snapshot of the layer tiles it covered beforehand, reusing
+        snapshot if one was taken already.
+        """
+        self.ensure_resident(screenshot=False)
+        bounds = self.annotation_bounds(annotation)
+        if snapshot is None:
+            snapshot = TileSnapshot(self.base_layer, scale_rect(bounds, self.base_layer.devicePixelRatio()))
+        
+        self.annotations.append(annotation)
+        self.index.insert(annotation, bounds, self.stacking_order(len(self.annotations) - 1))
+        
+        painter = QPainter(self.base_layer)
+        painter.setRenderHint(QPainter.Antialiasing)
+        self.draw_annotation(painter, annotation)
+        painter.end()
+        
+        self.canvas.layer_changed(bounds)
+        return snapshot
+        
+    def unpaint_annotation(self, annotation, snapshot):
+        """Remove the last annotation and restore the layer tiles under it."""
+        self.ensure_resident(screenshot=False)
+        self.annotations.pop()
+        self.index.remove(annotation)
+        self.deselect([annotation])
+        snapshot.restore(self.base_layer)
+        self.canvas.layer_changed(self.annotation_bounds(annotation))
+        
+    def stacking_order(self, position):
+        """Return an index order for the annotation at a list position, between its neighbours'."""
+        below = self.index.order(self.annotations[position - 1]) if position > 0 else None
+        above = (self.index.order(self.annotations[position + 1])
+                 if position + 1 < len(self.annotations) else None)
+        if above is None:
+            return 0 if below is None else below + 1
+        return above - 1 if below is None else (below + above) / 2
+        
+    def repaint_layer(self, rect, exclude=()):
+        """Redraw a rectangle of the cached layer from the screenshot and the annotations over it.
+        
+        Only the annotations the index finds there are drawn, so this costs
+        the same however many annotations there are elsewhere.
+        """
+        self.ensure_resident()
+        rect = rect.intersected(QRect(QPoint(0, 0), logical_size(self.screenshot)))
+        if rect.isEmpty():
+            return
+        painter = QPainter(self.base_layer)
+        painter.setClipRect(rect)
+        painter.setCompositionMode(QPainter.CompositionMode_Source)
+        painter.drawPixmap(rect, self.screenshot, scale_rect(rect, self.screenshot.devicePixelRatio()))
+        painter.setCompositionMode(QPainter.CompositionMode_SourceOver)
+        painter.setRenderHint(QPainter.Antialiasing)
+        for annotation in reversed(self.index.query(rect)):
+            if annotation not in exclude:
+                self.draw_annotation(painter, annotation)
+        painter.end()
+        self.canvas.layer_changed(rect)
+        
+    def bounds_of(self, annotations):
+        """Return the rectangle covering several annotations."""
+        bounds = QRect()
+        for annotation in annotations:
+            bounds = bounds.united(self.annotation_bounds(annotation))
+        return bounds
+        
+    def move_annotations(self, annotations, offset):
+        """Move annotations by an offset and redraw the layer where they were and are."""
+        dirty = self.bounds_of(annotations)
+        for annotation in annotations:
+            annotation.translate(offset.x(), offset.y())
+            self.index.update(annotation, self.annotation_bounds(annotation))
+        dirty = dirty.united(self.bounds_of(annotations))
+        self.repaint_layer(dirty)
+        self.canvas.update_image_rect(dirty.adjusted(-2, -2, 2, 2))
+        
+    def remove_annotations(self, annotations):
+        """Remove annotations from anywhere in the list.
+        
+        Returns (position, annotation) pairs in list order, for
+        insert_annotations() to put them back.
+        """
+        doomed = set(annotations)
+        removed = [(position, annotation) for position, annotation in enumerate(self.annotations)
+                   if annotation in doomed]
+        self.annotations = [annotation for annotation in self.annotations if annotation not in doomed]
+        dirty = self.bounds_of(annotations)
+        for annotation in annotations:
+            self.index.remove(annotation)
+        self.deselect(annotations)
+        self.repaint_layer(dirty)
+        return removed
+        
+    def insert_annotations(self, removed):
+        """Put annotations back at the list positions remove_annotations() returned."""
+        for position, annotation in removed:
+            self.annotations.insert(position, annotation)
+            self.index.insert(annotation, self.annotation_bounds(annotation), self.stacking_order(position))
+        self.repaint_layer(self.bounds_of(annotation for _, annotation in removed))
+        
+    def restyle_annotations(self, annotations, styles):
+        """Set the (color, width) of each annotation and redraw them."""
+        dirty = self.bounds_of(annotations)
+        for annotation, (color, width) in zip(annotations, styles):
+            annotation.color = QColor(color)
+            annotation.width = width
+            self.index.update(annotation, self.annotation_bounds(annotation))
+        dirty = dirty.united(self.bounds_of(annotations))
+        self.repaint_layer(dirty)
+        self.canvas.update_image_rect(dirty.adjusted(-2, -2, 2, 2))
+        
+    def undo(self):
+        """Undo the most recent annotation change."""
+        if not self.is_drawing:
+            self.history.undo(self)
+            self.update_history_actions()
+            
+    def redo(self):
+        """Redo the most recently undone annotation change."""
+        if not self.is_drawing:
+            self.history.redo(self)
+            self.update_history_actions()
+            
+    def update_history_actions(self):
+        """Enable the undo/redo buttons only when there is something to do."""
+        self.undo_action.setEnabled(self.history.can_undo())
+        self.redo_action.setEnabled(self.history.can_redo())
         
-        # Draw annotations
+    def update_current(self, dirty_rect):
+        """Repaint the canvas region touched by the in-progress annotation."""
+        self.canvas.update_image_rect(dirty_rect)
+        
+    def annotation_bounds(self, annotation):
+        """Return the image rectangle covered by an annotation, including its pen."""
+        return renderer_for(annotation).bounds(annotation)
+        
+    def rendered_pixmap(self):
+        """Return the annotated image, including any in-progress annotation.
+        
+        The pixmap owns its pixels, so it can be handed to the clipboard or
+        a worker thread.
+        """
+        self.ensure_resident(screenshot=False)
+        if not self.current_annotation:
+            return self.owned(self.base_layer)
+        
+        result = QPixmap(self.base_layer)
         painter = QPainter(result)
         painter.setRenderHint(QPainter.Antialiasing)
+        self.draw_annotation(painter, self.current_annotation)
+        painter.end()
+        return result
+        
+    def owned(self, pixmap):
+        """Return pixmap, or a copy of it if it shares the pixels mapped from a session file."""
+        if (self.session is not None and self.screenshot is not None
+                and pixmap.cacheKey() == self.screenshot.cacheKey()):
+            return pixmap.copy()
+        return pixmap
+        
+    def touch(self):
+        """Record that the window was used and let the memory budget know."""
+        self.last_used = time.monotonic()
+        self.activated.emit()
+        
+    def memory_usage(self):
+        """Return the bytes of pixmap and undo data this window keeps in memory."""
+        total = pixmap_nbytes(self.stroke_layer) + self.redactions.nbytes + self.canvas.nbytes
+        # Pixels mapped from a session file are pages the system can drop and reread
+        mapped = self.session is not None
+        shared = self.screenshot_shares_layer()
+        if not (mapped and shared):
+            total += pixmap_nbytes(self.base_layer)
+        if not (mapped or shared):
+            total += pixmap_nbytes(self.screenshot)
+        return total + self.history.memory_usage
+        
+    def compressed_images(self):
+        """Return the compressed buffers holding this window's demoted pixmaps."""
+        return [image for image in (self.compressed_screenshot, self.compressed_base_layer)
+                if image is not None]
+        
+    def screenshot_shares_layer(self):
+        """Whether the screenshot and the cached layer share one pixel buffer."""
+        return (self.screenshot is not None and self.base_layer is not None
+                and self.screenshot.cacheKey() == self.base_layer.cacheKey())
+        
+    def demote(self, full=False):
+        """Compress pixmaps to free memory.
         
-        for annotation in self.annotations:
-            self.draw_annotation(painter, annotation)
+        Only the original screenshot is compressed unless full is set, in
+        which case the displayed layer is released too; use full only for
+        windows that are not visible.
+        """
+        if self.is_drawing:
+            return
+        
+        # Redacted pixels are cheap to rebuild from the screenshot
+        self.redactions.clear()
+        
+        if full:
+            if self.base_layer is not None and not self.screenshot_shares_layer():
+                self.compressed_base_layer = CompressedImage(self.base_layer)
+            # An unannotated layer is rebuilt from the screenshot instead
+            self.base_layer = None
+            self.stroke_layer = None
+            self.canvas.reset_layer()
+            
+        if self.screenshot is not None and self.session is None and not self.screenshot_shares_layer():
+            self.compressed_screenshot = CompressedImage(self.screenshot)
+            self.screenshot = None
             
-        # Draw current annotation if any
-        if self.current_annotation:
-            self.draw_annotation(painter, self.current_annotation)
+    def ensure_resident(self, base_layer=True, screenshot=True):
+        """Restore the demoted pixmaps a caller needs.
+        
+        Displaying the window needs only the base layer; pass screenshot=False
+        there, so that a visible window keeps its original screenshot
+        compressed until something reads its pixels.
+        """
+        if screenshot and self.screenshot is None and self.compressed_screenshot is not None:
+            self.screenshot = self.compressed_screenshot.to_pixmap()
+            self.compressed_screenshot.close()
+            self.compressed_screenshot = None
+            
+        if base_layer and self.base_layer is None:
+            if self.compressed_base_layer is not None:
+                self.base_layer = self.compressed_base_layer.to_pixmap()
+                self.compressed_base_layer.close()
+                self.compressed_base_layer = None
+            else:
+                self.update_image()
+                
+    def showEvent(self, event):
+        """Restore the demoted layer as soon as the window is shown."""
+        super().showEvent(event)
+        self.ensure_resident(screenshot=False)
+        self.touch()
+        
+    def closeEvent(self, event):
+        """Drop the pixmaps and release the session file the screenshot is mapped from."""
+        super().closeEvent(event)
+        self.frame_timer.stop()
+        if self.session is not None:
+            # Redaction layers still being built read the mapped pixels
+            wait(list(self.redactions.layers.values()))
+        self.redactions.clear()
+        self.canvas.reset_layer()
+        self.screenshot = None
+        self.base_layer = None
+        self.stroke_layer = None
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+        
+    def stroke_pen(self, annotation):
+        """Return the pen used for freehand strokes."""
+        return renderer_for(annotation).resources(annotation)
+        
+    def ensure_stroke_layer(self):
+        """Create the transparent stroke layer on first use."""
+        self.ensure_resident(screenshot=False)
+        if self.stroke_layer is None or self.stroke_layer.size() != self.base_layer.size():
+            self.stroke_layer = QPixmap(self.base_layer.size())
+            self.stroke_layer.setDevicePixelRatio(self.base_layer.devicePixelRatio())
+            self.stroke_layer.fill(Qt.transparent)
             
+    def frame_interval(self):
+        """Return the display frame interval in milliseconds."""
+        refresh_rate = self.screen().refreshRate() if self.screen() else 0
+        return max(1, int(1000 / refresh_rate)) if refresh_rate > 0 else 16
+        
+    def flush_stroke(self):
+        """Append the pen points queued since the last frame to the stroke."""
+        annotation = self.current_annotation
+        if not self.pending_points or not annotation or annotation.tool != AnnotationTool.PEN:
+            self.pending_points = []
+            return
+        
+        segment = QPolygonF([QPointF(*annotation.last_point())] + [QPointF(p) for p in self.pending_points])
+        for point in self.pending_points:
+            annotation.add_point(point.x(), point.y())
+        self.pending_points = []
+        
+        # Draw only the new segment onto the stroke layer
+        painter = QPainter(self.stroke_layer)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setPen(self.stroke_pen(annotation))
+        painter.drawPolyline(segment)
+        painter.end()
+        
+        margin = annotation.width // 2 + 2
+        self.update_current(segment.boundingRect().toAlignedRect().adjusted(-margin, -margin, margin, margin))
+        
+    def finish_stroke(self):
+        """Simplify the pen stroke in progress and commit it."""
+        self.frame_timer.stop()
+        self.flush_stroke()
+        
+        annotation = self.current_annotation
+        self.current_annotation = None
+        stroke_bounds = self.annotation_bounds(annotation)
+        
+        points = simplify_points(annotation.point_list(), self.STROKE_TOLERANCE)
+        annotation.set_points(points, smooth=self.STROKE_SMOOTHING)
+        
+        # Clear the stroke layer where the live stroke was drawn
+        painter = QPainter(self.stroke_layer)
+        painter.setCompositionMode(QPainter.CompositionMode_Source)
+        painter.fillRect(stroke_bounds, Qt.transparent)
         painter.end()
         
-        self.image_label.setPixmap(result)
+        self.commit_annotation(annotation)
+        self.canvas.update_image_rect(stroke_bounds)
         
     def draw_annotation(self, painter, annotation):
-        """Draw a single annotation."""
-        pen = QPen(annotation['color'], annotation['width'])
-        painter.setPen(pen)
+        """Draw a single annotation with the renderer registered for its tool."""
+        renderer_for(annotation).draw(painter, annotation, self)
         
-        if annotation['type'] == AnnotationTool.PEN:
-            path = annotation['path']
-            painter.drawPath(path)
-            
-        elif annotation['type'] == AnnotationTool.TEXT:
-            font = QFont()
-            font.setPointSize(annotation.get('font_size', 12))
-            painter.setFont(font)
-            painter.drawText(annotation['pos'], annotation['text'])
+    def hits(self, annotation, pos, tolerance):
+        """Whether an image point is on an annotation's drawn geometry, give or take tolerance."""
+        renderer = renderer_for(annotation)
+        outline = renderer.outline(annotation)
+        if outline is None:
+            # Filled areas are picked anywhere inside
+            return QRectF(renderer.bounds(annotation)).contains(pos)
+        
+        stroker = QPainterPathStroker()
+        stroker.setWidth(annotation.width + 2 * tolerance)
+        stroker.setCapStyle(Qt.RoundCap)
+        stroker.setJoinStyle(Qt.RoundJoin)
+        return stroker.createStroke(outline).contains(pos)
+        
+    def annotation_at(self, pos):
+        """Return the topmost annotation at an image point (QPointF), or None.
+        
+        The index narrows the search to the few annotations whose bounds are
+        near the point; only those are tested against their geometry.
+        """
+        tolerance = self.HIT_TOLERANCE / self.canvas.zoom
+        reach = math.ceil(tolerance)
+        probe = QRect(pos.toPoint(), QSize(1, 1)).adjusted(-reach, -reach, reach, reach)
+        for annotation in self.index.query(probe):
+            if self.hits(annotation, pos, tolerance):
+                return annotation
+        return None
+        
+    def update_overlay(self, rect):
+        """Repaint the canvas around an image rectangle whose outlines changed."""
+        if not rect.isNull():
+            self.canvas.update_image_rect(rect.adjusted(-2, -2, 2, 2))
             
-        elif annotation['type'] == AnnotationTool.ARROW:
-            start = annotation['start']
-            end = annotation['end']
+    def set_selection(self, annotations):
+        """Replace the selected annotations."""
+        dirty = self.bounds_of(self.selection)
+        self.selection = list(annotations)
+        self.update_overlay(dirty.united(self.bounds_of(self.selection)))
+        
+    def deselect(self, annotations):
+        """Drop annotations from the selection and hover, e.g. once removed."""
+        gone = set(annotations)
+        if self.hover_annotation in gone:
+            self.set_hover(None)
+        if any(annotation in gone for annotation in self.selection):
+            self.set_selection([annotation for annotation in self.selection if annotation not in gone])
             
-            # Draw line
-            painter.drawLine(start, end)
+    def set_hover(self, annotation):
+        """Outline the annotation the select tool would pick, and show the move cursor over it."""
+        if annotation is self.hover_annotation:
+            return
+        dirty = self.bounds_of([a for a in (self.hover_annotation, annotation) if a is not None])
+        self.hover_annotation = annotation
+        if annotation is None:
+            self.canvas.unsetCursor()
+        else:
+            self.canvas.setCursor(Qt.SizeAllCursor)
+        self.update_overlay(dirty)
+        
+    def draw_selection(self, painter):
+        """Outline the selection, the hovered annotation and the selection band, in image coordinates."""
+        if not (self.selection or self.hover_annotation or self.band_rect):
+            return
+        painter.setBrush(Qt.NoBrush)
+        painter.setPen(QPen(self.SELECTION_COLOR, 0, Qt.DashLine))  # Cosmetic: one pixel at any zoom
+        for annotation in self.selection:
+            painter.drawRect(self.annotation_bounds(annotation))
+        if self.hover_annotation is not None and self.hover_annotation not in self.selection:
+            painter.setPen(QPen(self.SELECTION_COLOR, 0, Qt.DotLine))
+            painter.drawRect(self.annotation_bounds(self.hover_annotation))
+        if self.band_rect is not None:
+            painter.fillRect(self.band_rect, QColor(0, 120, 215, 40))
+            painter.setPen(QPen(self.SELECTION_COLOR, 0))
+            painter.drawRect(self.band_rect)
             
-            # Draw arrowhead
-            arrow_size = 10
+    def press_select(self, pos, extend):
+        """Pick the annotation under pos to move, or start a selection band."""
+        self.is_drawing = True
+        hit = self.annotation_at(pos)
+        if hit is None:
+            if not extend:
+                self.set_selection([])
+            self.band_origin = pos
+            return
+        
+        if extend and hit in self.selection:
+            self.set_selection([annotation for annotation in self.selection if annotation is not hit])
+            return
+        if extend:
+            self.set_selection(self.selection + [hit])
+        elif hit not in self.selection:
+            self.set_selection([hit])
+        self.move_origin = pos
+        
+    def drag_select(self, pos):
+        """Move the selection, or stretch the selection band, to pos."""
+        if self.move_origin is not None:
+            offset = (pos - self.move_origin).toPoint()
+            step = offset - self.move_offset
+            if step.isNull():
+                return
+            if not self.floating:
+                # Take the selection off the layer and draw it live until dropped
+                self.floating = list(self.selection)
+                self.repaint_layer(self.bounds_of(self.floating), exclude=set(self.floating))
+            dirty = self.bounds_of(self.floating)
+            for annotation in self.floating:
+                annotation.translate(step.x(), step.y())
+            self.move_offset = offset
+            self.update_overlay(dirty.united(self.bounds_of(self.floating)))
             
-            # Calculate direction vector
-            dx = end.x() - start.x()
-            dy = end.y() - start.y()
-            length = (dx*dx + dy*dy) ** 0.5
+        elif self.band_origin is not None:
+            dirty = self.band_rect or QRect()
+            self.band_rect = QRectF(self.band_origin, pos).normalized().toAlignedRect()
+            self.update_overlay(dirty.united(self.band_rect))
             
-            # Only draw arrowhead if line is long enough
-            if length > 1e-6:
-                # Normalize
-                dx /= length
-                dy /= length
-                
-                # Perpendicular
-                px = -dy
-                py = dx
-                
-                # Arrowhead points
-                p1 = QPoint(int(end.x() - arrow_size * dx + arrow_size/2 * px),
-                           int(end.y() - arrow_size * dy + arrow_size/2 * py))
-                p2 = QPoint(int(end.x() - arrow_size * dx - arrow_size/2 * px),
-                           int(end.y() - arrow_size * dy - arrow_size/2 * py))
+    def release_select(self, extend):
+        """Drop moved annotations as an undoable move, or select those inside the band."""
+        floating, offset = self.floating, self.move_offset
+        self.floating = []
+        self.move_origin = None
+        self.move_offset = QPoint(0, 0)
+        if floating:
+            # Put them back where they started; the command moves them for good
+            for annotation in floating:
+                annotation.translate(-offset.x(), -offset.y())
+            if offset.isNull():
+                self.repaint_layer(self.bounds_of(floating))
+            else:
+                self.update_overlay(self.bounds_of(floating).translated(offset))
+                self.push_command(MoveAnnotationsCommand(floating, offset))
                 
-                polygon = QPolygonF([end, p1, p2])
-                painter.setBrush(annotation['color'])
-                painter.drawPolygon(polygon)
+        band = self.band_rect
+        self.band_origin = None
+        self.band_rect = None
+        if band is not None:
+            index = self.index
+            inside = [annotation for annotation in index.query(band) if band.contains(index.rect(annotation))]
+            inside.sort(key=index.order)
+            if extend:
+                inside = self.selection + [annotation for annotation in inside if annotation not in self.selection]
+            self.update_overlay(band)
+            self.set_selection(inside)
             
-        elif annotation['type'] == AnnotationTool.RECTANGLE:
-            rect = QRect(annotation['start'], annotation['end'])
-            painter.drawRect(rect.normalized())
+    def delete_selection(self):
+        """Delete the selected annotations as one undoable step."""
+        if self.selection and not self.is_drawing:
+            self.push_command(DeleteAnnotationsCommand(self.selection))
             
-        elif annotation['type'] == AnnotationTool.ELLIPSE:
-            rect = QRect(annotation['start'], annotation['end'])
-            painter.drawEllipse(rect.normalized())
+    def restyle_selection(self, color=None, width=None):
+        """Apply a colour or width to the selected annotations as one undoable step."""
+        if self.is_drawing:
+            return
+        changed = [annotation for annotation in self.selection
+                   if (color is not None and annotation.color != color)
+                   or (width is not None and annotation.width != width)]
+        if changed:
+            self.push_command(RestyleAnnotationsCommand(changed, color, width))
+            
+    def draw_redaction(self, painter, annotation):
+        """Replace the pixels under a redaction with their redacted screenshot pixels."""
+        self.ensure_resident(base_layer=False)
+        ratio = self.screenshot.devicePixelRatio()
+        rect = QRect(annotation.start, annotation.end).normalized()
+        device_rect = scale_rect(rect, ratio).intersected(self.screenshot.rect())
+        if device_rect.isEmpty():
+            return
+        
+        strength = self.device_strength(annotation.strength)
+        if annotation is self.current_annotation or annotation in self.floating:
+            # Still being dragged: paint from the layer, caching nothing
+            layer = self.redactions.layer(self.screenshot, annotation.tool, strength)
+            layer.draw(painter, device_rect, ratio)
+            return
+        
+        image = self.redactions.region(self.screenshot, annotation.tool, strength, device_rect)
+        image.setDevicePixelRatio(ratio)
+        painter.drawImage(QPointF(device_rect.x() / ratio, device_rect.y() / ratio), image)
     
     def mousePressEvent(self, event):
         """Handle mouse press events."""
+        self.touch()
+        
+        if event.button() == Qt.MiddleButton:
+            self.pan_origin = event.pos()
+            return
+        
         # Check if clicking on toolbar area
         if event.pos().y() < self.TOOLBAR_HEIGHT:
             if event.button() == Qt.LeftButton:
@@ -289,106 +1109,194 @@ class AnnotationWindow(QWidget):
             
         # Handle annotation tools
         if event.button() == Qt.LeftButton:
-            pos = event.pos() - QPoint(0, self.TOOLBAR_HEIGHT)  # Adjust for toolbar
+            pos = self.image_pos(event)
             
             if self.current_tool == AnnotationTool.PEN:
                 self.is_drawing = True
                 self.last_point = pos
-                path = QPainterPath()
-                path.moveTo(pos)
-                self.current_annotation = {
-                    'type': AnnotationTool.PEN,
-                    'color': self.pen_color,
-                    'width': self.pen_width,
-                    'path': path
-                }
+                self.pending_points = []
+                self.current_annotation = PenStroke(self.pen_color, self.pen_width,
+                                                    [(pos.x(), pos.y())])
+                self.ensure_stroke_layer()
+                self.frame_timer.setInterval(self.frame_interval())
                 
             elif self.current_tool == AnnotationTool.TEXT:
                 text, ok = QInputDialog.getText(self, 'Add Text', 'Enter text:')
                 if ok and text:
-                    self.annotations.append({
-                        'type': AnnotationTool.TEXT,
-                        'color': self.pen_color,
-                        'width': self.pen_width,
-                        'pos': pos,
-                        'text': text,
-                        'font_size': 12
-                    })
-                    self.update_image()
+                    self.commit_annotation(TextAnnotation(self.pen_color, self.pen_width, pos.toPoint(), text))
                     
-            elif self.current_tool in [AnnotationTool.ARROW, AnnotationTool.RECTANGLE, AnnotationTool.ELLIPSE]:
+            elif self.current_tool in SHAPE_TYPES:
                 self.is_drawing = True
-                self.current_annotation = {
-                    'type': self.current_tool,
-                    'color': self.pen_color,
-                    'width': self.pen_width,
-                    'start': pos,
-                    'end': pos
-                }
+                self.current_annotation = SHAPE_TYPES[self.current_tool](self.pen_color, self.pen_width,
+                                                                         pos.toPoint())
+                
+            elif self.current_tool == AnnotationTool.SELECT:
+                self.press_select(pos, bool(event.modifiers() & Qt.ShiftModifier))
     
     def mouseMoveEvent(self, event):
         """Handle mouse move events."""
         if self.dragging:
             self.move(event.globalPos() - self.drag_position)
             return
+        
+        if self.pan_origin is not None:
+            self.canvas.pan_by(self.pan_origin - event.pos())
+            self.pan_origin = event.pos()
+            return
             
         if self.is_drawing:
-            pos = event.pos() - QPoint(0, self.TOOLBAR_HEIGHT)
+            pos = self.image_pos(event)
             
-            if self.current_tool == AnnotationTool.PEN:
+            if self.current_tool == AnnotationTool.SELECT:
+                self.drag_select(pos)
+                
+            elif self.current_tool == AnnotationTool.PEN:
                 if self.current_annotation:
-                    self.current_annotation['path'].lineTo(pos)
-                    self.update_image()
+                    # Drop points that barely moved, then wait for the next frame
+                    if (pos - self.last_point).manhattanLength() >= self.STROKE_MIN_DISTANCE:
+                        self.last_point = pos
+                        self.pending_points.append(pos)
+                        if not self.frame_timer.isActive():
+                            self.frame_timer.start()
                     
-            elif self.current_tool in [AnnotationTool.ARROW, AnnotationTool.RECTANGLE, AnnotationTool.ELLIPSE]:
+            elif self.current_tool in SHAPE_TYPES:
                 if self.current_annotation:
-                    self.current_annotation['end'] = pos
-                    self.update_image()
+                    # Repaint where the shape was and where it is now
+                    dirty = self.annotation_bounds(self.current_annotation)
+                    self.current_annotation.end = pos.toPoint()
+                    self.update_current(dirty.united(self.annotation_bounds(self.current_annotation)))
+                    
+        elif self.current_tool == AnnotationTool.SELECT:
+            self.set_hover(self.annotation_at(self.image_pos(event)))
     
     def mouseReleaseEvent(self, event):
         """Handle mouse release events."""
         if self.dragging:
             self.dragging = False
             return
+        
+        if event.button() == Qt.MiddleButton:
+            self.pan_origin = None
+            return
             
         if event.button() == Qt.LeftButton and self.is_drawing:
             self.is_drawing = False
             
+            if self.current_tool == AnnotationTool.SELECT:
+                self.release_select(bool(event.modifiers() & Qt.ShiftModifier))
+                return
+            
             if self.current_annotation:
-                self.annotations.append(self.current_annotation)
+                if self.current_annotation.tool == AnnotationTool.PEN:
+                    self.finish_stroke()
+                    return
+                
+                annotation = self.current_annotation
                 self.current_annotation = None
-                self.update_image()
+                self.commit_annotation(annotation)
     
+    def image_pos(self, event):
+        """Map a mouse event on the window to image coordinates, as a QPointF."""
+        return self.canvas.to_image(self.canvas.mapFrom(self, event.pos()))
+        
+    def wheelEvent(self, event):
+        """Zoom around the cursor with Ctrl held, otherwise pan (Shift pans sideways)."""
+        if event.modifiers() & Qt.ControlModifier:
+            steps = event.angleDelta().y() / 120
+            if steps:
+                self.canvas.zoom_by(steps, self.canvas.mapFrom(self, event.pos()))
+            return
+        
+        delta = event.pixelDelta()
+        if delta.isNull():
+            delta = event.angleDelta()
+        if event.modifiers() & Qt.ShiftModifier and not delta.x():
+            delta = QPoint(delta.y(), 0)
+        self.canvas.pan_by(-delta)
+        
+    def on_zoom_changed(self, zoom):
+        self.zoom_label.setText(f"{round(zoom * 100)}%")
+        
     def save_image(self):
         """Save the annotated image to a file."""
-        file_path, _ = QFileDialog.getSaveFileName(
+        file_path, selected_filter = QFileDialog.getSaveFileName(
             self,
             "Save Image",
             "",
-            "PNG Files (*.png);;JPEG Files (*.jpg);;All Files (*)"
+            ";;".join(IMAGE_FILTERS) + ";;All Files (*)"
         )
         
         if file_path:
             try:
                 # Get the current pixmap with annotations
-                pixmap = self.image_label.pixmap()
+                pixmap = self.rendered_pixmap()
                 if pixmap is None:
                     QMessageBox.warning(self, "Save Error", "No image to save.")
                     return
                 
-                if not pixmap.save(file_path):
-                    QMessageBox.warning(self, "Save Error", 
-                                      f"Failed to save image to {file_path}")
+                # Encode and write on a worker thread
+                preset_name = IMAGE_FILTERS.get(selected_filter)
+                if preset_name is None:
+                    self.saver.save(pixmap.toImage(), file_path)
+                    return
+                
+                quality = None
+                preset = PRESETS.get(preset_name)
+                if preset is not None and preset.quality is not None:
+                    quality, ok = QInputDialog.getInt(self, "Save Image", f"{preset.label} quality (0-100):",
+                                                      preset.quality, 0, 100)
+                    if not ok:
+                        return
+                self.saver.run(file_path, save_with_preset, pixmap.toImage(), file_path, preset_name, quality)
             except Exception as e:
                 QMessageBox.critical(self, "Save Error", 
                                    f"An error occurred while saving: {str(e)}")
+                
+    def export_all(self):
+        """Save the annotated image with every encoder preset at once."""
+        file_path, _ = QFileDialog.getSaveFileName(self, "Export All Formats", "",
+                                                   "Base file name (*)")
+        if file_path:
+            self.exporter.export(self.rendered_pixmap().toImage(), file_path)
+
+    def on_export_finished(self, base_path, results):
+        """Report the size and encode time of each exported file."""
+        written = [result for result in results if result.error is None]
+        smallest = min(written, key=lambda result: result.size)
+        lines = [result.describe() for result in results]
+        lines.append(f"\nSmallest: {os.path.basename(smallest.path)}")
+        QMessageBox.information(self, "Export All", "\n".join(lines))
+
+    def save_session(self):
+        """Save the original capture and its annotations as a session file."""
+        file_path, _ = QFileDialog.getSaveFileName(self, "Save Session", "", SESSION_FILTER)
+        
+        if file_path:
+            if not file_path.endswith(SESSION_EXTENSION):
+                file_path += SESSION_EXTENSION
+            
+            self.ensure_resident(base_layer=False)
+            self.saver.run(file_path, write_session, file_path, self.owned(self.screenshot).toImage(),
+                           serialize(self.annotations), self.pos(),
+                           self.screenshot.devicePixelRatio())
+            
+    def on_save_finished(self, file_path):
+        """Show a brief confirmation once a background save completes."""
+        QToolTip.showText(self.mapToGlobal(QPoint(0, self.TOOLBAR_HEIGHT)),
+                          f"Saved to {file_path}", self)
+        
+    def on_save_failed(self, file_path, error):
+        """Report a background save that could not be completed."""
+        QMessageBox.warning(self, "Save Error", 
+                          f"Failed to save image to {file_path}: {error}")
             
     def copy_to_clipboard(self):
         """Copy the annotated image to clipboard."""
-        pixmap = self.image_label.pixmap()
+        pixmap = self.rendered_pixmap()
         if pixmap is None:
             QMessageBox.warning(self, "Copy Error", "No image to copy.")
             return
         
+        # Formats are encoded only when another application asks for them
         clipboard = QApplication.clipboard()
-        clipboard.setPixmap(pixmap)
+        clipboard.setMimeData(LazyImageMimeData(pixmap.toImage()))
@@ -0,0 +1,511 @@
+"""
+Headless performance benchmarks for the capture, overlay and annotation paths.
+
+Runs under Qt's offscreen platform, feeds synthetic captures and mouse-event
+streams to SelectionOverlay and AnnotationWindow, and reports latency
+percentiles. Results are written as JSON so runs can be compared between
+versions:
+
+    python benchmark.py --out before.json
+    python benchmark.py --out after.json --compare before.json
+
+Latency budgets for the interactive paths live in BUDGETS rather than in
+the unit tests, where wall-clock limits would flake on loaded machines; a
+run that exceeds any of them lists it and exits with status 1.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import subprocess
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtCore import Qt, QPoint, QPointF, QEvent, QT_VERSION_STR, PYQT_VERSION_STR
+from PyQt5.QtGui import QPainter, QColor, QPixmap, QMouseEvent, QLinearGradient
+
+import cli
+from image_saver import save_image_file
+from encoders import PRESETS, encode_all, encode_auto
+
+DEFAULT_SIZES = '1280x720,1920x1080,3840x2160'
+DEFAULT_COUNTS = '0,100,1000'
+
+# Benchmark name -> (statistic, milliseconds) it must stay within
+BUDGETS = {
+    'overlay.element_at': ('p99_ms', 2.0),  # Highlight lookup on every overlay mouse move
+    'cli.capture.imports': ('p50_ms', cli.IMPORT_BUDGET_MS),  # Interpreter start-up included
+    'annotation.pan.100%': ('p50_ms', 1000 / 60),  # One wheel notch per display frame
+    'annotation.pan.50%': ('p50_ms', 1000 / 60),
+    'annotation.pan.25%': ('p50_ms', 1000 / 60),
+    'annotation.annotation_at': ('p50_ms', 1.0),  # Hit test on every select-tool mouse move
+}
+
+
+def percentile(samples, pct):
+    """Return the nearest-rank percentile of a list of samples."""
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarize(name, samples, **params):
+    """Build a result record (milliseconds) for one benchmark run."""
+    samples_ms = [s * 1000.0 for s in samples]
+    record = {'benchmark': name}
+    record.update(params)
+    record.update({
+        'samples': len(samples_ms),
+        'mean_ms': sum(samples_ms) / len(samples_ms),
+        'p50_ms': percentile(samples_ms, 50),
+        'p90_ms': percentile(samples_ms, 90),
+        'p99_ms': percentile(samples_ms, 99),
+        'max_ms': max(samples_ms),
+    })
+    return record
+
+
+def measure(func, repeat):
+    """Call func repeat times and return the wall-clock duration of each call."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def make_capture(width, height, seed=0):
+    """Create a synthetic screenshot with gradients and UI-like blocks."""
+    rng = random.Random(seed)
+    pixmap = QPixmap(width, height)
+    painter = QPainter(pixmap)
+
+    gradient = QLinearGradient(0, 0, width, height)
+    gradient.setColorAt(0, QColor(240, 240, 245))
+    gradient.setColorAt(1, QColor(180, 190, 210))
+    painter.fillRect(pixmap.rect(), gradient)
+
+    for _ in range(width * height // 20000):
+        color = QColor(rng.randrange(256), rng.randrange(256), rng.randrange(256))
+        painter.fillRect(rng.randrange(width), rng.randrange(height),
+                         rng.randrange(10, 200), rng.randrange(5, 60), color)
+
+    painter.end()
+    return pixmap
+
+
+def make_annotation(tool, width, height, rng):
+    """Create a random annotation of the given tool type."""
+    from annotation_model import AnnotationTool, PenStroke, TextAnnotation, SHAPE_TYPES
+
+    color = QColor(rng.randrange(256), rng.randrange(256), rng.randrange(256))
+    start = QPoint(rng.randrange(width), rng.randrange(height))
+    pen_width = rng.randrange(1, 8)
+
+    if tool == AnnotationTool.PEN:
+        x, y = start.x(), start.y()
+        points = [(x, y)]
+        for _ in range(50):
+            x = max(0, min(width - 1, x + rng.randrange(-15, 16)))
+            y = max(0, min(height - 1, y + rng.randrange(-15, 16)))
+            points.append((x, y))
+        return PenStroke(color, pen_width, points)
+    if tool == AnnotationTool.TEXT:
+        return TextAnnotation(color, pen_width, start, 'Benchmark note')
+    return SHAPE_TYPES[tool](color, pen_width, start, QPoint(rng.randrange(width), rng.randrange(height)))
+
+
+def make_annotations(count, width, height, seed=0):
+    """Create count annotations cycling through every tool type."""
+    from annotation_window import AnnotationTool
+
+    rng = random.Random(seed)
+    tools = [AnnotationTool.PEN, AnnotationTool.TEXT, AnnotationTool.ARROW,
+             AnnotationTool.RECTANGLE, AnnotationTool.ELLIPSE]
+    return [make_annotation(tools[i % len(tools)], width, height, rng) for i in range(count)]
+
+
+def mouse_event(event_type, pos, button=Qt.LeftButton):
+    """Create a synthetic left-button mouse event at pos."""
+    buttons = Qt.NoButton if event_type == QEvent.MouseButtonRelease else Qt.LeftButton
+    if event_type == QEvent.MouseMove:
+        button = Qt.NoButton
+    return QMouseEvent(event_type, QPointF(pos), button, buttons, Qt.NoModifier)
+
+
+def stroke_points(width, height, steps, seed=0):
+    """Return a wandering mouse path inside a width x height area."""
+    rng = random.Random(seed)
+    x, y = width // 2, height // 2
+    points = []
+    for _ in range(steps):
+        x = max(0, min(width - 1, x + rng.randrange(-6, 7)))
+        y = max(0, min(height - 1, y + rng.randrange(-6, 7)))
+        points.append(QPoint(x, y))
+    return points
+
+
+def drag_stream(app, widget, points, offset=QPoint(0, 0)):
+    """Send a press/move.../release stream and time each move including repaint."""
+    app.sendEvent(widget, mouse_event(QEvent.MouseButtonPress, points[0] + offset))
+    samples = []
+    for point in points[1:]:
+        start = time.perf_counter()
+        app.sendEvent(widget, mouse_event(QEvent.MouseMove, point + offset))
+        app.processEvents()
+        samples.append(time.perf_counter() - start)
+    app.sendEvent(widget, mouse_event(QEvent.MouseButtonRelease, points[-1] + offset))
+    app.processEvents()
+    return samples
+
+
+def bench_overlay(app, capture, args):
+    """Benchmark SelectionOverlay painting and rubber-band dragging."""
+    from screen_capture import SelectionOverlay
+
+    params = {'width': capture.width(), 'height': capture.height()}
+    results = []
+
+    overlay = SelectionOverlay(capture)
+    app.processEvents()
+    results.append(summarize('overlay.paintEvent', measure(overlay.repaint, args.repeat), **params))
+
+    # Rubber-band from the top-left quarter towards the bottom-right
+    start = QPoint(capture.width() // 4, capture.height() // 4)
+    points = [start + QPoint(i * 3, i * 2) for i in range(args.moves)]
+    results.append(summarize('overlay.mouseMoveEvent', drag_stream(app, overlay, points), **params))
+
+    # Warm-standby reuse: reset with a new capture, show and paint
+    def show_warm():
+        overlay.start(capture)
+        app.processEvents()
+        overlay.dismiss()
+
+    results.append(summarize('overlay.time_to_overlay', measure(show_warm, args.repeat), **params))
+
+    # Background element analysis, and the per-move highlight lookup it enables
+    from element_map import build_element_map
+    image = capture.toImage()
+    element_samples = measure(lambda: build_element_map(image, capture.devicePixelRatio()),
+                              max(1, args.save_repeat))
+    results.append(summarize('overlay.element_map.build', element_samples, **params))
+    element_map = build_element_map(image, capture.devicePixelRatio())
+    rng = random.Random(2)
+    lookups = [QPoint(rng.randrange(capture.width()), rng.randrange(capture.height()))
+               for _ in range(args.moves)]
+    results.append(summarize('overlay.element_at',
+                             [measure(lambda: element_map.element_at(pos), 1)[0] for pos in lookups],
+                             **params))
+
+    overlay.close()
+    overlay.deleteLater()
+    app.processEvents()
+    return results
+
+
+def bench_annotation(app, capture, count, args):
+    """Benchmark AnnotationWindow rendering, drawing, saving and copying."""
+    from annotation_window import AnnotationWindow, AnnotationTool
+
+    params = {'width': capture.width(), 'height': capture.height(), 'annotations': count}
+    results = []
+
+    window = AnnotationWindow(capture)
+    window.annotations = make_annotations(count, capture.width(), capture.height())
+    window.update_image()
+    window.show()
+    app.processEvents()
+
+    results.append(summarize('annotation.update_image', measure(window.update_image, args.repeat), **params))
+    results.append(summarize('annotation.paintEvent', measure(window.canvas.repaint, args.repeat), **params))
+
+    # Interactive strokes, offset below the toolbar
+    offset = QPoint(0, window.TOOLBAR_HEIGHT)
+    points = stroke_points(capture.width(), capture.height(), args.moves)
+    for tool, name in ((AnnotationTool.PEN, 'pen'), (AnnotationTool.RECTANGLE, 'rectangle'),
+                       (AnnotationTool.PIXELATE, 'pixelate'), (AnnotationTool.BLUR, 'blur')):
+        window.set_tool(tool)
+        samples = drag_stream(app, window, points, offset)
+        results.append(summarize(f'annotation.mouseMoveEvent.{name}', samples, **params))
+
+    # Hovering with the select tool hit-tests the annotations under the cursor
+    window.set_tool(AnnotationTool.SELECT)
+    samples = []
+    for point in points:
+        start = time.perf_counter()
+        app.sendEvent(window, mouse_event(QEvent.MouseMove, point + offset))
+        app.processEvents()
+        samples.append(time.perf_counter() - start)
+    results.append(summarize('annotation.mouseMoveEvent.hover', samples, **params))
+
+    # The hit test alone, without event dispatch and repaints
+    samples = []
+    for point in points:
+        start = time.perf_counter()
+        window.annotation_at(QPointF(point))
+        samples.append(time.perf_counter() - start)
+    results.append(summarize('annotation.annotation_at', samples, **params))
+
+    window.close()
+    window.deleteLater()
+    app.processEvents()
+    return results
+
+
+def bench_draw_annotation(capture, args):
+    """Benchmark draw_annotation for each tool type on the given capture size."""
+    from annotation_window import AnnotationWindow, AnnotationTool
+
+    params = {'width': capture.width(), 'height': capture.height()}
+    results = []
+    window = AnnotationWindow(capture)
+    target = QPixmap(capture)
+    rng = random.Random(1)
+
+    for tool, name in ((AnnotationTool.PEN, 'pen'), (AnnotationTool.TEXT, 'text'),
+                       (AnnotationTool.ARROW, 'arrow'), (AnnotationTool.RECTANGLE, 'rectangle'),
+                       (AnnotationTool.ELLIPSE, 'ellipse'), (AnnotationTool.PIXELATE, 'pixelate'),
+                       (AnnotationTool.BLUR, 'blur')):
+        annotation = make_annotation(tool, capture.width(), capture.height(), rng)
+        painter = QPainter(target)
+        painter.setRenderHint(QPainter.Antialiasing)
+        samples = measure(lambda: window.draw_annotation(painter, annotation), args.repeat)
+        painter.end()
+        results.append(summarize(f'annotation.draw_annotation.{name}', samples, **params))
+
+    window.close()
+    window.deleteLater()
+    return results
+
+
+def bench_export(app, capture, args):
+    """Benchmark save encoding and clipboard export."""
+    from annotation_window import AnnotationWindow
+
+    params = {'width': capture.width(), 'height': capture.height()}
+    results = []
+    window = AnnotationWindow(capture)
+    image = window.rendered_pixmap().toImage()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for extension in ('png', 'jpg'):
+            file_path = os.path.join(tmp_dir, f'bench.{extension}')
+            samples = measure(lambda: save_image_file(image, file_path), args.save_repeat)
+            results.append(summarize(f'annotation.save_image.{extension}', samples, **params))
+
+        # Each encoder preset on its own, then all at once and the auto choice
+        for name, preset in PRESETS.items():
+            samples = measure(lambda: preset.encode(image), args.save_repeat)
+            results.append(summarize(f'annotation.encode.{name}', samples, bytes=len(preset.encode(image)),
+                                     **params))
+        results.append(summarize('annotation.encode_all', measure(lambda: encode_all(image), args.save_repeat),
+                                 **params))
+        samples = measure(lambda: encode_auto(image), args.save_repeat)
+        results.append(summarize('annotation.encode_auto', samples, bytes=encode_auto(image).size, **params))
+
+        # Time the GUI thread is blocked when handing a save to the worker pool
+        file_path = os.path.join(tmp_dir, 'bench_async.png')
+        futures = []
+        samples = measure(lambda: futures.append(window.saver.save(window.rendered_pixmap().toImage(),
+                                                                   file_path)),
+                          args.save_repeat)
+        for future in futures:
+            future.result()
+        app.processEvents()
+        results.append(summarize('annotation.save_image.submit', samples, **params))
+
+    def copy():
+        window.copy_to_clipboard()
+        app.processEvents()
+
+    results.append(summarize('annotation.copy_to_clipboard', measure(copy, args.save_repeat), **params))
+
+    window.close()
+    window.deleteLater()
+    return results
+
+
+def bench_pan(app, args, width=1920, height=20000):
+    """Benchmark panning and zooming the annotation view of a very tall capture."""
+    from annotation_window import AnnotationWindow
+
+    params = {'width': width, 'height': height}
+    results = []
+    window = AnnotationWindow(make_capture(width, height))
+    window.show()
+    app.processEvents()
+    canvas = window.canvas
+
+    for zoom in (1.0, 0.5, 0.25):
+        # First paint at a zoom builds the pyramid levels it needs
+        def zoom_to(zoom=zoom):
+            canvas.set_zoom(zoom, QPoint(0, 0))
+            canvas.repaint()
+
+        results.append(summarize(f'annotation.zoom.{zoom:.0%}', measure(zoom_to, 1), **params))
+        canvas.pan_by(QPoint(0, -canvas.scroll_pos.y()))
+
+        def pan():
+            canvas.pan_by(QPoint(0, 120))  # One wheel notch
+            canvas.repaint()
+
+        results.append(summarize(f'annotation.pan.{zoom:.0%}', measure(pan, args.moves), **params))
+
+    window.close()
+    window.deleteLater()
+    app.processEvents()
+    return results
+
+
+def import_profile(argv):
+    """Run main.py with argv under -X importtime.
+
+    Returns (seconds spent importing, names of the modules imported, the
+    completed process). Interpreter start-up imports are included.
+    """
+    main_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+    process = subprocess.run([sys.executable, '-X', 'importtime', main_path, *argv],
+                             capture_output=True, text=True)
+    total_us = 0
+    modules = set()
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or line.endswith('imported package'):
+            continue
+        _, cumulative, name = line.split('|')
+        modules.add(name.strip())
+        if not name[1:].startswith(' '):  # Top level; nested imports are indented
+            total_us += int(cumulative)
+    return total_us / 1e6, modules, process
+
+
+def bench_cli(args):
+    """Benchmark the start-up of a command-line capture."""
+    params = {'width': 640, 'height': 480}
+    import_samples = []
+    total_samples = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        argv = ['capture', '--region', '0,0,640,480', '--out', os.path.join(tmp_dir, 'cli.png')]
+        for _ in range(max(1, args.save_repeat)):
+            start = time.perf_counter()
+            import_seconds, _, _ = import_profile(argv)
+            total_samples.append(time.perf_counter() - start)
+            import_samples.append(import_seconds)
+    return [summarize('cli.capture.imports', import_samples, **params),
+            summarize('cli.capture.process', total_samples, **params)]
+
+
+def parse_sizes(text):
+    """Parse '1920x1080,3840x2160' into a list of (width, height) tuples."""
+    sizes = []
+    for item in text.split(','):
+        width, height = item.lower().split('x')
+        sizes.append((int(width), int(height)))
+    return sizes
+
+
+def print_results(results, baseline=None):
+    """Print a results table, with the change in p50 against a baseline if given."""
+    previous = {}
+    for record in (baseline or {}).get('results', []):
+        previous[result_key(record)] = record
+
+    print(f"{'benchmark':<40}{'size':>12}{'annot':>7}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}"
+          + (f"{'vs base':>10}" if baseline else ''))
+    for record in results:
+        size = f"{record['width']}x{record['height']}"
+        line = (f"{record['benchmark']:<40}{size:>12}{record.get('annotations', ''):>7}"
+                f"{record['p50_ms']:>10.3f}{record['p90_ms']:>10.3f}{record['p99_ms']:>10.3f}")
+        base = previous.get(result_key(record))
+        if base and base['p50_ms'] > 0:
+            line += f"{record['p50_ms'] / base['p50_ms']:>9.2f}x"
+        print(line)
+
+
+def check_budgets(results):
+    """Return a description of every result that exceeds its entry in BUDGETS."""
+    failures = []
+    for record in results:
+        budget = BUDGETS.get(record['benchmark'])
+        if budget is None:
+            continue
+        statistic, limit = budget
+        if record[statistic] > limit:
+            failures.append(f"{record['benchmark']} at {record['width']}x{record['height']}: "
+                            f"{statistic} {record[statistic]:.2f}, budget {limit:g}")
+    return failures
+
+
+def result_key(record):
+    """Return the key identifying a benchmark configuration across runs."""
+    return (record['benchmark'], record['width'], record['height'], record.get('annotations'))
+
+
+def main(argv=None):
+    """Run the benchmark sweep."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default=DEFAULT_SIZES,
+                        help=f'comma-separated capture sizes (default: {DEFAULT_SIZES})')
+    parser.add_argument('--counts', default=DEFAULT_COUNTS,
+                        help=f'comma-separated annotation counts (default: {DEFAULT_COUNTS})')
+    parser.add_argument('--repeat', type=int, default=20, help='samples per render benchmark')
+    parser.add_argument('--save-repeat', type=int, default=3, help='samples per export benchmark')
+    parser.add_argument('--moves', type=int, default=100, help='mouse moves per drag stream')
+    parser.add_argument('--out', help='write JSON results to this file')
+    parser.add_argument('--compare', help='baseline JSON results to compare against')
+    args = parser.parse_args(argv)
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    sizes = parse_sizes(args.sizes)
+    counts = [int(count) for count in args.counts.split(',')]
+
+    results = bench_cli(args)
+    results.extend(bench_pan(app, args))
+    for width, height in sizes:
+        capture = make_capture(width, height)
+        results.extend(bench_overlay(app, capture, args))
+        results.extend(bench_draw_annotation(capture, args))
+        for count in counts:
+            results.extend(bench_annotation(app, capture, count, args))
+        results.extend(bench_export(app, capture, args))
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'qt': QT_VERSION_STR,
+            'pyqt': PYQT_VERSION_STR,
+            'platform': platform.platform(),
+            'qpa_platform': QApplication.platformName(),
+        },
+        'results': results,
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.out}")
+
+    failures = check_budgets(results)
+    if failures:
+        print("\nOver budget:")
+        for failure in failures:
+            print(f"  {failure}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
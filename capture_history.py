@@ -0,0 +1,333 @@
+"""
+Persistent history of past captures.
+
+Captures are stored content-addressed: each image is written once under the
+hash of its pixels, so capturing the same region repeatedly adds an index
+entry but no new image file. The index is a ring buffer capped by entry
+count and age; images no longer referenced by any entry are deleted.
+
+Hashing, encoding, thumbnailing and pruning all run on a single worker
+thread, which serializes every change to the history directory.
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5.QtWidgets import QListView, QAbstractItemView
+from PyQt5.QtCore import (Qt, QObject, QSize, QAbstractListModel, QModelIndex,
+                          QStandardPaths, pyqtSignal)
+from PyQt5.QtGui import QImage, QPixmap
+
+from image_saver import encode_image, write_atomic
+
+logger = logging.getLogger(__name__)
+
+# Version of the history index format
+INDEX_VERSION = 1
+
+
+def default_directory():
+    """Return the per-user directory the history is kept in."""
+    base = QStandardPaths.writableLocation(QStandardPaths.GenericDataLocation)
+    if not base:
+        base = os.path.expanduser('~')
+    return os.path.join(base, 'screencapture', 'history')
+
+
+def image_digest(image):
+    """Return a hex digest identifying an image's size, format and pixels."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{image.width()}x{image.height()}:{int(image.format())}".encode('ascii'))
+    bits = image.constBits()
+    bits.setsize(image.sizeInBytes())
+    digest.update(memoryview(bits))
+    return digest.hexdigest()
+
+
+class HistoryEntry:
+    """One capture in the history; several entries may share an image."""
+
+    __slots__ = ('digest', 'timestamp', 'width', 'height', 'device_pixel_ratio', 'position')
+
+    def __init__(self, digest, timestamp, width, height, device_pixel_ratio=1.0, position=None):
+        self.digest = digest
+        self.timestamp = timestamp  # time.time() of the capture
+        self.width = width  # In device pixels
+        self.height = height
+        self.device_pixel_ratio = device_pixel_ratio
+        self.position = position  # (x, y) on the virtual desktop, or None
+
+    def to_dict(self):
+        return {
+            'digest': self.digest,
+            'timestamp': self.timestamp,
+            'width': self.width,
+            'height': self.height,
+            'device_pixel_ratio': self.device_pixel_ratio,
+            'position': list(self.position) if self.position is not None else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        position = data.get('position')
+        return cls(data['digest'], float(data['timestamp']), int(data['width']), int(data['height']),
+                   float(data.get('device_pixel_ratio', 1.0)),
+                   tuple(position) if position is not None else None)
+
+
+class CaptureHistory(QObject):
+    """Content-addressed ring buffer of captures on disk.
+
+    add() returns immediately; the changed signal is emitted (queued to the
+    GUI thread) once the capture has been stored and the index rewritten.
+    """
+
+    changed = pyqtSignal()
+
+    DEFAULT_MAX_ENTRIES = 500
+    DEFAULT_MAX_AGE_DAYS = 30
+    THUMBNAIL_SIZE = QSize(160, 120)
+
+    def __init__(self, directory=None, max_entries=DEFAULT_MAX_ENTRIES,
+                 max_age_days=DEFAULT_MAX_AGE_DAYS, parent=None):
+        super().__init__(parent)
+        self.directory = directory or default_directory()
+        self.max_entries = max_entries
+        self.max_age = max_age_days * 86400 if max_age_days else None
+        self.images_dir = os.path.join(self.directory, 'images')
+        self.thumbnails_dir = os.path.join(self.directory, 'thumbnails')
+        self.index_path = os.path.join(self.directory, 'index.json')
+
+        self._lock = threading.Lock()  # Guards _entries, read from the GUI thread
+        self._entries = self.read_index()  # Oldest first
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='capture-history')
+        self._executor.submit(self._guarded, self._prune_and_write)
+
+    def read_index(self):
+        """Load the entries recorded in the index file."""
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') != INDEX_VERSION:
+                raise ValueError(f"unsupported index version {data.get('version')!r}")
+            return [HistoryEntry.from_dict(entry) for entry in data['entries']]
+        except FileNotFoundError:
+            return []
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Ignoring unreadable capture history index {self.index_path}: {e}")
+            return []
+
+    def entries(self):
+        """Return a snapshot of the entries, oldest first."""
+        with self._lock:
+            return list(self._entries)
+
+    def image_path(self, digest):
+        return os.path.join(self.images_dir, digest + '.png')
+
+    def thumbnail_path(self, digest):
+        return os.path.join(self.thumbnails_dir, digest + '.png')
+
+    def add(self, pixmap, position=None):
+        """Queue a capture to be stored and return its Future.
+
+        The pixmap is converted to a QImage here, on the GUI thread; the
+        image is implicitly shared, so this does not copy the pixels.
+        """
+        timestamp = time.time()
+        image = pixmap.toImage()
+        ratio = pixmap.devicePixelRatio()
+        if position is not None:
+            position = (position.x(), position.y())
+        return self._executor.submit(self._guarded, self._store, image, ratio, position, timestamp)
+
+    def load(self, entry):
+        """Load an entry's capture as a QPixmap, or return None if it is missing."""
+        pixmap = QPixmap(self.image_path(entry.digest))
+        if pixmap.isNull():
+            return None
+        pixmap.setDevicePixelRatio(entry.device_pixel_ratio)
+        return pixmap
+
+    def flush(self):
+        """Wait for every queued change to be written (for tests and shutdown)."""
+        self._executor.submit(lambda: None).result()
+
+    def _guarded(self, func, *args):
+        """Run a job on the worker, logging instead of losing its exception."""
+        try:
+            func(*args)
+        except Exception as e:
+            logger.error(f"Capture history error: {e}", exc_info=True)
+
+    def _store(self, image, ratio, position, timestamp):
+        """Store one capture (runs on the worker thread)."""
+        digest = image_digest(image)
+        image_path = self.image_path(digest)
+        if not os.path.exists(image_path):
+            os.makedirs(self.images_dir, exist_ok=True)
+            write_atomic(encode_image(image, 'PNG'), image_path)
+        else:
+            logger.debug(f"Capture {digest} already in history, not stored again")
+
+        thumbnail_path = self.thumbnail_path(digest)
+        if not os.path.exists(thumbnail_path):
+            os.makedirs(self.thumbnails_dir, exist_ok=True)
+            thumbnail = image.scaled(self.THUMBNAIL_SIZE, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+            write_atomic(encode_image(thumbnail, 'PNG'), thumbnail_path)
+
+        entry = HistoryEntry(digest, timestamp, image.width(), image.height(), ratio, position)
+        with self._lock:
+            self._entries.append(entry)
+        self._prune_and_write()
+
+    def _prune_and_write(self):
+        """Drop entries over the caps, delete unreferenced files and rewrite the index."""
+        with self._lock:
+            entries = self._entries
+            if self.max_age is not None:
+                cutoff = time.time() - self.max_age
+                entries = [entry for entry in entries if entry.timestamp >= cutoff]
+            if self.max_entries and len(entries) > self.max_entries:
+                entries = entries[-self.max_entries:]
+            removed = {entry.digest for entry in self._entries} - {entry.digest for entry in entries}
+            self._entries = entries
+            data = {'version': INDEX_VERSION, 'entries': [entry.to_dict() for entry in entries]}
+
+        for digest in removed:
+            for path in (self.image_path(digest), self.thumbnail_path(digest)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+        if os.path.isdir(self.directory) or entries:
+            os.makedirs(self.directory, exist_ok=True)
+            write_atomic(json.dumps(data).encode('utf-8'), self.index_path)
+
+        try:
+            self.changed.emit()
+        except RuntimeError:
+            pass  # History deleted while the job ran
+
+
+class ThumbnailLoader(QObject):
+    """Reads thumbnail files on a worker thread."""
+
+    loaded = pyqtSignal(str, QImage)  # digest, thumbnail (null if unreadable)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='thumbnail-loader')
+
+    def request(self, digest, path):
+        self._executor.submit(self._load, digest, path)
+
+    def _load(self, digest, path):
+        try:
+            self.loaded.emit(digest, QImage(path))
+        except RuntimeError:
+            pass
+
+
+class HistoryModel(QAbstractListModel):
+    """List model over the history, newest first.
+
+    Thumbnails are only loaded when the view asks for them, which it does
+    for visible rows only, and the most recently used ones are cached.
+    """
+
+    EntryRole = Qt.UserRole
+    THUMBNAIL_CACHE = 256
+
+    def __init__(self, history, parent=None):
+        super().__init__(parent)
+        self.history = history
+        self.entries = history.entries()[::-1]
+        self.thumbnails = OrderedDict()  # digest -> QPixmap, least recently used first
+        self.pending = set()  # Digests being loaded
+        self.loader = ThumbnailLoader(self)
+        self.loader.loaded.connect(self.on_thumbnail_loaded)
+        history.changed.connect(self.reload)
+
+    def reload(self):
+        """Pick up entries added or pruned since the model was built."""
+        self.beginResetModel()
+        self.entries = self.history.entries()[::-1]
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.entries)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+
+        entry = self.entries[index.row()]
+        if role == Qt.DisplayRole:
+            return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry.timestamp))
+        if role == Qt.ToolTipRole:
+            return f"{entry.width} x {entry.height}"
+        if role == Qt.DecorationRole:
+            return self.thumbnail(entry.digest)
+        if role == self.EntryRole:
+            return entry
+        return None
+
+    def thumbnail(self, digest):
+        """Return the cached thumbnail, requesting it in the background if needed."""
+        pixmap = self.thumbnails.get(digest)
+        if pixmap is not None:
+            self.thumbnails.move_to_end(digest)
+            return pixmap
+
+        if digest not in self.pending:
+            self.pending.add(digest)
+            self.loader.request(digest, self.history.thumbnail_path(digest))
+        return None
+
+    def on_thumbnail_loaded(self, digest, image):
+        """Cache a loaded thumbnail and repaint the rows showing it."""
+        self.pending.discard(digest)
+        if image.isNull():
+            return
+
+        self.thumbnails[digest] = QPixmap.fromImage(image)
+        while len(self.thumbnails) > self.THUMBNAIL_CACHE:
+            self.thumbnails.popitem(last=False)
+
+        for row, entry in enumerate(self.entries):
+            if entry.digest == digest:
+                index = self.index(row)
+                self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+
+class HistoryBrowser(QListView):
+    """Grid of past captures; activating one emits entry_activated."""
+
+    entry_activated = pyqtSignal(object)  # HistoryEntry
+
+    def __init__(self, history, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Capture History")
+        self.setViewMode(QListView.IconMode)
+        self.setResizeMode(QListView.Adjust)
+        self.setMovement(QListView.Static)
+        self.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.setIconSize(CaptureHistory.THUMBNAIL_SIZE)
+        self.setGridSize(CaptureHistory.THUMBNAIL_SIZE + QSize(24, 32))
+        # Every cell is the same size, so layout never asks for each row's data
+        self.setUniformItemSizes(True)
+        self.setLayoutMode(QListView.Batched)
+        self.resize(760, 520)
+
+        self.setModel(HistoryModel(history, self))
+        self.activated.connect(self.on_activated)
+
+    def on_activated(self, index):
+        self.entry_activated.emit(index.data(HistoryModel.EntryRole))
@@ -0,0 +1,124 @@
+"""
+Capture request scheduling.
+
+Every way of starting a capture goes through one CaptureScheduler, which
+allows a single capture at a time: requests arriving while one is in
+progress, or in a burst such as key repeat, are dropped rather than
+starting overlapping grabs. Delayed and timed captures wait in a queue
+served by a single timer.
+"""
+
+import time
+import heapq
+import logging
+from PyQt5.QtCore import Qt, QObject, QTimer, pyqtSignal
+
+logger = logging.getLogger(__name__)
+
+
+class CaptureScheduler(QObject):
+    """Serializes capture requests and runs delayed captures.
+
+    request() may be called from any thread. triggered is emitted on the
+    GUI thread with the perf_counter() time the capture was requested and
+    the mode it was requested with; the receiver must call finish() once
+    that capture is over. A dropped request leaves no trace, so state that
+    only applies to one capture belongs in its mode.
+    """
+
+    triggered = pyqtSignal(float, object)  # Requested at, mode (None for a plain capture)
+    _requested = pyqtSignal(float, object)  # Carries requests from other threads
+
+    DEBOUNCE_SECONDS = 0.3  # Requests closer than this to the previous one are repeats
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.busy = False  # Whether a capture is in progress
+        self.last_request = None  # perf_counter() of the last immediate request
+        self.pending = []  # Heap of (due, sequence) in time.monotonic() seconds
+        self.sequence = 0
+        self.dropped = 0
+        self.fired = 0
+
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.run_due)
+
+        self._requested.connect(self.on_requested, Qt.QueuedConnection)
+
+    def request(self, mode=None):
+        """Ask for a capture now (thread-safe), optionally in a mode the receiver defines."""
+        self._requested.emit(time.perf_counter(), mode)
+
+    def on_requested(self, requested_at, mode):
+        """Start a requested capture unless it repeats or overlaps another."""
+        previous = self.last_request
+        self.last_request = requested_at
+        if previous is not None and requested_at - previous < self.DEBOUNCE_SECONDS:
+            self.drop("repeated request")
+            return
+        if self.busy:
+            self.drop("capture already in progress")
+            return
+        self.fire(requested_at, mode)
+
+    def schedule(self, delay):
+        """Queue a capture to start after delay seconds."""
+        self.schedule_at(time.monotonic() + delay)
+
+    def schedule_at(self, due):
+        """Queue a capture to start at time.monotonic() time due."""
+        heapq.heappush(self.pending, (due, self.sequence))
+        self.sequence += 1
+        logger.info(f"Capture scheduled in {max(0.0, due - time.monotonic()):.1f} s "
+                    f"({len(self.pending)} pending)")
+        self.arm()
+
+    def cancel_pending(self):
+        """Forget every queued capture."""
+        self.pending = []
+        self.timer.stop()
+
+    def arm(self):
+        """Set the timer for the earliest queued capture."""
+        if not self.pending or self.busy:
+            self.timer.stop()
+            return
+        delay = max(0.0, self.pending[0][0] - time.monotonic())
+        self.timer.start(int(delay * 1000))
+
+    def run_due(self):
+        """Start the earliest queued capture if it is due."""
+        if self.busy or not self.pending:
+            return
+        if self.pending[0][0] > time.monotonic():
+            self.arm()  # Woke early
+            return
+        heapq.heappop(self.pending)
+        self.fire(time.perf_counter())
+
+    def fire(self, requested_at, mode=None):
+        self.busy = True
+        self.fired += 1
+        self.timer.stop()
+        self.triggered.emit(requested_at, mode)
+
+    def finish(self):
+        """Mark the current capture as over so the next one can start."""
+        if not self.busy:
+            return
+        self.busy = False
+        self.arm()
+
+    def drop(self, reason):
+        self.dropped += 1
+        logger.debug(f"Capture request dropped: {reason}")
+
+    def stats(self):
+        """Return a dict describing the queue."""
+        return {
+            'busy': self.busy,
+            'queue_depth': len(self.pending),
+            'dropped': self.dropped,
+            'fired': self.fired,
+        }
@@ -0,0 +1,151 @@
+"""
+Command-line interface.
+
+    python main.py capture --region 0,0,800,600 --out shot.webp
+    python main.py capture --out - > shot.png
+    python main.py capture
+    python main.py pin-file shot.png
+
+A capture with --out runs here, without the tray icon, selection overlay or
+global hotkeys. The other commands are sent to the running tray
+application (see instance.py), which is started first if there is none.
+Startup cost dominates scripted use, so this module imports nothing from
+Qt at load time, and each command imports only the modules it needs:
+capturing uses QtCore and QtGui, forwarding QtCore and QtNetwork, never
+QtWidgets, keyboard, NumPy or the annotation code. test_tool.py checks
+which modules a capture imports, and benchmark.py checks their import time
+against IMPORT_BUDGET_MS.
+"""
+
+import os
+import sys
+import argparse
+
+# Milliseconds of module imports allowed for `main.py capture`, interpreter start-up included
+IMPORT_BUDGET_MS = 150
+
+FORMATS = ('png', 'jpg', 'webp', 'bmp')
+
+# Modules a capture must not import, to keep start-up fast
+HEAVY_MODULES = ('PyQt5.QtWidgets', 'keyboard', 'numpy', 'PIL', 'annotation_window', 'screen_capture')
+
+_app = None  # QGuiApplication of a command-line capture, kept alive until exit
+
+
+def parse_region(text):
+    """Parse 'x,y,w,h' into a tuple of ints, for argparse."""
+    try:
+        x, y, width, height = (int(value) for value in text.split(','))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected x,y,w,h, got {text!r}")
+    if width <= 0 or height <= 0:
+        raise argparse.ArgumentTypeError(f"region must have a positive size, got {text!r}")
+    return x, y, width, height
+
+
+def output_format(out, fmt=None):
+    """Return the Qt image format for an output path ('-' for stdout) and optional --format."""
+    from image_saver import image_format
+    if fmt is None:
+        fmt = 'png' if out == '-' else os.path.splitext(out)[1].lstrip('.').lower()
+    if fmt not in FORMATS + ('jpeg',):
+        raise ValueError(f"unsupported image format {fmt!r}; use one of {', '.join(FORMATS)}")
+    return image_format(f'capture.{fmt}')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='main.py', description="Screen capture tool. Run without a command to start the tray app.")
+    commands = parser.add_subparsers(dest='command', required=True, metavar='command')
+
+    capture = commands.add_parser(
+        'capture', help="select a region to capture, or with --out capture straight to a file")
+    capture.add_argument('--region', type=parse_region, metavar='X,Y,W,H',
+                         help="virtual-desktop rectangle in logical pixels (default: every screen)")
+    capture.add_argument('--out', metavar='FILE',
+                         help="output file, or - for stdout; without it the tray application "
+                              "opens the selection overlay")
+    capture.add_argument('--format', choices=FORMATS,
+                         help="image format (default: from the --out extension, else png)")
+    capture.add_argument('--quality', type=int, default=-1, metavar='0-100',
+                         help="quality for lossy formats (default: the encoder's)")
+    capture.set_defaults(run=capture_command)
+
+    pin = commands.add_parser('pin-file', help="pin an image or session file on screen")
+    pin.add_argument('files', nargs='+', metavar='FILE')
+    pin.set_defaults(run=forward_command)
+
+    history = commands.add_parser('open-history', help="open the capture history")
+    history.set_defaults(run=forward_command)
+
+    quit_parser = commands.add_parser('quit', help="quit the running tray application")
+    quit_parser.set_defaults(run=forward_command)
+    return parser
+
+
+def main(argv=None):
+    """Run a command and return the process exit code."""
+    args = build_parser().parse_args(argv)
+    return args.run(args)
+
+
+def forward_command(args):
+    """Send a command to the running tray application, starting it if needed."""
+    from instance import send_command
+
+    command_args = [os.path.abspath(path) for path in getattr(args, 'files', [])]
+    reply = send_command(args.command, command_args)
+    if reply is None:
+        if args.command == 'quit':
+            print("main.py quit: not running", file=sys.stderr)
+            return 0
+        from main import run_gui
+        return run_gui([(args.command, command_args)])
+
+    if not reply.get('ok'):
+        print(f"main.py {args.command}: {reply.get('error')}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def capture_command(args):
+    """Grab a region and write it out, or with no --out ask the tray application
+    for an interactive capture; returns the exit code.
+    """
+    if args.out is None:
+        if args.region or args.format or args.quality != -1:
+            print("main.py capture: --region, --format and --quality need --out", file=sys.stderr)
+            return 2
+        return forward_command(args)
+
+    from PyQt5.QtCore import QRect
+    from PyQt5.QtGui import QGuiApplication
+    from image_saver import encode_image, write_atomic
+    from screen_grab import grab_region, virtual_geometry
+
+    try:
+        fmt = output_format(args.out, args.format)
+    except ValueError as e:
+        print(f"main.py capture: {e}", file=sys.stderr)
+        return 2
+
+    global _app
+    _app = QGuiApplication.instance() or QGuiApplication(sys.argv[:1])
+    region = QRect(*args.region) if args.region else virtual_geometry()
+    pixmap = grab_region(region)
+    if pixmap is None:
+        print(f"main.py capture: could not capture {region.x()},{region.y()},"
+              f"{region.width()},{region.height()}", file=sys.stderr)
+        return 1
+
+    try:
+        data = encode_image(pixmap.toImage(), fmt, args.quality)
+        if args.out == '-':
+            sys.stdout.buffer.write(data)
+            sys.stdout.buffer.flush()
+        else:
+            write_atomic(data, os.path.abspath(args.out))
+    except (ValueError, OSError) as e:
+        print(f"main.py capture: {e}", file=sys.stderr)
+        return 1
+    return 0
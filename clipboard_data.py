@@ -0,0 +1,131 @@
+"""
+Deferred clipboard export.
+
+Copying hands the clipboard a QMimeData that only advertises its formats.
+An image format is encoded the first time another application asks for it,
+and the result is kept for as long as the clipboard holds this data. A file
+exported for a file-URI request is deleted once the clipboard changes owner.
+"""
+
+import os
+import atexit
+import shutil
+import logging
+import tempfile
+from PyQt5.QtCore import QMimeData, QByteArray, QUrl
+from PyQt5.QtGui import QGuiApplication
+
+from image_saver import encode_image, write_atomic
+
+logger = logging.getLogger(__name__)
+
+QT_IMAGE_MIME_TYPE = 'application/x-qt-image'
+URI_LIST_MIME_TYPE = 'text/uri-list'
+
+# MIME type -> Qt image format name
+IMAGE_MIME_TYPES = {
+    'image/png': 'PNG',
+    'image/jpeg': 'JPEG',
+    'image/bmp': 'BMP',
+}
+
+_export_dir = None  # Created on first file-URI request, removed at exit
+_exported_files = set()  # Paths written for clipboard data, until the clipboard changes
+_watching_clipboard = False
+
+
+def export_directory():
+    """Return the directory files offered by URI are written to."""
+    global _export_dir
+    if _export_dir is None:
+        _export_dir = tempfile.mkdtemp(prefix='screencapture-clipboard-')
+        atexit.register(shutil.rmtree, _export_dir, True)
+    return _export_dir
+
+
+def remove_stale_exports():
+    """Delete the exported files of clipboard data the clipboard no longer holds."""
+    current = QGuiApplication.clipboard().mimeData()
+    keep = current.file_path if isinstance(current, LazyImageMimeData) else None
+    for file_path in _exported_files - {keep}:
+        _exported_files.discard(file_path)
+        try:
+            os.remove(file_path)
+        except OSError as e:
+            logger.warning(f"Could not remove clipboard export {file_path}: {e}")
+
+
+def watch_clipboard():
+    """Remove stale exports whenever the clipboard changes, including to another application."""
+    global _watching_clipboard
+    if not _watching_clipboard:
+        # Qt deletes the replaced data before it signals, so the data cannot clean up after itself
+        QGuiApplication.clipboard().dataChanged.connect(remove_stale_exports)
+        _watching_clipboard = True
+
+
+class LazyImageMimeData(QMimeData):
+    """Clipboard data for an image, encoded per format on first request.
+
+    The QImage is implicitly shared, so holding it costs nothing until the
+    window it came from paints again.
+    """
+
+    JPEG_QUALITY = 90
+
+    def __init__(self, image):
+        super().__init__()
+        self.image = image
+        self.encoded = {}  # MIME type -> QByteArray
+        self.file_path = None
+        watch_clipboard()
+
+    def formats(self):
+        return [QT_IMAGE_MIME_TYPE, *IMAGE_MIME_TYPES, URI_LIST_MIME_TYPE]
+
+    def hasFormat(self, mime_type):
+        return mime_type in self.formats()
+
+    def hasImage(self):
+        return True
+
+    def hasUrls(self):
+        return True
+
+    def retrieveData(self, mime_type, preferred_type):
+        """Return data for mime_type, encoding it now if this is the first request."""
+        if mime_type == QT_IMAGE_MIME_TYPE:
+            # Platform converters (e.g. Windows DIB) work from the QImage directly
+            return self.image
+
+        try:
+            if mime_type in IMAGE_MIME_TYPES:
+                return self.encoded_data(mime_type)
+            if mime_type == URI_LIST_MIME_TYPE:
+                return QByteArray(QUrl.fromLocalFile(self.export_file()).toEncoded() + b'\r\n')
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not provide clipboard data as {mime_type}: {e}")
+            return None
+
+        return super().retrieveData(mime_type, preferred_type)
+
+    def encoded_data(self, mime_type):
+        """Return the image encoded as mime_type, cached after the first call."""
+        data = self.encoded.get(mime_type)
+        if data is None:
+            fmt = IMAGE_MIME_TYPES[mime_type]
+            quality = self.JPEG_QUALITY if fmt == 'JPEG' else -1
+            data = QByteArray(encode_image(self.image, fmt, quality))
+            self.encoded[mime_type] = data
+            logger.debug(f"Encoded clipboard image as {mime_type} ({data.size()} bytes)")
+        return data
+
+    def export_file(self):
+        """Write the image to a PNG file once and return its path."""
+        if self.file_path is None:
+            fd, file_path = tempfile.mkstemp(dir=export_directory(), prefix='capture-', suffix='.png')
+            os.close(fd)
+            _exported_files.add(file_path)
+            write_atomic(bytes(self.encoded_data('image/png')), file_path)
+            self.file_path = file_path
+        return self.file_path
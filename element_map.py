@@ -0,0 +1,230 @@
+"""
+Element detection for snap-to-element selection.
+
+A captured frame is analysed off the GUI thread. An edge map is computed
+with vectorized NumPy gradients, then cut recursively along blank gaps and
+long border lines (an XY-cut) into nested rectangles approximating windows,
+panels, controls and text blocks. The rectangles are indexed in a uniform
+grid so the overlay can find the element under the cursor in a few
+comparisons, and their edges are kept sorted for snapping selections.
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PyQt5.QtCore import QObject, QRect, pyqtSignal
+
+from scroll_capture import image_to_array
+
+logger = logging.getLogger(__name__)
+
+EDGE_THRESHOLD = 24  # Luminance step (0-255) between neighbours that counts as an edge
+LINE_FRACTION = 0.9  # Rows or columns this full of edges are border lines
+MIN_ELEMENT_SIZE = 10  # In analysed pixels
+MAX_DEPTH = 16
+NEST_MARGIN = 3  # Boxes this close to their parent on every side are the same element
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='element-map')
+
+
+def luminance(pixels):
+    """Return the approximate luminance of 0xAARRGGBB pixels as int16."""
+    red = (pixels >> 16) & 0xFF
+    green = (pixels >> 8) & 0xFF
+    blue = pixels & 0xFF
+    return ((red * 77 + green * 150 + blue * 29) >> 8).astype(np.int16)
+
+
+def edge_map(pixels, threshold=EDGE_THRESHOLD):
+    """Return a boolean map of pixels that differ sharply from a neighbour.
+
+    Both pixels on either side of a step are marked, so a box around the
+    marked pixels sits exactly one pixel outside the boundary on every side.
+    """
+    gray = luminance(pixels)
+    edges = np.zeros(gray.shape, dtype=bool)
+    horizontal = np.abs(np.diff(gray, axis=1)) > threshold
+    edges[:, 1:] |= horizontal
+    edges[:, :-1] |= horizontal
+    vertical = np.abs(np.diff(gray, axis=0)) > threshold
+    edges[1:, :] |= vertical
+    edges[:-1, :] |= vertical
+    return edges
+
+
+def runs(mask):
+    """Return (starts, ends) of the runs of True in a 1-D boolean array."""
+    padded = np.concatenate(([False], mask, [False]))
+    changes = np.flatnonzero(padded[1:] != padded[:-1])
+    return changes[0::2], changes[1::2]
+
+
+def find_elements(edges, min_size=MIN_ELEMENT_SIZE, max_depth=MAX_DEPTH):
+    """Cut an edge map into nested element rectangles.
+
+    Returns an (n, 4) int array of (left, top, right, bottom), right and
+    bottom exclusive, each tightened to the boundaries it contains.
+    """
+    height, width = edges.shape
+    found = set()
+    stack = [(0, height, 0, width, 0, None)]
+    while stack:
+        y0, y1, x0, x1, depth, parent = stack.pop()
+        block = edges[y0:y1, x0:x1]
+        rows = np.count_nonzero(block, axis=1)
+        filled_rows = np.flatnonzero(rows)
+        if not len(filled_rows):
+            continue
+        columns = np.count_nonzero(block, axis=0)
+        filled_columns = np.flatnonzero(columns)
+
+        # Tighten to the edges inside the block
+        top, bottom = filled_rows[0], filled_rows[-1] + 1
+        left, right = filled_columns[0], filled_columns[-1] + 1
+        if bottom - top < min_size or right - left < min_size:
+            continue
+        rect = (x0 + left, y0 + top, x0 + right, y0 + bottom)
+        if rect in found:
+            continue
+        # The inside of a border, with nothing else in it, is not an element of its own
+        if parent is None or max(abs(a - b) for a, b in zip(rect, parent)) > NEST_MARGIN:
+            found.add(rect)
+        if depth >= max_depth:
+            continue
+
+        # Split across blank gaps and border lines, rows first, then columns
+        for profile, span, horizontal in ((rows[top:bottom], right - left, True),
+                                          (columns[left:right], bottom - top, False)):
+            separator = (profile == 0) | (profile >= LINE_FRACTION * span)
+            starts, ends = runs(~separator)
+            if len(starts) == 1 and ends[0] - starts[0] == len(profile):
+                continue  # Nothing to cut along this axis
+            for start, end in zip(starts, ends):
+                if horizontal:
+                    stack.append((rect[1] + start, rect[1] + end, rect[0], rect[2], depth + 1, rect))
+                else:
+                    stack.append((rect[1], rect[3], rect[0] + start, rect[0] + end, depth + 1, rect))
+            break
+
+    if not found:
+        return np.zeros((0, 4), dtype=np.int32)
+
+    # Step inside the one-pixel margin edge_map() leaves, except at the image border
+    rects = np.array(sorted(found), dtype=np.int32)
+    rects[:, 0] += rects[:, 0] > 0
+    rects[:, 1] += rects[:, 1] > 0
+    rects[:, 2] -= rects[:, 2] < width
+    rects[:, 3] -= rects[:, 3] < height
+    return rects
+
+
+class ElementMap:
+    """Element rectangles in logical overlay coordinates, with a grid index."""
+
+    CELL_SIZE = 64  # Logical pixels per grid cell
+
+    def __init__(self, rects):
+        """rects is an (n, 4) array of (left, top, right, bottom), right and bottom exclusive."""
+        areas = (rects[:, 2] - rects[:, 0]) * (rects[:, 3] - rects[:, 1])
+        order = np.argsort(areas, kind='stable')
+        self.rects = rects[order]  # Smallest first, so the first hit is the innermost
+
+        # Each cell lists the rectangles overlapping it, smallest first
+        self.cells = {}
+        size = self.CELL_SIZE
+        for index, (left, top, right, bottom) in enumerate(self.rects.tolist()):
+            for cy in range(top // size, (bottom - 1) // size + 1):
+                for cx in range(left // size, (right - 1) // size + 1):
+                    self.cells.setdefault((cx, cy), []).append(index)
+
+        self.x_edges = np.unique(np.concatenate((self.rects[:, 0], self.rects[:, 2])))
+        self.y_edges = np.unique(np.concatenate((self.rects[:, 1], self.rects[:, 3])))
+
+    def __len__(self):
+        return len(self.rects)
+
+    def element_at(self, pos):
+        """Return the innermost element rectangle containing pos as a QRect, or None."""
+        x, y = pos.x(), pos.y()
+        rects = self.rects
+        for index in self.cells.get((x // self.CELL_SIZE, y // self.CELL_SIZE), ()):
+            left, top, right, bottom = rects[index]
+            if left <= x < right and top <= y < bottom:
+                return QRect(int(left), int(top), int(right - left), int(bottom - top))
+        return None
+
+    def snap(self, rect, distance):
+        """Move each edge of rect to the nearest element edge within distance."""
+        left = self.nearest(self.x_edges, rect.left(), distance)
+        right = self.nearest(self.x_edges, rect.right() + 1, distance)
+        top = self.nearest(self.y_edges, rect.top(), distance)
+        bottom = self.nearest(self.y_edges, rect.bottom() + 1, distance)
+        if right <= left or bottom <= top:
+            return rect
+        return QRect(left, top, right - left, bottom - top)
+
+    @staticmethod
+    def nearest(edges, value, distance):
+        """Return the edge closest to value if it is within distance, else value."""
+        index = int(np.searchsorted(edges, value))
+        best = value
+        best_distance = distance + 1
+        for candidate in edges[max(0, index - 1):index + 1]:
+            if abs(candidate - value) < best_distance:
+                best, best_distance = int(candidate), abs(candidate - value)
+        return best
+
+
+def build_element_map(image, ratio):
+    """Analyse a captured QImage and return its ElementMap in logical pixels.
+
+    HiDPI frames are sampled about once per logical pixel, which is all
+    selection needs and keeps the analysis fast.
+    """
+    step = max(1, int(round(ratio)))
+    pixels = image_to_array(image)[::step, ::step]
+    rects = find_elements(edge_map(pixels))
+    # Back to logical pixels: analysed index * step device pixels / ratio
+    scale = step / ratio
+    logical = np.empty_like(rects)
+    logical[:, :2] = np.floor(rects[:, :2] * scale)
+    logical[:, 2:] = np.ceil(rects[:, 2:] * scale)
+    return ElementMap(logical)
+
+
+class ElementMapBuilder(QObject):
+    """Builds element maps in the background.
+
+    ready is emitted on the GUI thread with the map and the generation
+    passed to build(), so results for an earlier capture can be ignored.
+    """
+
+    ready = pyqtSignal(object, int)  # ElementMap, generation
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.latest = None  # Generation of the most recent request
+
+    def build(self, image, ratio, generation):
+        """Queue an analysis of a QImage and return its Future.
+
+        Requests superseded by a later one before they start are skipped.
+        """
+        self.latest = generation
+        return _executor.submit(self._build, image, ratio, generation)
+
+    def _build(self, image, ratio, generation):
+        """Run one analysis (runs on the worker thread)."""
+        if generation != self.latest:
+            return None
+        try:
+            element_map = build_element_map(image, ratio)
+        except Exception as e:
+            logger.error(f"Element analysis failed: {e}", exc_info=True)
+            return None
+        logger.debug(f"Found {len(element_map)} candidate elements")
+        try:
+            self.ready.emit(element_map, generation)
+        except RuntimeError:
+            pass
+        return element_map
@@ -0,0 +1,272 @@
+"""
+Encoder presets that trade output size against encode time.
+
+A preset is one named way of encoding an image: PNG at the fastest or the
+strongest zlib level, PNG reduced to a 256-colour palette, lossless or
+lossy WebP, or JPEG at a chosen quality. Qt encodes PNG and JPEG; Pillow
+encodes the palette PNG, and WebP because Qt cannot set libwebp's effort.
+
+Encodes run on a worker pool, as many at once as there are cores for.
+encode_all() reports the size and encode time of
+every preset, encode_auto() keeps the smallest output among the presets
+that finish within a time budget, and Exporter writes one file per preset
+in the background.
+"""
+
+import io
+import os
+import math
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from PIL import Image
+from PyQt5.QtCore import QObject, pyqtSignal
+from PyQt5.QtGui import QImage
+
+from image_saver import encode_image, write_atomic
+
+logger = logging.getLogger(__name__)
+
+AUTO = 'auto'  # Preset name that saves whichever output encode_auto() picks
+AUTO_BUDGET = 1.0  # Seconds encode_auto() waits for smaller outputs
+# Lossless presets encode_auto() tries, started in this order so that with
+# few cores the one that is usually both small and quick runs first
+AUTO_PRESETS = ('webp-lossless', 'png-fast', 'png-max')
+
+_executor = ThreadPoolExecutor(max_workers=min(6, os.cpu_count() or 1), thread_name_prefix='encoder')
+
+
+def png_quality(level):
+    """Return the Qt PNG 'quality' that selects a zlib compression level (0-9)."""
+    return 100 - math.ceil(level * 91 / 9)
+
+
+def to_pil(image):
+    """Convert a QImage to an RGB or RGBA PIL image."""
+    mode = 'RGBA' if image.hasAlphaChannel() else 'RGB'
+    image = image.convertToFormat(QImage.Format_RGBA8888 if mode == 'RGBA' else QImage.Format_RGB888)
+    data = image.constBits().asstring(image.sizeInBytes())
+    return Image.frombuffer(mode, (image.width(), image.height()), data, 'raw', mode, image.bytesPerLine(), 1)
+
+
+def encode_pil(image, fmt, **options):
+    output = io.BytesIO()
+    image.save(output, fmt, **options)
+    return output.getvalue()
+
+
+def encode_png(level):
+    return lambda image, quality: encode_image(image, 'PNG', png_quality(level))
+
+
+def encode_palette_png(image, quality):
+    """Reduce to 256 colours and encode as PNG.
+
+    Not dithered, so text and UI edges stay crisp; exact for images that
+    have 256 colours or fewer, as many screenshots of plain UI do.
+    """
+    palette = to_pil(image).quantize(256, method=Image.FASTOCTREE, dither=Image.NONE)
+    return encode_pil(palette, 'PNG', compress_level=9)
+
+
+def encode_webp(image, quality):
+    """Encode as WebP, lossless when quality is None."""
+    if quality is None:
+        # Method 0 at full effort is both smaller and several times faster than
+        # the higher methods on screenshots
+        return encode_pil(to_pil(image), 'WEBP', lossless=True, method=0, quality=100)
+    return encode_pil(to_pil(image), 'WEBP', quality=quality, method=4)
+
+
+def encode_jpeg(image, quality):
+    return encode_image(image, 'JPEG', quality)
+
+
+class EncoderPreset:
+    """A named encoder and its settings.
+
+    quality is the default for presets with a quality setting (0-100) and
+    None for the others.
+    """
+
+    def __init__(self, name, label, extension, encoder, lossless=True, quality=None):
+        self.name = name
+        self.label = label
+        self.extension = extension
+        self.encoder = encoder
+        self.lossless = lossless
+        self.quality = quality
+
+    def encode(self, image, quality=None):
+        """Encode a QImage and return the bytes."""
+        return self.encoder(image, self.quality if quality is None else quality)
+
+    def file_path(self, file_path):
+        """Return file_path with this preset's extension, replacing any other."""
+        root, extension = os.path.splitext(file_path)
+        if extension.lower() in (f'.{self.extension}', '.jpeg' if self.extension == 'jpg' else None):
+            return file_path
+        return f'{root}.{self.extension}'
+
+
+PRESETS = {preset.name: preset for preset in (
+    EncoderPreset('png-fast', "PNG, fast", 'png', encode_png(1)),
+    EncoderPreset('png-max', "PNG, smallest", 'png', encode_png(9)),
+    EncoderPreset('png-palette', "PNG, 256 colours", 'png', encode_palette_png, lossless=False),
+    EncoderPreset('webp-lossless', "WebP, lossless", 'webp', encode_webp),
+    EncoderPreset('webp', "WebP", 'webp', encode_webp, lossless=False, quality=80),
+    EncoderPreset('jpeg', "JPEG", 'jpg', encode_jpeg, lossless=False, quality=85),
+)}
+
+# Save dialog filters and the preset each selects
+FILE_FILTERS = {f"{preset.label} (*.{preset.extension})": preset.name for preset in PRESETS.values()}
+FILE_FILTERS[f"Smallest lossless in {AUTO_BUDGET:g} s (*.png *.webp)"] = AUTO
+
+
+class EncodeResult:
+    """The output of one preset, or the error it failed with."""
+
+    __slots__ = ('preset', 'data', 'size', 'seconds', 'error', 'path')
+
+    def __init__(self, preset, data=None, seconds=0.0, error=None):
+        self.preset = preset
+        self.data = data  # Encoded bytes; Exporter drops them once written
+        self.size = len(data) if data is not None else None
+        self.seconds = seconds
+        self.error = error
+        self.path = None  # Set once written by Exporter
+
+    def describe(self):
+        """Return a one-line report of the size and encode time."""
+        if self.error is not None:
+            return f"{self.preset.label}: failed ({self.error})"
+        return f"{self.preset.label}: {self.size / 1024:,.0f} KB in {self.seconds * 1000:.0f} ms"
+
+
+def timed_encode(preset, image, quality=None):
+    """Encode with one preset and return an EncodeResult (runs on a worker thread)."""
+    start = time.perf_counter()
+    try:
+        data = preset.encode(image, quality)
+    except Exception as e:
+        logger.warning(f"{preset.name} encoding failed: {e}")
+        return EncodeResult(preset, error=str(e))
+    return EncodeResult(preset, data, time.perf_counter() - start)
+
+
+def resolve(names):
+    """Return the presets named, or all of them for None."""
+    if names is None:
+        return list(PRESETS.values())
+    try:
+        return [PRESETS[name] for name in names]
+    except KeyError as e:
+        raise ValueError(f"Unknown encoder preset: {e.args[0]}")
+
+
+def encode_all(image, names=None, quality=None):
+    """Encode a QImage with several presets in parallel and return their EncodeResults in order.
+
+    quality applies to the presets that have a quality setting.
+    """
+    futures = [_executor.submit(timed_encode, preset, image, quality) for preset in resolve(names)]
+    return [future.result() for future in futures]
+
+
+def encode_auto(image, budget=AUTO_BUDGET, names=AUTO_PRESETS):
+    """Return the EncodeResult of the smallest output encoded within budget seconds.
+
+    The named presets are queued at once. If none finishes in time, the
+    first to finish is used. Encodes still running then are left to finish
+    in the background and discarded.
+    """
+    presets = resolve(names)
+    futures = [_executor.submit(timed_encode, preset, image) for preset in presets]
+    done, pending = wait(futures, timeout=budget)
+    finished = [future.result() for future in done if future.result().error is None]
+    while not finished and pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        finished = [future.result() for future in done if future.result().error is None]
+    for future in pending:
+        future.cancel()
+    if not finished:
+        raise ValueError("No encoder could encode the image")
+
+    best = min(finished, key=lambda result: result.size)
+    logger.info(f"Auto encoding chose {best.describe()} ({len(finished)} of {len(presets)} presets in time)")
+    return best
+
+
+def save_with_preset(image, file_path, name, quality=None):
+    """Encode a QImage with a preset, or AUTO, and write it atomically.
+
+    Returns the path written, whose extension is made to match the format
+    (for AUTO, the format chosen).
+    """
+    if name == AUTO:
+        result = encode_auto(image)
+        preset, data = result.preset, result.data
+    else:
+        preset = resolve([name])[0]
+        data = preset.encode(image, quality)
+    file_path = preset.file_path(file_path)
+    write_atomic(data, file_path)
+    return file_path
+
+
+class Exporter(QObject):
+    """Writes an image in several formats at once and reports each file.
+
+    For a base path 'shot.png' the files are 'shot-png-fast.png',
+    'shot-webp.webp' and so on. Signals are emitted from a worker thread
+    and delivered queued to receivers on the GUI thread.
+    """
+
+    exported = pyqtSignal(str, list)  # base path, EncodeResults with their paths
+    failed = pyqtSignal(str, str)  # base path, error message
+
+    def export(self, image, base_path, names=None, quality=None):
+        """Queue encoding image with the named presets (default all) and return their Futures."""
+        root = os.path.splitext(base_path)[0]
+        futures = [_executor.submit(self._export_one, preset, image, quality,
+                                    f'{root}-{preset.name}.{preset.extension}')
+                   for preset in resolve(names)]
+        lock = threading.Lock()
+        remaining = [len(futures)]
+
+        def on_done(_):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            results = [future.result() for future in futures]
+            if all(result.error is not None for result in results):
+                self._emit(self.failed, base_path, results[0].error)
+            else:
+                self._emit(self.exported, base_path, results)
+
+        for future in futures:
+            future.add_done_callback(on_done)
+        return futures
+
+    @staticmethod
+    def _export_one(preset, image, quality, file_path):
+        """Encode and write one file (runs on a worker thread)."""
+        result = timed_encode(preset, image, quality)
+        if result.error is None:
+            try:
+                write_atomic(result.data, file_path)
+                result.path = file_path
+            except OSError as e:
+                result.error = str(e)
+            result.data = None
+        return result
+
+    @staticmethod
+    def _emit(signal, *args):
+        """Emit a signal, ignoring a receiver that was deleted while exporting."""
+        try:
+            signal.emit(*args)
+        except RuntimeError:
+            pass
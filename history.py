@@ -0,0 +1,191 @@
+"""
+Undo/redo history for annotation windows.
+
+Commands record what changed; where pixels of the flattened annotation layer
+are overwritten, only the tiles touched are kept, never the whole image.
+"""
+
+from collections import deque
+from PyQt5.QtCore import QPoint, QRect, QPointF
+from PyQt5.QtGui import QPainter
+
+
+class TileSnapshot:
+    """Copies of the pixmap tiles covering a rectangle, for restoring later."""
+
+    TILE_SIZE = 128  # In device pixels
+
+    __slots__ = ('tiles', 'nbytes')
+
+    def __init__(self, pixmap, rect):
+        """Copy the tiles of pixmap intersecting rect (in device pixels)."""
+        self.tiles = []
+        self.nbytes = 0
+
+        rect = rect.intersected(pixmap.rect())
+        if rect.isEmpty():
+            return
+
+        size = self.TILE_SIZE
+        bytes_per_pixel = max(1, pixmap.depth() // 8)
+        for ty in range(rect.top() // size, rect.bottom() // size + 1):
+            for tx in range(rect.left() // size, rect.right() // size + 1):
+                tile_rect = QRect(tx * size, ty * size, size, size).intersected(pixmap.rect())
+                self.tiles.append((tile_rect, pixmap.copy(tile_rect)))
+                self.nbytes += tile_rect.width() * tile_rect.height() * bytes_per_pixel
+
+    def restore(self, pixmap):
+        """Write the saved tiles back into pixmap."""
+        ratio = pixmap.devicePixelRatio()
+        painter = QPainter(pixmap)
+        painter.setCompositionMode(QPainter.CompositionMode_Source)
+        for tile_rect, tile in self.tiles:
+            # The painter works in logical pixels; matching ratios keep this a 1:1 blit
+            tile.setDevicePixelRatio(ratio)
+            painter.drawPixmap(QPointF(tile_rect.x() / ratio, tile_rect.y() / ratio), tile)
+        painter.end()
+
+
+class AddAnnotationCommand:
+    """Adding an annotation to the end of the list and painting it."""
+
+    __slots__ = ('annotation', 'snapshot')
+
+    def __init__(self, annotation):
+        self.annotation = annotation
+        self.snapshot = None  # Layer pixels under the annotation before it was painted
+
+    @property
+    def nbytes(self):
+        return self.snapshot.nbytes if self.snapshot else 0
+
+    def redo(self, window):
+        self.snapshot = window.paint_annotation(self.annotation, self.snapshot)
+
+    def undo(self, window):
+        window.unpaint_annotation(self.annotation, self.snapshot)
+
+
+class MoveAnnotationsCommand:
+    """Moving annotations by an offset; the layer is redrawn where they were and are."""
+
+    __slots__ = ('annotations', 'offset')
+
+    nbytes = 0  # Nothing to snapshot
+
+    def __init__(self, annotations, offset):
+        self.annotations = list(annotations)
+        self.offset = QPoint(offset)
+
+    def redo(self, window):
+        window.move_annotations(self.annotations, self.offset)
+
+    def undo(self, window):
+        window.move_annotations(self.annotations, -self.offset)
+
+
+class DeleteAnnotationsCommand:
+    """Removing annotations from anywhere in the list."""
+
+    __slots__ = ('annotations', 'removed')
+
+    nbytes = 0
+
+    def __init__(self, annotations):
+        self.annotations = list(annotations)
+        self.removed = None  # (list position, annotation) pairs, for putting them back
+
+    def redo(self, window):
+        self.removed = window.remove_annotations(self.annotations)
+
+    def undo(self, window):
+        window.insert_annotations(self.removed)
+
+
+class RestyleAnnotationsCommand:
+    """Changing the colour and/or width of annotations."""
+
+    __slots__ = ('annotations', 'color', 'width', 'previous')
+
+    nbytes = 0
+
+    def __init__(self, annotations, color=None, width=None):
+        self.annotations = list(annotations)
+        self.color = color
+        self.width = width
+        self.previous = [(annotation.color, annotation.width) for annotation in self.annotations]
+
+    def redo(self, window):
+        window.restyle_annotations(self.annotations, [
+            (self.color if self.color is not None else color, self.width if self.width is not None else width)
+            for color, width in self.previous])
+
+    def undo(self, window):
+        window.restyle_annotations(self.annotations, self.previous)
+
+
+class UndoHistory:
+    """Undo and redo stacks of commands with a memory cap.
+
+    When the commands' snapshots exceed max_bytes, the oldest undo entries
+    are evicted; their changes stay but can no longer be undone.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.undo_stack = deque()
+        self.redo_stack = []
+        self.memory_usage = 0
+        self.evicted = 0
+
+    def can_undo(self):
+        return bool(self.undo_stack)
+
+    def can_redo(self):
+        return bool(self.redo_stack)
+
+    def push(self, command, window):
+        """Apply a new command and record it, discarding anything to redo."""
+        command.redo(window)
+        for undone in self.redo_stack:
+            self.memory_usage -= undone.nbytes
+        self.redo_stack = []
+
+        self.undo_stack.append(command)
+        self.memory_usage += command.nbytes
+        self.enforce_limit()
+
+    def undo(self, window):
+        """Revert the most recent command. Returns it, or None if there is none."""
+        if not self.undo_stack:
+            return None
+
+        command = self.undo_stack.pop()
+        command.undo(window)
+        self.redo_stack.append(command)
+        return command
+
+    def redo(self, window):
+        """Re-apply the most recently undone command. Returns it, or None."""
+        if not self.redo_stack:
+            return None
+
+        command = self.redo_stack.pop()
+        self.memory_usage -= command.nbytes
+        command.redo(window)
+        self.memory_usage += command.nbytes
+        self.undo_stack.append(command)
+        return command
+
+    def clear(self):
+        """Forget every command."""
+        self.undo_stack.clear()
+        self.redo_stack = []
+        self.memory_usage = 0
+
+    def enforce_limit(self):
+        """Evict the oldest undo entries until memory is within the cap."""
+        while self.memory_usage > self.max_bytes and self.undo_stack:
+            command = self.undo_stack.popleft()
+            self.memory_usage -= command.nbytes
+            self.evicted += 1
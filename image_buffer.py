@@ -0,0 +1,61 @@
+"""
+Shared capture frames.
+
+A capture is held once, as a SharedFrame, and handed to the overlay and the
+annotation window without copying: QPixmap is implicitly shared, so every
+holder references the same pixels and Qt copies them only when one of the
+holders paints. Crops that cover the whole frame are the frame itself;
+other crops copy just their region. Releasing the frame drops the capture
+code's reference so the full-size pixels are freed as soon as nothing else
+shares them.
+"""
+
+from PyQt5.QtGui import QPixmap
+
+from annotation_window import scale_rect
+from memory_manager import pixmap_nbytes
+
+
+class SharedFrame:
+    """A captured frame of the virtual desktop that crops are taken from."""
+
+    __slots__ = ('pixmap', 'geometry')
+
+    def __init__(self, pixmap, geometry):
+        self.pixmap = pixmap
+        self.geometry = geometry  # Virtual-desktop rectangle covered, in logical pixels
+
+    @property
+    def is_released(self):
+        return self.pixmap is None
+
+    @property
+    def nbytes(self):
+        return pixmap_nbytes(self.pixmap)
+
+    def device_rect(self, rect):
+        """Map a rectangle in frame-relative logical pixels to device pixels within the frame."""
+        return scale_rect(rect, self.pixmap.devicePixelRatio()).intersected(self.pixmap.rect())
+
+    def crop(self, rect):
+        """Return the pixels under rect (frame-relative, logical pixels) as a QPixmap.
+
+        A crop of the whole frame shares the frame's pixels; copy-on-write
+        happens only if it is painted on.
+        """
+        device_rect = self.device_rect(rect)
+        if device_rect == self.pixmap.rect():
+            return QPixmap(self.pixmap)
+
+        cropped = self.pixmap.copy(device_rect)
+        cropped.setDevicePixelRatio(self.pixmap.devicePixelRatio())
+        return cropped
+
+    def position(self, rect):
+        """Return where a frame-relative rectangle is on the virtual desktop."""
+        return rect.topLeft() + self.geometry.topLeft()
+
+    def release(self):
+        """Drop this frame's reference to the capture."""
+        self.pixmap = None
+
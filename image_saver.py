@@ -0,0 +1,112 @@
+"""
+Background image saving.
+
+Images are encoded on a shared worker pool and written atomically through a
+temporary file in the destination directory, so the GUI thread never waits
+on encoding or disk I/O.
+"""
+
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5.QtCore import QObject, QBuffer, QByteArray, QIODevice, pyqtSignal
+
+# Shared by every window so several saves can run side by side
+_executor = ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 1),
+                               thread_name_prefix='image-saver')
+
+
+def image_format(file_path):
+    """Return the Qt image format name for a file path, based on its extension."""
+    extension = os.path.splitext(file_path)[1].lstrip('.').upper()
+    if not extension:
+        raise ValueError(f"Cannot determine image format of {file_path} (no extension)")
+    return 'JPEG' if extension == 'JPG' else extension
+
+
+def encode_image(image, fmt, quality=-1):
+    """Encode a QImage and return the encoded bytes."""
+    data = QByteArray()
+    buffer = QBuffer(data)
+    buffer.open(QIODevice.WriteOnly)
+    ok = image.save(buffer, fmt, quality)
+    buffer.close()
+    if not ok:
+        raise ValueError(f"Could not encode image as {fmt}")
+    return bytes(data)
+
+
+def write_atomic(data, file_path):
+    """Write data to file_path via a temporary file and rename.
+
+    data is a bytes-like object or a list of them, written in order.
+    Readers see either the old file or the complete new one, never a
+    partially written image.
+    """
+    chunks = data if isinstance(data, (list, tuple)) else [data]
+    directory = os.path.dirname(os.path.abspath(file_path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.', suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, file_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def save_image_file(image, file_path, quality=-1):
+    """Encode image in the format given by file_path's extension and write it atomically."""
+    write_atomic(encode_image(image, image_format(file_path), quality), file_path)
+
+
+class ImageSaver(QObject):
+    """Saves images in the background and reports the outcome through signals.
+
+    Signals are emitted from the worker thread and delivered queued to
+    receivers on the GUI thread.
+    """
+
+    saved = pyqtSignal(str)  # file_path
+    failed = pyqtSignal(str, str)  # file_path, error message
+
+    def save(self, image, file_path, quality=-1):
+        """Queue a QImage to be saved to file_path and return its Future.
+
+        QImage is implicitly shared, so later changes to the caller's image
+        detach from it rather than affecting the save.
+        """
+        return self.run(file_path, save_image_file, image, file_path, quality)
+
+    def run(self, file_path, func, *args):
+        """Queue func(*args), which writes file_path, and return its Future.
+
+        Completion is reported through saved/failed like an image save. func
+        may return the path it actually wrote, which saved then reports.
+        """
+        return _executor.submit(self._run, file_path, func, args)
+
+    def _run(self, file_path, func, args):
+        """Run one save job (runs on a worker thread)."""
+        try:
+            written = func(*args)
+        except Exception as e:
+            self._emit(self.failed, file_path, str(e))
+            return False
+
+        self._emit(self.saved, written if isinstance(written, str) else file_path)
+        return True
+
+    @staticmethod
+    def _emit(signal, *args):
+        """Emit a signal, ignoring a receiver that was deleted while saving."""
+        try:
+            signal.emit(*args)
+        except RuntimeError:
+            pass
@@ -0,0 +1,159 @@
+"""
+Single-instance support.
+
+The first process to start the tray application listens on a per-user
+local socket. Later invocations connect to it, send one command and exit,
+so a capture started from a script or a desktop shortcut costs one round
+trip rather than a Qt start-up, and only one process ever hooks ALT+F2.
+
+Each message is one line of UTF-8 JSON. A client sends
+{"command": name, "args": [...]} and the instance answers
+{"ok": true} or {"ok": false, "error": message}. Only QtCore and QtNetwork
+are needed on the client side.
+"""
+
+import os
+import json
+import getpass
+import hashlib
+import logging
+from PyQt5.QtCore import QObject, QElapsedTimer
+from PyQt5.QtNetwork import QLocalServer, QLocalSocket
+
+logger = logging.getLogger(__name__)
+
+NAME_ENV = 'SCREEN_CAPTURE_INSTANCE'  # Overrides the socket name, e.g. for a second, separate instance
+CONNECT_TIMEOUT_MS = 500
+REPLY_TIMEOUT_MS = 5000
+MAX_MESSAGE_BYTES = 64 * 1024
+
+
+def server_name():
+    """Return the local socket name of the current user's instance."""
+    name = os.environ.get(NAME_ENV)
+    if name:
+        return name
+    try:
+        user = getpass.getuser()
+    except Exception:
+        user = str(os.getuid()) if hasattr(os, 'getuid') else 'default'
+    return 'screen-capture-' + hashlib.blake2b(user.encode('utf-8'), digest_size=8).hexdigest()
+
+
+def encode_message(message):
+    return json.dumps(message, separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+def send_command(command, args=(), name=None, timeout_ms=REPLY_TIMEOUT_MS):
+    """Send a command to the running instance and return its reply dict.
+
+    Returns None if no instance is listening. Blocks until the reply
+    arrives, so it works without an event loop or even a QCoreApplication.
+    """
+    socket = QLocalSocket()
+    socket.connectToServer(name or server_name())
+    if not socket.waitForConnected(CONNECT_TIMEOUT_MS):
+        return None
+
+    socket.write(encode_message({'command': command, 'args': list(args)}))
+    socket.flush()
+    timer = QElapsedTimer()
+    timer.start()
+    while not socket.canReadLine():
+        remaining = timeout_ms - timer.elapsed()
+        if remaining <= 0 or not socket.waitForReadyRead(remaining):
+            socket.abort()
+            return {'ok': False, 'error': "The running instance did not reply"}
+
+    try:
+        reply = json.loads(bytes(socket.readLine()).decode('utf-8'))
+    except ValueError:
+        reply = {'ok': False, 'error': "The running instance sent an invalid reply"}
+    socket.disconnectFromServer()
+    return reply
+
+
+class InstanceServer(QObject):
+    """Listens for commands from later invocations and runs them.
+
+    handlers maps command names to callables taking the argument list. A
+    handler reports failure by raising ValueError or OSError, whose message
+    goes back to the client. Any other exception is logged and reported as
+    a failure as well, since raised from a Qt slot it would abort the
+    process. 'ping' is always answered, so clients can tell a live instance
+    from a stale socket.
+    """
+
+    def __init__(self, name=None, parent=None):
+        super().__init__(parent)
+        self.name = name or server_name()
+        self.handlers = {'ping': lambda args: None}
+        self.server = QLocalServer(self)
+        self.server.setSocketOptions(QLocalServer.UserAccessOption)
+        self.server.newConnection.connect(self.on_new_connection)
+
+    def listen(self):
+        """Start listening. Returns False if another instance already is.
+
+        Raises OSError if the socket cannot be set up for any other reason.
+        """
+        # Ask first: with access options set, Qt replaces an existing socket rather than failing
+        if send_command('ping', name=self.name, timeout_ms=CONNECT_TIMEOUT_MS) is not None:
+            return False
+        if self.server.listen(self.name):
+            return True
+
+        # Left behind by an instance that crashed
+        QLocalServer.removeServer(self.name)
+        if not self.server.listen(self.name):
+            raise OSError(f"Could not listen for commands on {self.name}: {self.server.errorString()}")
+        logger.info("Replaced a stale instance socket")
+        return True
+
+    def close(self):
+        self.server.close()
+
+    def on_new_connection(self):
+        while self.server.hasPendingConnections():
+            socket = self.server.nextPendingConnection()
+            socket.readyRead.connect(lambda socket=socket: self.on_ready_read(socket))
+            socket.disconnected.connect(socket.deleteLater)
+            self.on_ready_read(socket)  # The command may have arrived already
+
+    def on_ready_read(self, socket):
+        """Run the command once its line is complete, then reply and hang up."""
+        if not socket.canReadLine():
+            if socket.bytesAvailable() > MAX_MESSAGE_BYTES:
+                self.reply(socket, {'ok': False, 'error': "Message too long"})
+            return
+
+        try:
+            message = json.loads(bytes(socket.readLine()).decode('utf-8'))
+            command, args = message['command'], list(message.get('args', []))
+        except (ValueError, KeyError, TypeError):
+            self.reply(socket, {'ok': False, 'error': "Malformed command"})
+            return
+        self.reply(socket, self.run(command, args))
+
+    def run(self, command, args):
+        """Run a command in this process and return the reply dict."""
+        handler = self.handlers.get(command)
+        if handler is None:
+            return {'ok': False, 'error': f"Unknown command: {command}"}
+        if command != 'ping':
+            logger.info(f"Received command {command} {' '.join(map(str, args))}".rstrip())
+        try:
+            handler(args)
+        except (ValueError, OSError) as e:
+            return {'ok': False, 'error': str(e)}
+        except Exception as e:
+            # Raised from a Qt slot it would abort the process, and with it the tray
+            logger.exception(f"Command {command} failed")
+            return {'ok': False, 'error': f"{command} failed: {e}"}
+        return {'ok': True}
+
+    @staticmethod
+    def reply(socket, reply):
+        socket.write(encode_message(reply))
+        socket.flush()
+        socket.disconnectFromServer()
@@ -1,26 +1,71 @@
 """
 Screen Capture and Annotation Tool
 A Snipaste-like application for capturing screen regions and annotating them.
+
+Run without arguments to start the tray application, or with a command
+(see `python main.py --help`) for scripted use. Only one tray application
+runs per user; commands are forwarded to it. Modules are imported only
+once the mode is known, so commands start without loading the GUI.
 """
 
 import sys
-import atexit
-from PyQt5.QtWidgets import QApplication
-from screen_capture import ScreenCaptureApp
 
 
-def main():
+def main(argv=None):
     """Main entry point for the application."""
+    argv = sys.argv[1:] if argv is None else argv
+    if argv:
+        from cli import main as cli_main
+        return cli_main(argv)
+
+    from instance import send_command
+    if send_command('ping') is not None:
+        print("Screen capture is already running (see `python main.py --help` for commands)",
+              file=sys.stderr)
+        return 0
+    return run_gui()
+
+
+def run_gui(commands=()):
+    """Run the tray application until it quits.
+
+    commands are (name, args) pairs to run once it is up, as if another
+    invocation had sent them. If another instance wins the race to start,
+    they are sent to it instead.
+    """
+    import atexit
+    import logging
+    from PyQt5.QtWidgets import QApplication
+    from instance import InstanceServer, send_command
+
     app = QApplication(sys.argv)
     app.setQuitOnLastWindowClosed(False)
-    
+
+    server = InstanceServer()
+    try:
+        if not server.listen():
+            for command, args in commands:
+                send_command(command, args)
+            return 0
+    except OSError as e:
+        logging.getLogger(__name__).warning(f"{e}; commands from other invocations will start new instances")
+
+    from screen_capture import ScreenCaptureApp
     capture_app = ScreenCaptureApp()
-    
+    server.handlers.update(capture_app.instance_commands())
+
     # Register cleanup function
     atexit.register(capture_app.cleanup)
-    
-    sys.exit(app.exec_())
+
+    for command, args in commands:
+        reply = server.run(command, args)
+        if not reply['ok']:
+            print(f"main.py {command}: {reply['error']}", file=sys.stderr)
+
+    result = app.exec_()
+    server.close()
+    return result
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
@@ -0,0 +1,178 @@
+"""
+Memory budget for pinned annotation windows.
+
+Windows that are hidden or idle have their pixmaps demoted to compressed
+in-memory buffers, least recently used first, and further to spill files
+once the compressed buffers themselves grow too large. Pixmaps are restored
+transparently when a window is shown or used again.
+"""
+
+import time
+import zlib
+import tempfile
+import logging
+from PyQt5.QtCore import QObject, QTimer
+from PyQt5.QtGui import QImage, QPixmap
+
+logger = logging.getLogger(__name__)
+
+
+def pixmap_nbytes(pixmap):
+    """Return the approximate memory held by a pixmap's pixels."""
+    if pixmap is None or pixmap.isNull():
+        return 0
+    return pixmap.width() * pixmap.height() * max(1, pixmap.depth() // 8)
+
+
+class CompressedImage:
+    """A pixmap's pixels held zlib-compressed in memory or in a spill file."""
+
+    COMPRESSION_LEVEL = 1  # Screenshots compress well even at the fastest level
+
+    __slots__ = ('width', 'height', 'bytes_per_line', 'format', 'ratio', 'data', 'spill_file', 'nbytes')
+
+    def __init__(self, pixmap):
+        image = pixmap.toImage()
+        self.width = image.width()
+        self.height = image.height()
+        self.bytes_per_line = image.bytesPerLine()
+        self.format = image.format()
+        self.ratio = pixmap.devicePixelRatio()
+        self.spill_file = None
+
+        bits = image.constBits()
+        bits.setsize(image.sizeInBytes())
+        self.data = zlib.compress(memoryview(bits), self.COMPRESSION_LEVEL)
+        self.nbytes = len(self.data)
+
+    @property
+    def is_spilled(self):
+        return self.spill_file is not None
+
+    def spill(self):
+        """Move the compressed data out of memory into an anonymous temp file."""
+        if self.is_spilled:
+            return
+        spill_file = tempfile.TemporaryFile(prefix='screencapture-')
+        spill_file.write(self.data)
+        spill_file.flush()
+        self.spill_file = spill_file
+        self.data = None
+
+    def to_pixmap(self):
+        """Decompress back into a QPixmap."""
+        if self.is_spilled:
+            self.spill_file.seek(0)
+            data = self.spill_file.read()
+        else:
+            data = self.data
+
+        raw = zlib.decompress(data)
+        # copy() so the image owns its pixels rather than borrowing raw
+        image = QImage(raw, self.width, self.height, self.bytes_per_line, self.format).copy()
+        pixmap = QPixmap.fromImage(image)
+        pixmap.setDevicePixelRatio(self.ratio)
+        return pixmap
+
+    def close(self):
+        """Release the spill file, if any."""
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.spill_file = None
+
+
+class MemoryBudget(QObject):
+    """Keeps the pixmaps of registered windows within a global memory budget.
+
+    Windows must provide memory_usage(), compressed_images(), demote(full)
+    and a last_used timestamp (time.monotonic()). Hidden windows are fully
+    demoted; visible windows idle for IDLE_SECONDS only give up the pixels
+    they do not need for display.
+    """
+
+    DEFAULT_BUDGET = 512 * 1024 * 1024  # Bytes of resident pixmaps
+    DEFAULT_SPILL_THRESHOLD = 128 * 1024 * 1024  # Compressed bytes kept in memory
+    IDLE_SECONDS = 60
+    CHECK_INTERVAL_MS = 5000
+
+    def __init__(self, budget=DEFAULT_BUDGET, spill_threshold=DEFAULT_SPILL_THRESHOLD, parent=None):
+        super().__init__(parent)
+        self.budget = budget
+        self.spill_threshold = spill_threshold
+        self.windows = []  # Least recently used first
+        self.evictions = 0
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.enforce)
+        self.timer.start(self.CHECK_INTERVAL_MS)
+
+    def register(self, window):
+        """Start tracking a window and make room for it if needed."""
+        self.windows.append(window)
+        window.activated.connect(lambda: self.touch(window))
+        window.destroyed.connect(lambda: self.unregister(window))
+        self.enforce()
+
+    def unregister(self, window):
+        """Stop tracking a window."""
+        if window in self.windows:
+            self.windows.remove(window)
+
+    def touch(self, window):
+        """Mark a window as the most recently used."""
+        if window in self.windows and self.windows[-1] is not window:
+            self.windows.remove(window)
+            self.windows.append(window)
+
+    def resident_bytes(self):
+        """Return the pixmap memory held by all tracked windows."""
+        return sum(window.memory_usage() for window in self.windows)
+
+    def compressed_images(self):
+        """Return every compressed image held by the tracked windows."""
+        return [image for window in self.windows for image in window.compressed_images()]
+
+    def enforce(self):
+        """Demote least recently used windows until resident memory fits the budget."""
+        resident = self.resident_bytes()
+        if resident > self.budget:
+            now = time.monotonic()
+            # Never demote the most recently used window
+            for window in self.windows[:-1]:
+                if resident <= self.budget:
+                    break
+
+                hidden = not window.isVisible() or window.isMinimized()
+                if not hidden and now - window.last_used < self.IDLE_SECONDS:
+                    continue
+
+                before = window.memory_usage()
+                window.demote(full=hidden)
+                freed = before - window.memory_usage()
+                if freed > 0:
+                    resident -= freed
+                    self.evictions += 1
+                    logger.info(f"Demoted pinned window, freed {freed / 1048576:.1f} MB")
+
+        self.spill()
+
+    def spill(self):
+        """Move the oldest compressed buffers to disk once they exceed the threshold."""
+        images = [image for image in self.compressed_images() if not image.is_spilled]
+        in_memory = sum(image.nbytes for image in images)
+        for image in images:
+            if in_memory <= self.spill_threshold:
+                break
+            image.spill()
+            in_memory -= image.nbytes
+
+    def stats(self):
+        """Return a dict describing current memory use."""
+        compressed = self.compressed_images()
+        return {
+            'windows': len(self.windows),
+            'resident_bytes': self.resident_bytes(),
+            'compressed_bytes': sum(image.nbytes for image in compressed if not image.is_spilled),
+            'spilled_bytes': sum(image.nbytes for image in compressed if image.is_spilled),
+            'evictions': self.evictions,
+        }
@@ -0,0 +1,293 @@
+"""
+Region recording to animated WebP or GIF.
+
+Frames are grabbed on the GUI thread at a fixed rate and handed to a worker
+thread, which compares each one with the previous frame tile by tile and
+keeps only the tiles that changed. Frames with no change at all are not
+stored; the previous frame simply lasts longer. Encoding through Pillow
+happens once recording stops, also off the GUI thread.
+"""
+
+import io
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+from PyQt5.QtCore import Qt, QObject, QTimer, pyqtSignal
+
+from image_saver import write_atomic
+from scroll_capture import image_to_array, ScrollCaptureControl
+
+logger = logging.getLogger(__name__)
+
+FILE_FILTER = "Animated WebP (*.webp);;GIF (*.gif)"
+
+
+class TileFrames:
+    """A sequence of frames stored as the tiles changed since the frame before."""
+
+    TILE_SIZE = 32
+
+    def __init__(self):
+        self.width = 0
+        self.height = 0
+        self.first = None  # Padded (height, width) uint32 array of the first frame
+        self.previous = None  # Padded last frame, for comparison
+        self.frames = []  # (timestamp, tile rows, tile columns, tiles) after the first
+        self.start_time = None
+        self.nbytes = 0
+
+    def __len__(self):
+        return len(self.frames) + (self.first is not None)
+
+    def pad(self, pixels):
+        """Pad a frame with zeros to whole tiles."""
+        size = self.TILE_SIZE
+        height, width = pixels.shape
+        return np.pad(pixels, ((0, -height % size), (0, -width % size)))
+
+    def tiles(self, padded):
+        """View a padded frame as (tile row, y, tile column, x)."""
+        size = self.TILE_SIZE
+        height, width = padded.shape
+        return padded.reshape(height // size, size, width // size, size)
+
+    def add(self, pixels, timestamp):
+        """Add a frame. Returns False if it was identical to the previous one."""
+        padded = self.pad(pixels)
+        if self.first is None:
+            self.height, self.width = pixels.shape
+            self.first = self.previous = padded
+            self.start_time = timestamp
+            self.nbytes = padded.nbytes
+            return True
+
+        if padded.shape != self.previous.shape:
+            raise ValueError("Frame size changed while recording")
+
+        grid = self.tiles(padded)
+        changed = (grid != self.tiles(self.previous)).any(axis=(1, 3))
+        rows, columns = np.nonzero(changed)
+        if not len(rows):
+            return False
+
+        tiles = grid[rows, :, columns, :]  # (n, TILE_SIZE, TILE_SIZE) copy
+        self.frames.append((timestamp, rows, columns, tiles))
+        self.nbytes += tiles.nbytes + rows.nbytes + columns.nbytes
+        self.previous = padded
+        return True
+
+    def timestamps(self):
+        """Return the grab time of every stored frame, without rebuilding any."""
+        if self.first is None:
+            return []
+        return [self.start_time] + [frame[0] for frame in self.frames]
+
+    def replay(self):
+        """Yield (timestamp, pixels) for every stored frame, rebuilding each in turn.
+
+        The yielded array is reused; copy it to keep it.
+        """
+        if self.first is None:
+            return
+        canvas = self.first.copy()
+        grid = self.tiles(canvas)
+        yield self.start_time, canvas[:self.height, :self.width]
+        for timestamp, rows, columns, tiles in self.frames:
+            grid[rows, :, columns, :] = tiles
+            yield timestamp, canvas[:self.height, :self.width]
+
+
+def to_pil(pixels):
+    """Convert a (height, width) array of 0xAARRGGBB pixels to an RGB PIL image."""
+    # Little-endian bytes are B, G, R, A
+    bgra = pixels.view(np.uint8).reshape(pixels.shape[0], pixels.shape[1], 4)
+    return Image.fromarray(np.ascontiguousarray(bgra[:, :, 2::-1]), 'RGB')
+
+
+class ReplayImage(Image.Image):
+    """A multi-frame PIL image whose frames are rebuilt from TileFrames as they are read.
+
+    Pillow's animated WebP and GIF writers read multi-frame images one frame
+    at a time through seek(), so only the current frame is held in full.
+    Handing the frames over as append_images instead would not stream them:
+    the WebP writer makes a list of append_images before encoding.
+
+    This relies on Pillow internals: seek() swaps in each frame's core image
+    through the im, _mode and _size attributes. _mode backs the mode property
+    only from Pillow 10.1 on, hence the floor in requirements.txt.
+    """
+
+    def __init__(self, frames):
+        super().__init__()
+        self.frames = frames
+        self.n_frames = len(frames)
+        self.is_animated = self.n_frames > 1
+        self._replay = None
+        self._index = -1
+        self.seek(0)
+
+    def tell(self):
+        return self._index
+
+    def seek(self, index):
+        if not 0 <= index < self.n_frames:
+            raise EOFError("No more recorded frames")
+        if index == self._index:
+            return
+        if self._replay is None or index < self._index:
+            self._replay = self.frames.replay()
+            self._index = -1
+        while self._index < index:
+            _, pixels = next(self._replay)
+            self._index += 1
+        frame = to_pil(pixels)
+        self.im = frame.im
+        self._mode = frame.mode
+        self._size = frame.size
+
+
+def encode_recording(frames, end_time, file_path, quality=None):
+    """Encode recorded frames to an animated WebP or GIF, chosen by extension.
+
+    Frame durations come from the grab timestamps; the last frame lasts
+    until end_time. quality applies to WebP: None means lossless.
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension not in ('.webp', '.gif'):
+        raise ValueError(f"Cannot record to {file_path}: use a .webp or .gif file")
+    if not len(frames):
+        raise ValueError("Nothing was recorded")
+
+    timestamps = frames.timestamps() + [end_time]
+    durations = [max(10, round((end - start) * 1000)) for start, end in zip(timestamps, timestamps[1:])]
+
+    # Frames are rebuilt one at a time as the encoder reads them
+    image = ReplayImage(frames)
+    output = io.BytesIO()
+    if extension == '.webp':
+        options = {'lossless': True} if quality is None else {'quality': quality}
+        image.save(output, 'WEBP', save_all=True, duration=durations, loop=0, method=4, **options)
+    else:
+        image.save(output, 'GIF', save_all=True, duration=durations, loop=0)
+    write_atomic(output.getvalue(), file_path)
+
+
+class RegionRecorder(QObject):
+    """Records a region at a fixed frame rate until stopped or out of time.
+
+    grab is called on the GUI thread and returns a QPixmap or None.
+    stopped is emitted when recording ends, by stop() or the time limit,
+    and cancelled after cancel().
+    """
+
+    progress = pyqtSignal(int, int)  # Seconds recorded, kilobytes stored
+    stopped = pyqtSignal()
+    cancelled = pyqtSignal()
+
+    DEFAULT_FPS = 10
+    DEFAULT_MAX_SECONDS = 30
+    MAX_PENDING = 4  # Frames waiting for the differ before grabs are skipped
+
+    def __init__(self, grab, fps=DEFAULT_FPS, max_seconds=DEFAULT_MAX_SECONDS, parent=None):
+        super().__init__(parent)
+        self.grab = grab
+        self.max_seconds = max_seconds
+        self.frames = TileFrames()
+        self.started_at = None
+        self.end_time = None
+        self.grabs_skipped = 0
+        self.pending = threading.Semaphore(self.MAX_PENDING)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='region-recorder')
+
+        self.timer = QTimer(self)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.setInterval(round(1000 / fps))
+        self.timer.timeout.connect(self.grab_frame)
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self.grab_frame()
+        self.timer.start()
+
+    def grab_frame(self):
+        """Grab one frame and queue it for diffing."""
+        now = time.perf_counter()
+        if now - self.started_at >= self.max_seconds:
+            self.stop()
+            return
+
+        if not self.pending.acquire(blocking=False):
+            self.grabs_skipped += 1
+            return
+
+        pixmap = self.grab()
+        if pixmap is None or pixmap.isNull():
+            self.pending.release()
+            return
+        self.executor.submit(self._add, pixmap.toImage(), now)
+
+    def _add(self, image, timestamp):
+        """Store the tiles of a frame that changed (runs on the worker thread)."""
+        try:
+            self.frames.add(image_to_array(image), timestamp)
+            self._emit(self.progress, int(timestamp - self.started_at), self.frames.nbytes // 1024)
+        except Exception as e:
+            logger.error(f"Could not record frame: {e}", exc_info=True)
+        finally:
+            self.pending.release()
+
+    def stop(self):
+        """Stop recording; frames already grabbed are still stored."""
+        if not self.timer.isActive():
+            return
+        self.timer.stop()
+        self.end_time = time.perf_counter()
+        logger.info(f"Recorded {len(self.frames)} distinct frames in "
+                    f"{self.end_time - self.started_at:.1f} s ({self.grabs_skipped} grabs skipped)")
+        self.stopped.emit()
+
+    def cancel(self):
+        """Stop recording and drop the frames."""
+        self.timer.stop()
+        self.executor.shutdown(wait=False)
+        self.frames = TileFrames()
+        self.cancelled.emit()
+
+    def save(self, saver, file_path, quality=None):
+        """Encode the recording to file_path through an ImageSaver, after queued frames.
+
+        Returns the Future; the outcome is reported by the saver's signals.
+        """
+        frames, end_time = self.frames, self.end_time
+        return saver.run(file_path, self._encode, self.executor, frames, end_time, file_path, quality)
+
+    @staticmethod
+    def _encode(executor, frames, end_time, file_path, quality):
+        """Wait for queued frames, then encode (runs on a saver worker thread)."""
+        executor.shutdown(wait=True)
+        encode_recording(frames, end_time, file_path, quality)
+
+    @staticmethod
+    def _emit(signal, *args):
+        """Emit a signal, ignoring a receiver that was deleted meanwhile."""
+        try:
+            signal.emit(*args)
+        except RuntimeError:
+            pass
+
+
+class RecordingControl(ScrollCaptureControl):
+    """Panel shown next to the region while it is being recorded."""
+
+    PROMPT = "Recording..."
+
+    def __init__(self, recorder, region):
+        super().__init__(recorder, region)
+        recorder.stopped.connect(self.close)
+
+    def progress_text(self, seconds, kilobytes):
+        return f"⏺ {seconds} s, {kilobytes} KB"
@@ -0,0 +1,234 @@
+"""
+Pixelate and blur redaction.
+
+Redaction works on the screenshot's own pixels, never on a translucent
+overlay, so a redacted region in saved or copied output holds nothing but
+block averages or blurred values. The expensive NumPy pass runs once per
+tool and strength over the whole screenshot and produces a reduced layer:
+one pixel per block for pixelation, a blurred downsample for blurring.
+Layers are built on a worker thread as soon as a redaction tool is picked,
+so the first drag rarely waits for one. Each region is then a crop of that
+layer scaled back up, painted straight onto the canvas and only where it
+is dirty, which is cheap enough to redo on every mouse move while
+dragging. Finished regions are cached at full resolution so repainting
+the annotation layer only blits them.
+"""
+
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PyQt5.QtCore import Qt, QRectF
+from PyQt5.QtGui import QImage, QPainter
+
+from annotation_model import AnnotationTool
+from scroll_capture import image_to_array, array_to_image
+
+logger = logging.getLogger(__name__)
+
+BLUR_PASSES = 2  # Repeated box blurs approach a Gaussian
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='redaction')
+
+
+def channels(pixels):
+    """View a (height, width) uint32 array as (height, width, 4) bytes."""
+    return pixels.view(np.uint8).reshape(pixels.shape[0], pixels.shape[1], 4)
+
+
+def block_means(pixels, block):
+    """Average a (height, width) uint32 array over block x block squares.
+
+    Returns one pixel per block; partial blocks at the right and bottom
+    edges average the edge pixels repeated outward.
+    """
+    height, width = pixels.shape
+    padded = np.pad(pixels, ((0, -height % block), (0, -width % block)), mode='edge')
+    rows, columns = padded.shape[0] // block, padded.shape[1] // block
+    # Sum each block's rows first, then its columns, channel by channel
+    sums = channels(padded).reshape(rows, block, columns * block * 4).sum(axis=1, dtype=np.uint32)
+    sums = sums.reshape(rows, columns, block, 4).sum(axis=2)
+    means = (sums // (block * block)).astype(np.uint8)
+    return means.view(np.uint32).reshape(rows, columns)
+
+
+def box_blur(pixels, radius, passes=BLUR_PASSES):
+    """Blur a (height, width) uint32 array with separable box filters."""
+    result = channels(np.ascontiguousarray(pixels))
+    for _ in range(passes):
+        for axis in (0, 1):
+            result = box_blur_axis(result, radius, axis)
+    return np.ascontiguousarray(result).view(np.uint32).reshape(pixels.shape)
+
+
+def box_blur_axis(data, radius, axis):
+    """Average each value with radius neighbours either side along one axis.
+
+    Uses a running sum, so the cost does not depend on radius. Values past
+    the ends repeat the edge.
+    """
+    size = 2 * radius + 1
+    length = data.shape[axis]
+    padding = [(0, 0)] * data.ndim
+    padding[axis] = (radius + 1, radius)
+    totals = np.cumsum(np.pad(data, padding, mode='edge'), axis=axis, dtype=np.uint32)
+    ahead = [slice(None)] * data.ndim
+    behind = [slice(None)] * data.ndim
+    ahead[axis] = slice(size, size + length)
+    behind[axis] = slice(0, length)
+    window = totals[tuple(ahead)] - totals[tuple(behind)]
+    window //= size
+    return window.astype(np.uint8)
+
+
+class RedactionLayer:
+    """A redacted copy of a whole image at reduced resolution.
+
+    Each layer pixel covers scale x scale source pixels. Pixelation layers
+    are enlarged with hard block edges, blur layers smoothly.
+    """
+
+    __slots__ = ('image', 'scale', 'smooth')
+
+    def __init__(self, pixels, scale, smooth):
+        self.image = array_to_image(pixels)
+        self.scale = scale
+        self.smooth = smooth
+
+    @property
+    def nbytes(self):
+        return self.image.sizeInBytes()
+
+    def draw(self, painter, device_rect, ratio=1.0):
+        """Paint the redacted pixels under a rectangle of the source where it lies.
+
+        ratio maps the source's device pixels to the painter's coordinates.
+        Only the part of the rectangle inside the painter's clip costs time.
+        """
+        scale = self.scale
+        target = QRectF(device_rect.x() / ratio, device_rect.y() / ratio,
+                        device_rect.width() / ratio, device_rect.height() / ratio)
+        painter.save()
+        if self.smooth:
+            painter.setRenderHint(QPainter.SmoothPixmapTransform)
+            source = QRectF(device_rect.x() / scale, device_rect.y() / scale,
+                            device_rect.width() / scale, device_rect.height() / scale)
+        else:
+            # Enlarge whole blocks by exactly scale, then clip to the rectangle
+            painter.setRenderHint(QPainter.SmoothPixmapTransform, False)
+            painter.setClipRect(target, Qt.IntersectClip)
+            left, top = device_rect.left() // scale, device_rect.top() // scale
+            right, bottom = device_rect.right() // scale + 1, device_rect.bottom() // scale + 1
+            source = QRectF(left, top, right - left, bottom - top)
+            target = QRectF(left * scale / ratio, top * scale / ratio,
+                            (right - left) * scale / ratio, (bottom - top) * scale / ratio)
+        painter.drawImage(target, self.image, source)
+        painter.restore()
+
+    def render(self, device_rect):
+        """Return the redacted pixels under a rectangle of the source as a QImage."""
+        result = QImage(device_rect.size(), QImage.Format_RGB32)
+        painter = QPainter(result)
+        painter.translate(-device_rect.x(), -device_rect.y())
+        self.draw(painter, device_rect)
+        painter.end()
+        return result
+
+
+def pixelate_layer(image, block):
+    """Build the pixelation layer of a QImage for block x block pixel blocks."""
+    return RedactionLayer(block_means(image_to_array(image), block), block, smooth=False)
+
+
+def blur_layer(image, radius):
+    """Build the blur layer of a QImage for a blur about radius pixels wide.
+
+    The image is first averaged down by a third of the radius, which is
+    itself a box filter, so the blur itself runs on far fewer pixels.
+    """
+    factor = max(1, radius // 3)
+    pixels = image_to_array(image)
+    if factor > 1:
+        pixels = block_means(pixels, factor)
+    return RedactionLayer(box_blur(pixels, max(1, round(radius / factor))), factor, smooth=True)
+
+
+LAYER_BUILDERS = {AnnotationTool.PIXELATE: pixelate_layer,
+                  AnnotationTool.BLUR: blur_layer}
+
+
+class RedactionCache:
+    """Redaction layers and finished regions for one source pixmap.
+
+    Layers are kept per (tool, strength) and can be built ahead of use on a
+    worker thread. Regions are kept least recently used first within
+    max_bytes. Everything is dropped when the source changes.
+    """
+
+    MAX_REGION_BYTES = 64 * 1024 * 1024
+
+    def __init__(self, max_bytes=MAX_REGION_BYTES):
+        self.max_bytes = max_bytes
+        self.source_key = None
+        self.layers = {}  # (tool, strength) -> Future of a RedactionLayer
+        self.regions = OrderedDict()  # (tool, strength, x, y, w, h) -> QImage
+        self.region_bytes = 0
+
+    @property
+    def nbytes(self):
+        # A failed build re-raises from result(); it holds no layer, and layer() reports it
+        layers = [future.result() for future in self.layers.values()
+                  if future.done() and not future.cancelled() and future.exception() is None]
+        return self.region_bytes + sum(layer.nbytes for layer in layers if layer is not None)
+
+    def clear(self):
+        self.source_key = None
+        self.layers = {}
+        self.regions = OrderedDict()
+        self.region_bytes = 0
+
+    def use_source(self, source):
+        """Forget everything cached for a previous source pixmap."""
+        if source.cacheKey() != self.source_key:
+            self.clear()
+            self.source_key = source.cacheKey()
+
+    def prepare(self, source, tool, strength):
+        """Start building a layer in the background if it is not cached; returns its Future."""
+        self.use_source(source)
+        future = self.layers.get((tool, strength))
+        if future is None:
+            future = _executor.submit(self._build, LAYER_BUILDERS[tool], source.toImage(), tool, strength)
+            self.layers[tool, strength] = future
+        return future
+
+    @staticmethod
+    def _build(builder, image, tool, strength):
+        """Build one layer (runs on the worker thread)."""
+        layer = builder(image, strength)
+        logger.debug(f"Built redaction layer for tool {tool} at strength {strength}")
+        return layer
+
+    def layer(self, source, tool, strength):
+        """Return the redaction layer of a QPixmap for a tool and strength in device pixels.
+
+        Waits for the layer if it is still being built.
+        """
+        return self.prepare(source, tool, strength).result()
+
+    def region(self, source, tool, strength, device_rect):
+        """Return the redacted pixels of source under device_rect as a QImage."""
+        self.use_source(source)
+        key = (tool, strength, device_rect.x(), device_rect.y(), device_rect.width(), device_rect.height())
+        image = self.regions.get(key)
+        if image is not None:
+            self.regions.move_to_end(key)
+            return image
+
+        image = self.layer(source, tool, strength).render(device_rect)
+        self.regions[key] = image
+        self.region_bytes += image.sizeInBytes()
+        while self.region_bytes > self.max_bytes and len(self.regions) > 1:
+            _, evicted = self.regions.popitem(last=False)
+            self.region_bytes -= evicted.sizeInBytes()
+        return image
@@ -3,15 +3,26 @@ Screen capture functionality with region selection.
 """
 
 import sys
-import threading
+import time
 import logging
+from collections import deque
 from PyQt5.QtWidgets import (QApplication, QWidget, QSystemTrayIcon, QMenu, 
-                             QAction, qApp, QDesktopWidget)
-from PyQt5.QtCore import Qt, QRect, QPoint, pyqtSignal, QTimer
+                             QAction, qApp, QDesktopWidget, QFileDialog)
+from PyQt5.QtCore import Qt, QRect, QRectF, QPoint, QTimer, pyqtSignal
 from PyQt5.QtGui import (QPainter, QPen, QColor, QPixmap, QGuiApplication, 
-                        QScreen, QIcon, QCursor)
+                        QScreen, QIcon, QCursor, QRegion)
 import keyboard
-from annotation_window import AnnotationWindow
+from annotation_window import AnnotationWindow, scale_rect
+from memory_manager import MemoryBudget
+from session import Session, FILE_FILTER as SESSION_FILTER, EXTENSION as SESSION_EXTENSION
+from capture_history import CaptureHistory, HistoryBrowser
+from element_map import ElementMapBuilder
+from image_buffer import SharedFrame
+from capture_scheduler import CaptureScheduler
+from scroll_capture import ScrollingCapture, ScrollCaptureControl
+from recording import RegionRecorder, RecordingControl, FILE_FILTER as RECORDING_FILTER
+from image_saver import ImageSaver
+from screen_grab import grab_region
 
 # Set up logging
 logging.basicConfig(
@@ -25,101 +36,261 @@ class SelectionOverlay(QWidget):
     """Overlay widget for selecting screen region to capture."""
     
     selection_made = pyqtSignal(QRect)
+    selection_cancelled = pyqtSignal()
+    overlay_shown = pyqtSignal()  # Emitted on the first paint after start()
     
-    def __init__(self, screenshot):
+    # Constants
+    DIM_COLOR = QColor(0, 0, 0, 100)
+    BORDER_COLOR = QColor(0, 120, 215)
+    BORDER_WIDTH = 2
+    HIGHLIGHT_COLOR = QColor(0, 200, 120)
+    SNAP_DISTANCE = 6  # Selection edges this close to an element edge snap to it
+    
+    def __init__(self, screenshot=None):
         super().__init__()
-        self.screenshot = screenshot
+        self.screenshot = None
+        self.backdrop = None  # Screenshot with the dim layer pre-applied
         self.selection_rect = QRect()
+        self.highlight_rect = QRect()  # Element under the cursor
+        self.press_highlight = QRect()  # Element highlighted when the button went down
         self.start_pos = None
         self.is_selecting = False
+        self.pending_shown = False  # Whether overlay_shown is still to be emitted
+        
+        # Element detection runs in the background once the overlay is up
+        self.element_map = None
+        self.generation = 0  # Identifies the capture an element map belongs to
+        self.element_builder = ElementMapBuilder(self)
+        self.element_builder.ready.connect(self.on_element_map_ready)
         
         self.setup_ui()
         
+        if screenshot is not None:
+            self.start(screenshot)
+        
     def setup_ui(self):
         """Set up the overlay UI."""
         self.setWindowFlags(Qt.WindowStaysOnTopHint | Qt.FramelessWindowHint | Qt.Tool)
-        self.setAttribute(Qt.WA_TranslucentBackground)
-        self.setWindowState(Qt.WindowFullScreen)
+        self.setAttribute(Qt.WA_OpaquePaintEvent)
         self.setCursor(Qt.CrossCursor)
-        self.showFullScreen()
+        self.setMouseTracking(True)  # Highlight elements before any button is pressed
+        
+    def start(self, screenshot, geometry=None):
+        """Reset the overlay for a new capture and show it.
+        
+        geometry is the virtual-desktop rectangle the screenshot covers; the
+        overlay spans it. Without it the overlay is shown full screen.
+        """
+        self.screenshot = screenshot
+        self.selection_rect = QRect()
+        self.highlight_rect = QRect()
+        self.element_map = None
+        self.generation += 1
+        self.start_pos = None
+        self.is_selecting = False
+        self.pending_shown = True
+        
+        self.build_backdrop()
+        if geometry is None:
+            self.showFullScreen()
+        else:
+            self.setGeometry(geometry)
+            self.show()
         self.raise_()  # Bring window to front
         self.activateWindow()  # Activate the window to receive input
         
+    def dismiss(self):
+        """Hide the overlay and release the capture, keeping the window for reuse."""
+        self.hide()
+        self.is_selecting = False
+        self.screenshot = None
+        self.backdrop = None
+        self.element_map = None
+        self.highlight_rect = QRect()
+        
+    def build_backdrop(self):
+        """Pre-render the darkened screenshot once per capture."""
+        self.backdrop = QPixmap(self.screenshot)
+        painter = QPainter(self.backdrop)
+        painter.fillRect(self.backdrop.rect(), self.DIM_COLOR)
+        painter.end()
+        
+    def size_label(self, rect):
+        """Return the size label text, baseline position and bounding rectangle."""
+        size_text = f"{rect.width()} x {rect.height()}"
+        text_rect = self.fontMetrics().boundingRect(size_text)
+        text_pos = QPoint(rect.right() - text_rect.width() - 5, rect.bottom() + 20)
+        return size_text, text_pos, text_rect.translated(text_pos)
+        
+    def selection_region(self, rect):
+        """Return the widget region painted for a selection rectangle."""
+        if rect.isNull():
+            return QRegion()
+        
+        margin = self.BORDER_WIDTH + 1
+        region = QRegion(rect.adjusted(-margin, -margin, margin, margin))
+        _, _, label_rect = self.size_label(rect)
+        return region.united(QRegion(label_rect.adjusted(-2, -2, 2, 2)))
+        
+    def set_selection(self, rect):
+        """Change the selection and repaint only what it covered before and after."""
+        dirty = self.selection_region(self.selection_rect)
+        self.selection_rect = rect
+        self.update(dirty.united(self.selection_region(rect)))
+        
+    def set_highlight(self, rect):
+        """Change the highlighted element and repaint what it covered before and after."""
+        rect = rect or QRect()
+        if rect == self.highlight_rect:
+            return
+        dirty = self.selection_region(self.highlight_rect)
+        self.highlight_rect = rect
+        self.update(dirty.united(self.selection_region(rect)))
+        
+    def request_element_map(self):
+        """Start analysing the capture for elements to highlight and snap to."""
+        if self.screenshot is not None:
+            self.element_builder.build(self.screenshot.toImage(), self.screenshot.devicePixelRatio(),
+                                       self.generation)
+        
+    def on_element_map_ready(self, element_map, generation):
+        """Turn on highlighting and snapping once the current capture is analysed."""
+        if generation != self.generation or self.screenshot is None:
+            return  # For an earlier capture
+        self.element_map = element_map
+        if not self.is_selecting:
+            self.set_highlight(element_map.element_at(self.mapFromGlobal(QCursor.pos())))
+        
     def paintEvent(self, event):
         """Paint the overlay with selection rectangle."""
+        if self.backdrop is None:
+            return
+        
         painter = QPainter(self)
         
-        # Draw darkened screenshot
-        painter.drawPixmap(0, 0, self.screenshot)
-        painter.fillRect(self.rect(), QColor(0, 0, 0, 100))
+        # Draw the pre-dimmed screenshot for the dirty area only
+        dirty = event.rect()
+        ratio = self.backdrop.devicePixelRatio()
+        painter.drawPixmap(dirty, self.backdrop, scale_rect(dirty, ratio))
+        
+        # Show the element under the cursor undimmed until a selection starts
+        if not self.highlight_rect.isNull():
+            visible = self.highlight_rect.intersected(dirty)
+            painter.drawPixmap(visible, self.screenshot, scale_rect(visible, ratio))
+            painter.setPen(QPen(self.HIGHLIGHT_COLOR, self.BORDER_WIDTH, Qt.DashLine))
+            painter.drawRect(self.highlight_rect)
         
         # Draw selection rectangle
         if not self.selection_rect.isNull():
-            # Clear the selected area
-            painter.setCompositionMode(QPainter.CompositionMode_Clear)
-            painter.fillRect(self.selection_rect, Qt.transparent)
+            # Show the selected area undimmed
+            visible = self.selection_rect.intersected(dirty)
+            painter.drawPixmap(visible, self.screenshot, scale_rect(visible, ratio))
             
             # Draw border around selection
-            painter.setCompositionMode(QPainter.CompositionMode_SourceOver)
-            pen = QPen(QColor(0, 120, 215), 2, Qt.SolidLine)
+            pen = QPen(self.BORDER_COLOR, self.BORDER_WIDTH, Qt.SolidLine)
             painter.setPen(pen)
             painter.drawRect(self.selection_rect)
             
             # Draw size label
             if self.selection_rect.width() > 0 and self.selection_rect.height() > 0:
-                size_text = f"{self.selection_rect.width()} x {self.selection_rect.height()}"
+                size_text, text_pos, _ = self.size_label(self.selection_rect)
                 painter.setPen(QColor(255, 255, 255))
-                text_rect = painter.fontMetrics().boundingRect(size_text)
-                text_pos = QPoint(
-                    self.selection_rect.right() - text_rect.width() - 5,
-                    self.selection_rect.bottom() + 20
-                )
                 painter.drawText(text_pos, size_text)
+                
+        painter.end()
+        
+        if self.pending_shown:
+            self.pending_shown = False
+            self.overlay_shown.emit()
+            # Only now, so the analysis never delays the overlay's first paint
+            self.request_element_map()
     
     def mousePressEvent(self, event):
         """Handle mouse press to start selection."""
         if event.button() == Qt.LeftButton:
             self.start_pos = event.pos()
-            self.selection_rect = QRect(self.start_pos, self.start_pos)
             self.is_selecting = True
-            self.update()
+            self.press_highlight = self.highlight_rect
+            self.set_highlight(QRect())
+            self.set_selection(QRect(self.start_pos, self.start_pos))
     
     def mouseMoveEvent(self, event):
-        """Handle mouse move to update selection."""
+        """Handle mouse move to update selection, or the highlight when not selecting."""
         if self.is_selecting and self.start_pos:
-            self.selection_rect = QRect(self.start_pos, event.pos()).normalized()
-            self.update()
+            rect = QRect(self.start_pos, event.pos()).normalized()
+            if self.element_map is not None:
+                rect = self.element_map.snap(rect, self.SNAP_DISTANCE)
+            self.set_selection(rect)
+        elif self.element_map is not None:
+            self.set_highlight(self.element_map.element_at(event.pos()))
     
     def mouseReleaseEvent(self, event):
         """Handle mouse release to complete selection."""
         if event.button() == Qt.LeftButton and self.is_selecting:
             self.is_selecting = False
-            if self.selection_rect.width() > 5 and self.selection_rect.height() > 5:
-                self.selection_made.emit(self.selection_rect)
-                self.close()
+            rect = self.selection_rect
+            if rect.width() <= 5 and rect.height() <= 5 and not self.press_highlight.isNull():
+                # A click rather than a drag selects the highlighted element
+                rect = self.press_highlight
+            # Dismiss first so the dimmed backdrop is freed before the crop is made
+            self.dismiss()
+            if rect.width() > 5 and rect.height() > 5:
+                self.selection_made.emit(rect)
             else:
                 # If selection too small, cancel
-                self.close()
+                self.selection_cancelled.emit()
     
     def keyPressEvent(self, event):
         """Handle key press events."""
         if event.key() == Qt.Key_Escape:
-            self.close()
+            self.dismiss()
+            self.selection_cancelled.emit()
 
 
 class ScreenCaptureApp:
     """Main application class for screen capture tool."""
     
+    # Number of recent time-to-overlay samples kept for reporting
+    LATENCY_HISTORY = 100
+    CAPTURE_DELAYS = (3, 5, 10)  # Seconds offered for delayed captures
+    SCROLL = 'scroll'
+    RECORD = 'record'
+    
     def __init__(self):
         self.tray_icon = None
         self.annotation_windows = []
-        self.overlay = None  # Store overlay to prevent garbage collection
-        self.screenshot = None  # Store screenshot for reuse
+        self.overlay = None  # Warm-standby overlay, reused for every capture
+        self.frame = None  # SharedFrame of the capture in progress
+        self.selection_mode = None  # Mode of the capture in progress: SCROLL, RECORD or None
+        self.scrolling_capture = None
+        self.recorder = None
+        self.saver = ImageSaver()  # Writes recordings in the background
+        self.saver.saved.connect(self.on_recording_saved)
+        self.saver.failed.connect(self.on_recording_failed)
         self.hotkey_registered = False
-        self.listener_thread = None  # Track listener thread
+        self.grab_method = 0  # Index of the grab method that last succeeded
+        self.capture_started_at = None  # perf_counter() when the capture was requested
+        self.overlay_latencies = deque(maxlen=self.LATENCY_HISTORY)  # Seconds
+        self.memory_budget = MemoryBudget()  # Demotes idle pinned windows
+        self.memory_action = None
+        self.scheduler_action = None
+        # Every capture request goes through the scheduler, one capture at a time
+        self.scheduler = CaptureScheduler()
+        self.scheduler.triggered.connect(self.start_capture)
+        self.history = CaptureHistory()  # Every capture, stored in the background
+        self.history_browser = None  # Created on first use
+        self.setup_overlay()
         self.setup_tray_icon()
         self.setup_hotkeys()
         
+    def setup_overlay(self):
+        """Create the selection overlay once and keep it hidden until needed."""
+        self.overlay = SelectionOverlay()
+        self.overlay.selection_made.connect(self.on_selection_made)
+        self.overlay.selection_cancelled.connect(self.release_frame)
+        self.overlay.overlay_shown.connect(self.on_overlay_shown)
+        self.overlay.winId()  # Create the native window now rather than on first capture
+        
     def setup_tray_icon(self):
         """Set up system tray icon."""
         self.tray_icon = QSystemTrayIcon()
@@ -138,9 +309,45 @@ class ScreenCaptureApp:
         menu = QMenu()
         
         capture_action = QAction("Capture Screen (ALT+F2)", None)
-        capture_action.triggered.connect(self.start_capture)
+        capture_action.triggered.connect(lambda: self.scheduler.request())
         menu.addAction(capture_action)
         
+        scrolling_action = QAction("Scrolling Capture", None)
+        scrolling_action.triggered.connect(self.start_scrolling_capture)
+        menu.addAction(scrolling_action)
+        
+        record_action = QAction("Record Region", None)
+        record_action.triggered.connect(self.start_recording)
+        menu.addAction(record_action)
+        
+        delayed_menu = menu.addMenu("Delayed Capture")
+        for delay in self.CAPTURE_DELAYS:
+            delay_action = delayed_menu.addAction(f"In {delay} seconds")
+            delay_action.triggered.connect(lambda checked, delay=delay: self.scheduler.schedule(delay))
+        delayed_menu.addSeparator()
+        delayed_menu.addAction("Cancel Pending").triggered.connect(self.scheduler.cancel_pending)
+        
+        open_session_action = QAction("Open Session...", None)
+        open_session_action.triggered.connect(self.open_session)
+        menu.addAction(open_session_action)
+        
+        history_action = QAction("Capture History...", None)
+        history_action.triggered.connect(self.show_history)
+        menu.addAction(history_action)
+        
+        menu.addSeparator()
+        
+        # Memory use of pinned windows, refreshed whenever the menu opens
+        self.memory_action = QAction("Memory: -", None)
+        self.memory_action.setEnabled(False)
+        menu.addAction(self.memory_action)
+        menu.aboutToShow.connect(self.update_memory_action)
+        
+        self.scheduler_action = QAction("Captures: -", None)
+        self.scheduler_action.setEnabled(False)
+        menu.addAction(self.scheduler_action)
+        menu.aboutToShow.connect(self.update_scheduler_action)
+        
         menu.addSeparator()
         
         quit_action = QAction("Quit", None)
@@ -153,15 +360,26 @@ class ScreenCaptureApp:
         # Set tooltip
         self.tray_icon.setToolTip("Screen Capture Tool - Press ALT+F2 to capture")
         
+    def update_memory_action(self):
+        """Show the pinned windows' memory footprint in the tray menu."""
+        stats = self.memory_budget.stats()
+        mb = 1024 * 1024
+        self.memory_action.setText(
+            f"Memory: {stats['resident_bytes'] / mb:.1f} MB in {stats['windows']} pins, "
+            f"{(stats['compressed_bytes'] + stats['spilled_bytes']) / mb:.1f} MB compressed "
+            f"({stats['spilled_bytes'] / mb:.1f} MB on disk), {stats['evictions']} evictions")
+        
+    def update_scheduler_action(self):
+        """Show the capture queue in the tray menu."""
+        stats = self.scheduler.stats()
+        self.scheduler_action.setText(
+            f"Captures: {stats['queue_depth']} pending, {stats['fired']} taken, "
+            f"{stats['dropped']} duplicate requests dropped")
+        
     def setup_hotkeys(self):
         """Set up global hotkeys."""
         try:
-            # Start keyboard listener in background thread (only if not already started)
-            if self.listener_thread is None or not self.listener_thread.is_alive():
-                self.listener_thread = threading.Thread(target=self._run_keyboard_listener, daemon=True)
-                self.listener_thread.start()
-            
-            # Register hotkey after listener is running
+            # The keyboard library runs its own hook thread; nothing needs to wait on it
             keyboard.add_hotkey('alt+f2', self._on_hotkey_pressed)
             self.hotkey_registered = True
             logger.info("ALT+F2 hotkey registered successfully")
@@ -170,13 +388,6 @@ class ScreenCaptureApp:
             logger.info("This may require administrator privileges on Windows.")
             logger.info("You can still use the tray icon menu to capture.")
     
-    def _run_keyboard_listener(self):
-        """Run the keyboard listener (runs in background thread)."""
-        try:
-            keyboard.wait()
-        except Exception as e:
-            logger.error(f"Keyboard listener error: {e}")
-    
     def cleanup(self):
         """Clean up resources before exit."""
         if self.hotkey_registered:
@@ -188,80 +399,336 @@ class ScreenCaptureApp:
     def _on_hotkey_pressed(self):
         """Callback for hotkey press (runs in keyboard listener thread)."""
         logger.info("ALT+F2 pressed - starting capture...")
-        # Queue the capture on the Qt main thread to avoid threading issues
-        QTimer.singleShot(0, self.start_capture)
+        # The scheduler moves the request to the Qt main thread and drops repeats
+        self.scheduler.request()
     
-    def start_capture(self):
-        """Start the screen capture process (must run on Qt main thread)."""
+    def start_capture(self, requested_at=None, mode=None):
+        """Start the screen capture process (must run on Qt main thread).
+        
+        Called by the scheduler, which must be told through finish() once
+        the capture is over; release_frame() does that. mode is SCROLL or
+        RECORD to do more with the selection than pin it.
+        """
+        self.selection_mode = mode
         try:
-            logger.info("Capturing screen...")
-            # Take screenshot of primary screen using the most reliable method
-            screen = QGuiApplication.primaryScreen()
-            if screen is None:
-                logger.error("No screen found")
-                return
-            
-            # Try multiple methods to capture screen (for cross-platform compatibility)
-            self.screenshot = None
+            self.capture_started_at = requested_at if requested_at is not None else time.perf_counter()
             
-            # Method 1: Capture entire virtual screen (most reliable on Windows)
-            try:
-                self.screenshot = screen.grabWindow(0, 
-                                                   screen.geometry().x(),
-                                                   screen.geometry().y(),
-                                                   screen.geometry().width(),
-                                                   screen.geometry().height())
-            except Exception as e:
-                logger.debug(f"Screen capture method 1 failed: {e}")
-            
-            # Method 2: Use desktop widget (fallback)
-            if self.screenshot is None or self.screenshot.isNull():
-                try:
-                    desktop = QApplication.desktop()
-                    self.screenshot = screen.grabWindow(desktop.winId())
-                except Exception as e:
-                    logger.debug(f"Screen capture method 2 failed: {e}")
-            
-            # Method 3: Use screen geometry directly (last resort)
-            if self.screenshot is None or self.screenshot.isNull():
-                try:
-                    geometry = screen.geometry()
-                    self.screenshot = screen.grabWindow(QApplication.desktop().winId(),
-                                                       geometry.x(), geometry.y(),
-                                                       geometry.width(), geometry.height())
-                except Exception as e:
-                    logger.debug(f"Screen capture method 3 failed: {e}")
+            logger.info("Capturing screen...")
+            screenshot, geometry = self.grab_virtual_desktop()
             
-            if self.screenshot is None or self.screenshot.isNull():
+            if screenshot is None:
                 logger.error("All screenshot capture methods failed")
+                self.capture_started_at = None
+                self.release_frame()
                 return
             
-            logger.info(f"Screenshot captured successfully: {self.screenshot.width()}x{self.screenshot.height()}")
+            logger.info(f"Screenshot captured successfully: {screenshot.width()}x{screenshot.height()}")
             
-            # Show selection overlay
-            self.overlay = SelectionOverlay(self.screenshot)
-            self.overlay.selection_made.connect(self.on_selection_made)
+            # The overlay shares the frame's pixels rather than copying them
+            self.frame = SharedFrame(screenshot, geometry)
+            
+            # Show selection overlay across every screen (plain full screen if only one)
+            multi_screen = len(QGuiApplication.screens()) > 1
+            self.overlay.start(screenshot, geometry if multi_screen else None)
             logger.debug("Selection overlay displayed")
         except Exception as e:
+            self.capture_started_at = None
+            self.release_frame()
             logger.error(f"Error capturing screen: {e}", exc_info=True)
+            
+    def grab_virtual_desktop(self):
+        """Grab every screen into one image of the whole virtual desktop.
+        
+        Returns (pixmap, geometry), where geometry is the virtual-desktop
+        rectangle in logical pixels. The pixmap is at the highest device pixel
+        ratio among the screens, so the densest screen keeps its native
+        resolution, and its devicePixelRatio is set accordingly. Returns
+        (None, QRect()) if nothing could be grabbed.
+        """
+        # QScreen grabs must run on the GUI thread, so screens are grabbed in turn
+        grabs = []
+        for screen in QGuiApplication.screens():
+            pixmap = self.grab_screen(screen)
+            if pixmap is None:
+                logger.warning(f"Could not capture screen {screen.name()}")
+                continue
+            grabs.append((screen.geometry(), pixmap))
+            
+        if not grabs:
+            return None, QRect()
+        
+        # Single screen: use the grab as-is, no stitching needed
+        if len(grabs) == 1:
+            geometry, pixmap = grabs[0]
+            pixmap.setDevicePixelRatio(pixmap.width() / geometry.width())
+            return pixmap, geometry
+        
+        virtual = QRect()
+        for geometry, _ in grabs:
+            virtual = virtual.united(geometry)
+        ratio = max(pixmap.width() / geometry.width() for geometry, pixmap in grabs)
+        
+        desktop = QPixmap(scale_rect(QRect(QPoint(0, 0), virtual.size()), ratio).size())
+        desktop.setDevicePixelRatio(ratio)
+        desktop.fill(Qt.black)  # Areas not covered by any screen
+        
+        painter = QPainter(desktop)
+        painter.setRenderHint(QPainter.SmoothPixmapTransform)
+        for geometry, pixmap in grabs:
+            target = QRectF(geometry.translated(-virtual.topLeft()))
+            painter.drawPixmap(target, pixmap, QRectF(pixmap.rect()))
+        painter.end()
+        
+        return desktop, virtual
+        
+    def grab_screen(self, screen):
+        """Grab a screen, trying the method that worked last time first.
+        
+        Returns the screenshot pixmap, or None if every method failed.
+        """
+        geometry = screen.geometry()
+        single_screen = len(QGuiApplication.screens()) == 1
+        methods = [
+            # Method 1: Capture the screen itself, offsets are relative to it
+            # (most reliable on Windows)
+            lambda: screen.grabWindow(0, 0, 0, geometry.width(), geometry.height()),
+            # Method 2: Use desktop widget (fallback, it spans every screen)
+            lambda: screen.grabWindow(QApplication.desktop().winId()) if single_screen else None,
+            # Method 3: Use screen geometry directly (last resort)
+            lambda: screen.grabWindow(QApplication.desktop().winId(),
+                                      geometry.x(), geometry.y(),
+                                      geometry.width(), geometry.height()),
+        ]
+        
+        # Try multiple methods to capture screen (for cross-platform compatibility)
+        order = [self.grab_method] + [i for i in range(len(methods)) if i != self.grab_method]
+        for index in order:
+            try:
+                screenshot = methods[index]()
+            except Exception as e:
+                logger.debug(f"Screen capture method {index + 1} failed: {e}")
+                continue
+            
+            if screenshot is not None and not screenshot.isNull():
+                if index != self.grab_method:
+                    logger.info(f"Screen capture method {index + 1} will be tried first from now on")
+                    self.grab_method = index
+                return screenshot
+            logger.debug(f"Screen capture method {index + 1} returned an empty image")
+            
+        return None
+        
+    def on_overlay_shown(self):
+        """Record the time from capture request to the overlay's first paint."""
+        if self.capture_started_at is None:
+            return
+        
+        latency = time.perf_counter() - self.capture_started_at
+        self.capture_started_at = None
+        self.overlay_latencies.append(latency)
+        logger.info(f"Selection overlay shown in {latency * 1000:.1f} ms")
+        
+    def overlay_latency_stats(self):
+        """Return (last, median, worst) time-to-overlay in milliseconds, or None."""
+        if not self.overlay_latencies:
+            return None
+        
+        ordered = sorted(self.overlay_latencies)
+        return (self.overlay_latencies[-1] * 1000,
+                ordered[len(ordered) // 2] * 1000,
+                ordered[-1] * 1000)
         
     def on_selection_made(self, rect):
         """Handle the selection completion."""
-        # Use the stored screenshot instead of capturing again
-        if self.screenshot is None:
+        # Use the stored frame instead of capturing again
+        if self.frame is None or self.frame.is_released:
             return
         
-        # Crop to selected region
-        cropped = self.screenshot.copy(rect)
+        if self.selection_mode is not None:
+            mode = self.selection_mode
+            region = QRect(self.frame.position(rect), rect.size())
+            self.release_frame()
+            if mode == self.SCROLL:
+                self.begin_scrolling_capture(region)
+            else:
+                self.begin_recording(region)
+            return
         
-        # Clear the stored screenshot to free memory
-        self.screenshot = None
+        # Crop to selected region, in physical pixels; a full-frame crop shares its pixels
+        cropped = self.frame.crop(rect)
+        position = self.frame.position(rect)
         
-        # Open annotation window
-        annotation_window = AnnotationWindow(cropped, rect.topLeft())
+        self.release_frame()
+        
+        # Open annotation window where the region was on the virtual desktop
+        self.history.add(cropped, position)
+        self.pin_window(AnnotationWindow(cropped, position))
+        
+    def start_scrolling_capture(self):
+        """Select a region, then capture it repeatedly while the user scrolls."""
+        if self.scrolling_capture is not None:
+            logger.info("A scrolling capture is already running")
+            return
+        self.scheduler.request(self.SCROLL)
+        
+    def begin_scrolling_capture(self, region):
+        """Start grabbing region (virtual-desktop coordinates) for a scrolling capture."""
+        logger.info(f"Scrolling capture of {region.width()}x{region.height()} started")
+        self.scrolling_capture = ScrollingCapture(lambda: grab_region(region))
+        self.scrolling_capture.finished.connect(
+            lambda image: self.on_scrolling_capture_finished(image, region.topLeft()))
+        self.scrolling_capture.destroyed.connect(self.on_scrolling_capture_destroyed)
+        ScrollCaptureControl(self.scrolling_capture, region).show()
+        self.scrolling_capture.start()
+        
+    def on_scrolling_capture_finished(self, image, position):
+        """Pin the stitched result of a scrolling capture."""
+        self.scrolling_capture.deleteLater()
+        if image.isNull():
+            logger.info("Scrolling capture cancelled or empty")
+            return
+        
+        screenshot = QPixmap.fromImage(image)
+        screenshot.setDevicePixelRatio(image.devicePixelRatio())
+        self.history.add(screenshot, position)
+        self.pin_window(AnnotationWindow(screenshot, position))
+        
+    def on_scrolling_capture_destroyed(self):
+        self.scrolling_capture = None
+        
+    def start_recording(self):
+        """Select a region, then record it to an animated image."""
+        if self.recorder is not None:
+            logger.info("A recording is already running")
+            return
+        self.scheduler.request(self.RECORD)
+        
+    def begin_recording(self, region):
+        """Start recording region (virtual-desktop coordinates)."""
+        logger.info(f"Recording {region.width()}x{region.height()} started")
+        self.recorder = RegionRecorder(lambda: grab_region(region))
+        self.recorder.stopped.connect(self.on_recording_stopped)
+        self.recorder.cancelled.connect(self.discard_recorder)
+        RecordingControl(self.recorder, region).show()
+        self.recorder.start()
+        
+    def on_recording_stopped(self):
+        """Ask where to save the recording and encode it in the background."""
+        file_path, _ = QFileDialog.getSaveFileName(None, "Save Recording", "recording.webp",
+                                                   RECORDING_FILTER)
+        if not file_path:
+            self.recorder.cancel()  # Stops its worker thread, then discards it through cancelled
+            return
+        self.recorder.save(self.saver, file_path)
+        self.discard_recorder()
+        
+    def discard_recorder(self):
+        if self.recorder is not None:
+            self.recorder.deleteLater()
+            self.recorder = None
+        
+    def on_recording_saved(self, file_path):
+        logger.info(f"Recording saved to {file_path}")
+        self.tray_icon.showMessage("Recording Saved", file_path)
+        
+    def on_recording_failed(self, file_path, error):
+        logger.error(f"Could not save recording {file_path}: {error}")
+        self.tray_icon.showMessage("Recording", f"Could not save {file_path}: {error}",
+                                   QSystemTrayIcon.Warning)
+        
+    def release_frame(self):
+        """Drop the capture so the full frame is freed once nothing shares it.
+        
+        This ends the capture, so the scheduler may start the next one.
+        """
+        if self.frame is not None:
+            self.frame.release()
+            self.frame = None
+        self.selection_mode = None
+        self.scheduler.finish()
+        
+    def pin_window(self, annotation_window):
+        """Show an annotation window and track it until it is closed."""
         annotation_window.destroyed.connect(lambda: self.remove_window(annotation_window))
         annotation_window.show()
         self.annotation_windows.append(annotation_window)
+        self.memory_budget.register(annotation_window)
+        
+    def open_session(self):
+        """Ask for a session file and reopen it as a pinned window."""
+        file_path, _ = QFileDialog.getOpenFileName(None, "Open Session", "", SESSION_FILTER)
+        if file_path:
+            self.open_session_file(file_path)
+            
+    def open_session_file(self, file_path):
+        """Reopen a session file with its annotations still editable."""
+        try:
+            # The window shows the mapped pixels and closes the session when it closes
+            session = Session(file_path)
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not open session {file_path}: {e}")
+            self.tray_icon.showMessage("Open Session", f"Could not open {file_path}: {e}",
+                                       QSystemTrayIcon.Warning)
+            return None
+        
+        logger.info(f"Opened session {file_path} with {len(session.annotations)} annotations")
+        position = QPoint(*session.position) if session.position else None
+        annotation_window = AnnotationWindow(session.pixmap(), position, session.annotations, session)
+        self.pin_window(annotation_window)
+        return annotation_window
+    
+    def pin_file(self, file_path):
+        """Pin an image file, or reopen a session file; returns the window or None."""
+        if file_path.lower().endswith(SESSION_EXTENSION):
+            return self.open_session_file(file_path)
+        
+        screenshot = QPixmap(file_path)
+        if screenshot.isNull():
+            logger.error(f"Could not open image {file_path}")
+            return None
+        annotation_window = AnnotationWindow(screenshot)
+        self.pin_window(annotation_window)
+        return annotation_window
+    
+    def instance_commands(self):
+        """Return the commands later invocations may send, as name -> handler(args)."""
+        def pin_files(args):
+            if not args:
+                raise ValueError("pin-file needs a file path")
+            if not all(isinstance(file_path, str) for file_path in args):
+                raise ValueError("pin-file takes file paths")
+            failed = [file_path for file_path in args if self.pin_file(file_path) is None]
+            if failed:
+                raise ValueError(f"Could not open {', '.join(failed)}")
+        
+        return {
+            'capture': lambda args: self.scheduler.request(),
+            'pin-file': pin_files,
+            'open-history': lambda args: self.show_history(),
+            # Quit once the reply has gone out
+            'quit': lambda args: QTimer.singleShot(0, qApp.quit),
+        }
+    
+    def show_history(self):
+        """Open the capture history browser."""
+        if self.history_browser is None:
+            self.history_browser = HistoryBrowser(self.history)
+            self.history_browser.entry_activated.connect(self.open_history_entry)
+        self.history_browser.show()
+        self.history_browser.raise_()
+        self.history_browser.activateWindow()
+        
+    def open_history_entry(self, entry):
+        """Pin a capture from the history again."""
+        screenshot = self.history.load(entry)
+        if screenshot is None:
+            logger.error(f"Capture {entry.digest} is missing from the history")
+            return None
+        
+        position = QPoint(*entry.position) if entry.position else None
+        annotation_window = AnnotationWindow(screenshot, position)
+        self.pin_window(annotation_window)
+        return annotation_window
     
     def remove_window(self, window):
         """Remove closed annotation window from the list."""
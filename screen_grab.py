@@ -0,0 +1,62 @@
+"""
+Screen grabbing without widgets.
+
+Needs only a QGuiApplication, so the command-line capture can use it
+without loading QtWidgets or the rest of the GUI.
+"""
+
+import logging
+from PyQt5.QtCore import Qt, QRect, QRectF
+from PyQt5.QtGui import QGuiApplication, QPainter, QPixmap
+
+logger = logging.getLogger(__name__)
+
+
+def virtual_geometry():
+    """Return the virtual-desktop rectangle spanned by every screen, in logical pixels."""
+    virtual = QRect()
+    for screen in QGuiApplication.screens():
+        virtual = virtual.united(screen.geometry())
+    return virtual
+
+
+def grab_region(region):
+    """Grab a virtual-desktop region (logical pixels), or return None.
+
+    A region spanning several screens is assembled at the highest device
+    pixel ratio among them; areas outside every screen are black. The
+    pixmap's devicePixelRatio is set to match.
+    """
+    grabs = []
+    for screen in QGuiApplication.screens():
+        geometry = screen.geometry()
+        part = region.intersected(geometry)
+        if part.isEmpty():
+            continue
+        local = part.translated(-geometry.topLeft())
+        pixmap = screen.grabWindow(0, local.x(), local.y(), local.width(), local.height())
+        if pixmap.isNull():
+            logger.debug(f"Could not capture screen {screen.name()}")
+            continue
+        grabs.append((part, pixmap))
+
+    if not grabs:
+        return None
+
+    if len(grabs) == 1 and grabs[0][0] == region:
+        part, pixmap = grabs[0]
+        pixmap.setDevicePixelRatio(pixmap.width() / part.width())
+        return pixmap
+
+    ratio = max(pixmap.width() / part.width() for part, pixmap in grabs)
+    result = QPixmap(round(region.width() * ratio), round(region.height() * ratio))
+    result.setDevicePixelRatio(ratio)
+    result.fill(Qt.black)
+
+    painter = QPainter(result)
+    painter.setRenderHint(QPainter.SmoothPixmapTransform)
+    for part, pixmap in grabs:
+        target = QRectF(part.translated(-region.topLeft()))
+        painter.drawPixmap(target, pixmap, QRectF(pixmap.rect()))
+    painter.end()
+    return result
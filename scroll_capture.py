@@ -0,0 +1,305 @@
+"""
+Scrolling (long screenshot) capture.
+
+The selected region is grabbed repeatedly while the user scrolls. Each
+frame is reduced to one hash per pixel row, and the scroll distance between
+consecutive frames is found by matching those hashes; the rows that scrolled
+into view are appended to the result. All of the matching is vectorized
+with NumPy and runs on a worker thread, so grabbing keeps its pace.
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PyQt5 import sip
+from PyQt5.QtWidgets import QWidget, QHBoxLayout, QLabel, QPushButton
+from PyQt5.QtCore import Qt, QObject, QTimer, QPoint, pyqtSignal
+from PyQt5.QtGui import QImage
+
+logger = logging.getLogger(__name__)
+
+_weights = {}  # Width -> per-column hash weights
+
+
+def image_to_array(image):
+    """Copy a QImage's pixels into a (height, width) uint32 array."""
+    if image.format() not in (QImage.Format_RGB32, QImage.Format_ARGB32,
+                              QImage.Format_ARGB32_Premultiplied):
+        image = image.convertToFormat(QImage.Format_RGB32)
+    bits = image.constBits()
+    bits.setsize(image.sizeInBytes())
+    rows = np.frombuffer(bits, np.uint32).reshape(image.height(), image.bytesPerLine() // 4)
+    return rows[:, :image.width()].copy()
+
+
+def array_to_image(pixels):
+    """Return a QImage owning a copy of a (height, width) uint32 array."""
+    pixels = np.ascontiguousarray(pixels, dtype=np.uint32)
+    height, width = pixels.shape
+    image = QImage(sip.voidptr(pixels.ctypes.data), width, height, width * 4, QImage.Format_RGB32)
+    return image.copy()  # The array's buffer is only borrowed until here
+
+
+def row_hashes(pixels):
+    """Return one uint64 hash per row of a (height, width) uint32 array.
+
+    Each row is a weighted sum of its pixels with fixed random odd weights,
+    wrapping modulo 2**64; rows with equal hashes are equal in practice.
+    """
+    width = pixels.shape[1]
+    weights = _weights.get(width)
+    if weights is None:
+        rng = np.random.default_rng(width)
+        weights = rng.integers(1, 2 ** 63, size=width, dtype=np.uint64) | np.uint64(1)
+        _weights[width] = weights
+    return (pixels.astype(np.uint64) * weights).sum(axis=1, dtype=np.uint64)
+
+
+def find_scroll_offset(previous, current, min_overlap, min_match=0.95, anchors=8):
+    """Find how far content scrolled between two frames, from their row hashes.
+
+    Rows equal at the same position at the top and bottom of both frames are
+    treated as fixed headers and footers and left out of the match. Returns
+    (offset, top, bottom): the content in rows top..bottom moved up by offset
+    rows (0 if nothing changed). Returns None if no downward scroll with at
+    least min_overlap rows in common and min_match of them equal was found.
+    """
+    same = previous == current
+    if same.all():
+        return 0, 0, len(current)
+
+    top = int(np.argmin(same))
+    bottom = len(current) - int(np.argmin(same[::-1]))
+    previous_band = previous[top:bottom]
+    current_band = current[top:bottom]
+    band = bottom - top
+
+    # Anchor on rows that occur once in the frame, so each gives few candidates
+    _, first_index, counts = np.unique(current_band, return_index=True, return_counts=True)
+    anchor_rows = np.sort(first_index[counts == 1])[:anchors]
+
+    best_score, best_offset = 0.0, None
+    for anchor in anchor_rows:
+        for position in np.flatnonzero(previous_band == current_band[anchor]):
+            offset = int(position - anchor)
+            overlap = band - offset
+            if offset <= 0 or overlap < min_overlap:
+                continue
+            score = np.count_nonzero(previous_band[offset:] == current_band[:overlap]) / overlap
+            if score > best_score:
+                best_score, best_offset = score, offset
+        if best_score >= min_match:
+            break
+
+    if best_offset is None or best_score < min_match:
+        return None
+    return best_offset, top, bottom
+
+
+class FrameStitcher:
+    """Stitches frames of a scrolling region into one tall image."""
+
+    MIN_OVERLAP = 0.1  # Fraction of the frame height frames must share
+
+    def __init__(self):
+        self.strips = []  # Row arrays, top to bottom
+        self.reference = None  # Last frame that was stitched
+        self.reference_hashes = None
+        self.footer_rows = 0  # Fixed rows at the bottom of every frame
+        self.frames = 0
+        self.skipped = 0
+
+    @property
+    def height(self):
+        return sum(len(strip) for strip in self.strips)
+
+    def add(self, pixels):
+        """Add a frame. Returns True if it contributed new rows."""
+        hashes = row_hashes(pixels)
+        if self.reference is None:
+            self.strips.append(pixels)
+            self.reference, self.reference_hashes = pixels, hashes
+            self.frames += 1
+            return True
+
+        if pixels.shape != self.reference.shape:
+            self.skipped += 1
+            return False
+
+        min_overlap = max(8, int(len(pixels) * self.MIN_OVERLAP))
+        match = find_scroll_offset(self.reference_hashes, hashes, min_overlap)
+        if match is None:
+            self.skipped += 1
+            return False
+
+        offset, _, bottom = match
+        if offset == 0:
+            return False
+
+        # The rows that scrolled into view sit at the bottom of the moving band
+        self.strips.append(pixels[bottom - offset:bottom].copy())
+        self.footer_rows = len(pixels) - bottom
+        self.reference, self.reference_hashes = pixels, hashes
+        self.frames += 1
+        return True
+
+    def result(self):
+        """Return the stitched (height, width) array, or None if nothing was added."""
+        if not self.strips:
+            return None
+        if len(self.strips) == 1 or not self.footer_rows:
+            return np.concatenate(self.strips)
+
+        # The first frame's footer moves to the very bottom
+        first = self.strips[0]
+        footer = self.reference[len(self.reference) - self.footer_rows:]
+        return np.concatenate([first[:len(first) - self.footer_rows], *self.strips[1:], footer])
+
+
+class ScrollingCapture(QObject):
+    """Grabs a region at a fixed rate and stitches the frames in the background.
+
+    grab is called on the GUI thread and returns a QPixmap or None. Frames
+    are skipped rather than queued when stitching falls behind.
+    """
+
+    progress = pyqtSignal(int, int)  # Frames stitched, stitched height in device pixels
+    finished = pyqtSignal(QImage)  # Stitched result; null if nothing was captured
+
+    INTERVAL_MS = 100  # 10 grabs per second
+    MAX_PENDING = 2  # Frames waiting for the stitcher before grabs are skipped
+
+    def __init__(self, grab, interval_ms=INTERVAL_MS, parent=None):
+        super().__init__(parent)
+        self.grab = grab
+        self.stitcher = FrameStitcher()
+        self.device_pixel_ratio = 1.0
+        self.grabs_skipped = 0
+        self.pending = threading.Semaphore(self.MAX_PENDING)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='scroll-stitcher')
+
+        self.timer = QTimer(self)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.setInterval(interval_ms)
+        self.timer.timeout.connect(self.grab_frame)
+
+    def start(self):
+        self.grab_frame()
+        self.timer.start()
+
+    def grab_frame(self):
+        """Grab one frame and queue it for stitching."""
+        if not self.pending.acquire(blocking=False):
+            self.grabs_skipped += 1
+            return
+
+        pixmap = self.grab()
+        if pixmap is None or pixmap.isNull():
+            self.pending.release()
+            return
+
+        self.device_pixel_ratio = pixmap.devicePixelRatio()
+        self.executor.submit(self._stitch, pixmap.toImage())
+
+    def _stitch(self, image):
+        """Add a frame to the stitcher (runs on the worker thread)."""
+        try:
+            if self.stitcher.add(image_to_array(image)):
+                self._emit(self.progress, self.stitcher.frames, self.stitcher.height)
+        except Exception as e:
+            logger.error(f"Could not stitch frame: {e}", exc_info=True)
+        finally:
+            self.pending.release()
+
+    def stop(self):
+        """Stop grabbing and emit finished once queued frames are stitched."""
+        self.timer.stop()
+        self.executor.submit(self._finish)
+        self.executor.shutdown(wait=False)
+
+    def cancel(self):
+        """Stop grabbing, discard the frames and emit finished with a null image."""
+        self.timer.stop()
+        self.executor.shutdown(wait=False)
+        self.finished.emit(QImage())
+
+    def _finish(self):
+        """Assemble the result (runs on the worker thread)."""
+        pixels = self.stitcher.result()
+        image = array_to_image(pixels) if pixels is not None else QImage()
+        image.setDevicePixelRatio(self.device_pixel_ratio)
+        logger.info(f"Scrolling capture stitched {self.stitcher.frames} frames into "
+                    f"{image.width()}x{image.height()} ({self.stitcher.skipped} unmatched, "
+                    f"{self.grabs_skipped} grabs skipped)")
+        self._emit(self.finished, image)
+
+    @staticmethod
+    def _emit(signal, *args):
+        """Emit a signal, ignoring a receiver that was deleted meanwhile."""
+        try:
+            signal.emit(*args)
+        except RuntimeError:
+            pass
+
+
+class ScrollCaptureControl(QWidget):
+    """Small panel shown next to the region while a scrolling capture runs.
+
+    Works with any capture object providing progress(int, int), stop() and
+    cancel(); subclasses change PROMPT and progress_text() to suit.
+    """
+
+    MARGIN = 8
+    PROMPT = "Scroll the content to capture it"
+
+    def __init__(self, capture, region):
+        super().__init__()
+        self.capture = capture
+        self.setWindowFlags(Qt.WindowStaysOnTopHint | Qt.FramelessWindowHint | Qt.Tool)
+        self.setAttribute(Qt.WA_DeleteOnClose)
+        self.setStyleSheet("""
+            QWidget { background-color: #2d2d30; color: white; }
+            QPushButton {
+                background-color: #3e3e42;
+                border: 1px solid #555;
+                padding: 5px;
+            }
+            QPushButton:hover { background-color: #007acc; }
+        """)
+
+        layout = QHBoxLayout()
+        layout.setContentsMargins(6, 4, 6, 4)
+        self.label = QLabel(self.PROMPT)
+        layout.addWidget(self.label)
+        stop_button = QPushButton("✔ Done")
+        stop_button.clicked.connect(self.stop)
+        layout.addWidget(stop_button)
+        cancel_button = QPushButton("❌ Cancel")
+        cancel_button.clicked.connect(self.cancel)
+        layout.addWidget(cancel_button)
+        self.setLayout(layout)
+        self.adjustSize()
+
+        # Keep the panel out of the grabbed region: below it, or above if there is no room
+        below = QPoint(region.left(), region.bottom() + self.MARGIN)
+        screen = self.screen().availableGeometry() if self.screen() else None
+        if screen is not None and below.y() + self.height() > screen.bottom():
+            below = QPoint(region.left(), region.top() - self.height() - self.MARGIN)
+        self.move(below)
+
+        capture.progress.connect(self.on_progress)
+
+    def progress_text(self, frames, height):
+        return f"{frames} frames, {height} px"
+
+    def on_progress(self, first, second):
+        self.label.setText(self.progress_text(first, second))
+
+    def stop(self):
+        self.capture.stop()
+        self.close()
+
+    def cancel(self):
+        self.capture.cancel()
+        self.close()
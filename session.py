@@ -0,0 +1,150 @@
+"""
+Session files: an original capture plus its editable annotations.
+
+Layout:
+    8 bytes   magic, b'SCSESS01'
+    4 bytes   header length, little-endian
+    n bytes   JSON header (image geometry, window position, annotations)
+    padding   up to PIXEL_ALIGNMENT
+    pixels    raw QImage scanlines, uncompressed
+
+The pixel data is never compressed, so opening a session memory-maps the
+file and wraps the mapped scanlines in a QImage without decoding anything;
+only the pages that are actually read get loaded from disk.
+"""
+
+import json
+import mmap
+import ctypes
+import struct
+from PyQt5 import sip
+from PyQt5.QtGui import QImage, QPixmap
+
+from annotation_model import deserialize
+from image_saver import write_atomic
+
+MAGIC = b'SCSESS01'
+PIXEL_ALIGNMENT = 4096  # Page-aligned pixels so they can be mapped directly
+FILE_FILTER = "Capture Sessions (*.scsession)"
+EXTENSION = '.scsession'
+# 32-bit formats the pixels are stored in; others are converted when writing
+PIXEL_FORMATS = (QImage.Format_RGB32, QImage.Format_ARGB32, QImage.Format_ARGB32_Premultiplied)
+
+
+def write_session(file_path, image, annotation_data, position=None, device_pixel_ratio=1.0):
+    """Write a capture and its annotations to file_path atomically.
+
+    annotation_data is the output of annotation_model.serialize(), taken on
+    the GUI thread so this can run on a worker thread.
+    """
+    if image.format() not in PIXEL_FORMATS:
+        image = image.convertToFormat(QImage.Format_ARGB32_Premultiplied)
+
+    header = {
+        'width': image.width(),
+        'height': image.height(),
+        'bytes_per_line': image.bytesPerLine(),
+        'format': int(image.format()),
+        'device_pixel_ratio': device_pixel_ratio,
+        'position': [position.x(), position.y()] if position is not None else None,
+        'annotations': annotation_data,
+    }
+    header_bytes = json.dumps(header).encode('utf-8')
+    prefix_size = len(MAGIC) + 4 + len(header_bytes)
+    padding = -prefix_size % PIXEL_ALIGNMENT
+
+    bits = image.constBits()
+    bits.setsize(image.sizeInBytes())
+    write_atomic([MAGIC, struct.pack('<I', len(header_bytes)), header_bytes,
+                  b'\0' * padding, memoryview(bits)], file_path)
+
+
+class Session:
+    """An open session file.
+
+    image() and pixmap() are zero-copy views of the mapped pixels and stay
+    valid until close() is called, so opening a session costs the same
+    whatever the size of its capture.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._file = open(file_path, 'rb')
+        self._map = None
+        self._pixels = None
+        try:
+            magic = self._file.read(len(MAGIC))
+            if magic != MAGIC:
+                raise ValueError(f"not a session file: {file_path}")
+            try:
+                header_size = self._read_header()
+            except (struct.error, KeyError, TypeError, AttributeError, ValueError) as e:
+                raise ValueError(f"not a session file: {file_path} has a damaged header ({e!r})")
+
+            prefix_size = len(MAGIC) + 4 + header_size
+            self._offset = prefix_size + (-prefix_size % PIXEL_ALIGNMENT)
+            if self._offset + self.bytes_per_line * self.height > self._file_size():
+                raise ValueError(f"not a session file: {file_path} is truncated")
+
+            # Copy-on-write mapping: pages are read lazily and the file is never modified
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_COPY)
+            self._pixels = ctypes.c_char.from_buffer(self._map, self._offset)
+        except Exception:
+            self.close()
+            raise
+
+    def _read_header(self):
+        """Read the JSON header into attributes and return its size in bytes."""
+        (header_size,) = struct.unpack('<I', self._file.read(4))
+        header = json.loads(self._file.read(header_size).decode('utf-8'))
+
+        self.width = int(header['width'])
+        self.height = int(header['height'])
+        self.bytes_per_line = int(header['bytes_per_line'])
+        self.format = QImage.Format(header['format'])
+        self.device_pixel_ratio = float(header.get('device_pixel_ratio', 1.0))
+        position = header.get('position')
+        self.position = None if position is None else [int(position[0]), int(position[1])]
+        self.annotations = deserialize(header['annotations'])
+        if self.format not in PIXEL_FORMATS:
+            raise ValueError(f"unsupported pixel format {int(self.format)}")
+        if self.width <= 0 or self.height <= 0 or self.bytes_per_line < self.width * 4:
+            raise ValueError(f"bad image geometry {self.width}x{self.height}, "
+                             f"{self.bytes_per_line} bytes per line")
+        return header_size
+
+    def _file_size(self):
+        self._file.seek(0, 2)
+        return self._file.tell()
+
+    def image(self):
+        """Return a QImage over the mapped pixels, without copying them."""
+        image = QImage(sip.voidptr(ctypes.addressof(self._pixels)), self.width, self.height,
+                       self.bytes_per_line, self.format)
+        image.setDevicePixelRatio(self.device_pixel_ratio)
+        return image
+
+    def pixmap(self):
+        """Return the capture as a QPixmap over the mapped pixels, without copying them.
+
+        Like image(), it is valid only until close(). Painting on it, or a
+        copy of it, detaches the painted pixmap into its own buffer; anything
+        that may outlive the session needs QPixmap.copy().
+        """
+        pixmap = QPixmap.fromImage(self.image())
+        pixmap.setDevicePixelRatio(self.device_pixel_ratio)
+        return pixmap
+
+    def close(self):
+        """Unmap the file. Images returned by image() must no longer be used."""
+        self._pixels = None
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
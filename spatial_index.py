@@ -0,0 +1,85 @@
+"""
+Uniform-grid spatial index over rectangles.
+
+Every item is listed in each grid cell its rectangle overlaps, so a query
+looks only at the items in the cells under the query rectangle rather
+than at every item. Annotations are mostly small next to the capture, so
+a fixed cell size keeps both the cells per item and the items per cell
+low; a large item simply spans more cells.
+
+Items also carry a stacking order, so queries can return the topmost
+item first.
+"""
+
+from PyQt5.QtCore import QRect, QSize
+
+
+class GridIndex:
+    """Maps hashable keys to rectangles and finds those overlapping a region."""
+
+    CELL_SIZE = 128
+
+    def __init__(self, cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}  # (column, row) -> set of keys
+        self.items = {}  # key -> (QRect, order)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def cell_keys(self, rect):
+        """Yield the (column, row) of every cell a rectangle overlaps."""
+        size = self.cell_size
+        for row in range(rect.top() // size, rect.bottom() // size + 1):
+            for column in range(rect.left() // size, rect.right() // size + 1):
+                yield column, row
+
+    def insert(self, key, rect, order):
+        """Add a key, or move it, to rect; higher orders stack above lower ones."""
+        if key in self.items:
+            self.remove(key)
+        self.items[key] = (QRect(rect), order)
+        for cell in self.cell_keys(rect):
+            self.cells.setdefault(cell, set()).add(key)
+
+    def remove(self, key):
+        rect, _ = self.items.pop(key)
+        for cell in self.cell_keys(rect):
+            keys = self.cells[cell]
+            keys.discard(key)
+            if not keys:
+                del self.cells[cell]
+
+    def update(self, key, rect):
+        """Move a key to a new rectangle, keeping its order."""
+        self.insert(key, rect, self.items[key][1])
+
+    def rect(self, key):
+        return self.items[key][0]
+
+    def order(self, key):
+        return self.items[key][1]
+
+    def query(self, rect):
+        """Return the keys whose rectangles intersect rect, topmost first."""
+        found = set()
+        cells = self.cells
+        for cell in self.cell_keys(rect):
+            keys = cells.get(cell)
+            if keys:
+                found.update(keys)
+        items = self.items
+        hits = [key for key in found if items[key][0].intersects(rect)]
+        hits.sort(key=lambda key: items[key][1], reverse=True)
+        return hits
+
+    def at(self, point):
+        """Return the keys whose rectangles contain a point, topmost first."""
+        return self.query(QRect(point, QSize(1, 1)))
+
+    def clear(self):
+        self.cells = {}
+        self.items = {}
@@ -0,0 +1,72 @@
+"""
+Freehand stroke simplification and smoothing for the pen tool.
+"""
+
+from PyQt5.QtCore import QPointF
+from PyQt5.QtGui import QPainterPath
+
+
+def simplify_points(points, tolerance):
+    """Simplify a polyline with the Ramer-Douglas-Peucker algorithm.
+
+    points is a list of (x, y) tuples. Points closer than tolerance to the
+    simplified line are dropped; the first and last points are always kept.
+    """
+    if len(points) < 3 or tolerance <= 0:
+        return list(points)
+
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    tolerance_sq = tolerance * tolerance
+
+    # Iterative to stay clear of the recursion limit on long strokes
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        x1, y1 = points[first]
+        x2, y2 = points[last]
+        dx = x2 - x1
+        dy = y2 - y1
+        length_sq = dx * dx + dy * dy
+
+        farthest = -1
+        max_dist_sq = tolerance_sq
+        for i in range(first + 1, last):
+            px, py = points[i]
+            if length_sq == 0:
+                dist_sq = (px - x1) ** 2 + (py - y1) ** 2
+            else:
+                cross = dx * (py - y1) - dy * (px - x1)
+                dist_sq = cross * cross / length_sq
+            if dist_sq > max_dist_sq:
+                max_dist_sq = dist_sq
+                farthest = i
+
+        if farthest != -1:
+            keep[farthest] = True
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def stroke_path(points, smooth=False):
+    """Build a QPainterPath through points.
+
+    With smooth, the corners of the polyline are rounded off with quadratic
+    curves through the midpoints of consecutive segments.
+    """
+    path = QPainterPath()
+    if not points:
+        return path
+
+    path.moveTo(*points[0])
+    if not smooth or len(points) < 3:
+        for x, y in points[1:]:
+            path.lineTo(x, y)
+        return path
+
+    for (x1, y1), (x2, y2) in zip(points[1:-1], points[2:]):
+        path.quadTo(QPointF(x1, y1), QPointF((x1 + x2) / 2, (y1 + y2) / 2))
+    path.lineTo(*points[-1])
+    return path
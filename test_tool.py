@@ -2,8 +2,20 @@
 Example usage and testing script for the screen capture tool.
 """
 
+import os
 import sys
 
+_app = None
+
+
+def get_app():
+    """Return a QApplication, using the offscreen platform when headless."""
+    global _app
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt5.QtWidgets import QApplication
+    _app = QApplication.instance() or QApplication(sys.argv)
+    return _app
+
 
 def test_imports():
     """Test that all modules can be imported."""
@@ -44,6 +56,1204 @@ def test_class_definitions():
         return False
 
 
+def test_layered_rendering():
+    """Test that incremental commits match a full re-render of the annotations."""
+    try:
+        get_app()
+        from PyQt5.QtCore import QPoint
+        from PyQt5.QtGui import QColor, QPixmap
+        from annotation_window import AnnotationWindow
+        from annotation_model import PenStroke, RectangleAnnotation
+        
+        screenshot = QPixmap(200, 150)
+        screenshot.fill(QColor(255, 255, 255))
+        window = AnnotationWindow(screenshot)
+        
+        window.commit_annotation(PenStroke(QColor(255, 0, 0), 3, [(10, 10), (120, 90)]))
+        window.commit_annotation(RectangleAnnotation(QColor(0, 0, 255), 2, QPoint(30, 30), QPoint(150, 100)))
+        incremental = window.rendered_pixmap().toImage()
+        
+        window.update_image()
+        assert window.rendered_pixmap().toImage() == incremental
+        assert window.annotation_bounds(window.annotations[1]).contains(QPoint(150, 100))
+        print("✓ Layered rendering matches full re-render")
+        
+        window.close()
+        return True
+    except Exception as e:
+        print(f"✗ Layered rendering test error: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_background_save():
+    """Test that saving runs on the worker pool and writes the file atomically."""
+    try:
+        app = get_app()
+        import tempfile
+        from PyQt5.QtGui import QColor, QImage, QPixmap
+        from annotation_window import AnnotationWindow
+        
+        screenshot = QPixmap(64, 48)
+        screenshot.fill(QColor(0, 128, 0))
+        window = AnnotationWindow(screenshot)
+        saved = []
+        window.saver.saved.connect(saved.append)
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, 'capture.png')
+            future = window.saver.save(window.rendered_pixmap().toImage(), file_path)
+            assert future.result(timeout=10)
+            app.processEvents()
+            
+            assert saved == [file_path]
+            assert os.listdir(tmp_dir) == ['capture.png']
+            assert QImage(file_path).size() == screenshot.size()
+            
+            window.saver.failed.disconnect()  # Don't open an error dialog
+            failed = window.saver.save(QImage(), os.path.join(tmp_dir, 'empty.png'))
+            assert not failed.result(timeout=10)
+            assert os.listdir(tmp_dir) == ['capture.png']
+        print("✓ Background save writes files atomically")
+        
+        window.close()
+        return True
+    except Exception as e:
+        print(f"✗ Background save test error: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_stroke_simplification():
+    """Test that stroke simplification drops collinear points only."""
+    try:
+        from strokes import simplify_points, stroke_path
+        
+        line = [(x, 2 * x) for x in range(100)]
+        assert simplify_points(line, 0.5) == [(0, 0), (99, 198)]
+        
+        corner = [(0, 0), (5, 0), (10, 0), (10, 5), (10, 10)]
+        assert simplify_points(corner, 0.5) == [(0, 0), (10, 0), (10, 10)]
+        
+        assert stroke_path(corner, smooth=True).controlPointRect().width() == 10
+        print("✓ Pen strokes are simplified within tolerance")
+        return True
+    except Exception as e:
+        print(f"✗ Stroke simplification test error: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_undo_redo():
+    """Test that undo restores the layer pixels and redo re-applies them."""
+    try:
+        get_app()
+        from PyQt5.QtCore import QPoint
+        from PyQt5.QtGui import QColor, QPixmap
+        from annotation_window import AnnotationWindow
+        from annotation_model import EllipseAnnotation
+        
+        screenshot = QPixmap(300, 200)
+        screenshot.fill(QColor(255, 255, 255))
+        window = AnnotationWindow(screenshot)
+        original = window.rendered_pixmap().toImage()
+        
+        for i in range(3):
+            window.commit_annotation(EllipseAnnotation(QColor(0, 0, 255), 4, QPoint(10 + 40 * i, 10),
+                                                       QPoint(150 + 40 * i, 120)))
+        annotated = window.rendered_pixmap().toImage()
+        
+        for _ in range(3):
+            window.undo()
+        assert window.annotations == []
+        assert window.rendered_pixmap().toImage() == original
+        
+        for _ in range(3):
+            window.redo()
+        assert len(window.annotations) == 3
+        assert window.rendered_pixmap().toImage() == annotated
+        
+        # Snapshots hold tiles around each change, never the whole image
+        assert window.history.memory_usage < 3 * 300 * 200 * 4
+        print("✓ Undo and redo restore annotation layer tiles")
+        
+        window.close()
+        return True
+    except Exception as e:
+        print(f"✗ Undo/redo test error: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_memory_demotion():
+    """Test that demoted windows restore identical pixels on demand."""
+    try:
+        get_app()
+        from PyQt5.QtCore import QPoint
+        from PyQt5.QtGui import QColor, QPixmap
+        from annotation_window import AnnotationWindow
+        from annotation_model import ArrowAnnotation
+        
+        screenshot = QPixmap(320, 240)
+        screenshot.fill(QColor(30, 60, 90))
+        window = AnnotationWindow(screenshot)
+        window.commit_annotation(ArrowAnnotation(QColor(255, 0, 0), 3, QPoint(20, 20), QPoint(200, 150)))
+        expected = window.rendered_pixmap().toImage()
+        resident = window.memory_usage()
+        
+        window.demote(full=True)
+        assert window.memory_usage() < resident
+        assert len(window.compressed_images()) == 2
+        
+        window.compressed_images()[0].spill()
+        assert window.rendered_pixmap().toImage() == expected
+        assert window.screenshot is None, "Showing the layer should not restore the screenshot"
+        window.update_image()
+        assert window.compressed_images() == []
+        assert window.rendered_pixmap().toImage() == expected
+        
+        # A visible window keeps its screenshot compressed through repaints
+        window.show()
+        window.demote()
+        demoted = window.memory_usage()
+        window.canvas.repaint(0, 0, 10, 10)
+        assert window.screenshot is None and window.memory_usage() == demoted
+        print("✓ Demoted windows restore on demand")
+        
+        window.close()
+        return True
+    except Exception as e:
+        print(f"✗ Memory demotion test error: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_annotation_serialization():
+    """Test that annotations survive a round trip through the serialized format."""
+    try:
+        import json
+        from PyQt5.QtCore import QPoint
+        from PyQt5.QtGui import QColor
+        from annotation_model import (PenStroke, TextAnnotation, EllipseAnnotation,
+                                      serialize, deserialize)
+        
+        annotations = [
+            PenStroke(QColor(255, 0, 0), 3, [(1, 2), (3.5, 4), (10, 12)], smooth=True),
+            TextAnnotation(QColor(0, 0, 0, 128), 2, QPoint(5, 20), 'Note', 14),
+            EllipseAnnotation(QColor(0, 0, 255), 4, QPoint(0, 0), QPoint(40, 30)),
+        ]
+        restored = deserialize(json.loads(json.dumps(serialize(annotations))))
+        
+        assert [a.to_dict() for a in restored] == [a.to_dict() for a in annotations]
+        assert restored[0].point_list() == [(1, 2), (3.5, 4), (10, 12)]
+        assert restored[1].color.alpha() == 128
+        assert not hasattr(restored[2], '__dict__')
+        print("✓ Annotations round-trip through the serialized format")
+        return True
+    except Exception as e:
+        print(f"✗ Annotation serialization test error: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_session_round_trip():
+    """Test that a saved session reopens with the same pixels and annotations."""
+    try:
+        get_app()
+        import struct
+        import tempfile
+        from PyQt5.QtCore import QPoint
+        from PyQt5.QtGui import QColor, QPixmap
+        from annotation_window import AnnotationWindow
+        from annotation_model import ArrowAnnotation, RectangleAnnotation, serialize
+        from session import Session, write_session
+        
+        screenshot = QPixmap(300, 200)
+        screenshot.fill(QColor(200, 220, 240))
+        window = AnnotationWindow(screenshot, QPoint(40, 50))
+        window.commit_annotation(ArrowAnnotation(QColor(255, 0, 0), 3, QPoint(10, 10), QPoint(150, 120)))
+        window.commit_annotation(RectangleAnnotation(QColor(0, 0, 255), 2, QPoint(100, 20), QPoint(250, 180)))
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, 'capture.scsession')
+            write_session(file_path, window.screenshot.toImage(), serialize(window.annotations),
+                          window.pos(), window.screenshot.devicePixelRatio())
+            
+            session = Session(file_path)
+            assert session.image() == screenshot.toImage()
+            reopened = AnnotationWindow(session.pixmap(), QPoint(*session.position),
+                                        session.annotations, session)
+            assert len(reopened.annotations) == 2
+            assert reopened.rendered_pixmap().toImage() == window.rendered_pixmap().toImage()
+            
+            # Windows show the mapped pixels; only what leaves the window is copied
+            plain_session = Session(file_path)
+            plain = AnnotationWindow(plain_session.pixmap(), session=plain_session)
+            copied = plain.rendered_pixmap()
+            plain_session._map[plain_session._offset:plain_session._offset + 4] = b'\x00\x00\x00\xff'
+            assert plain.screenshot.toImage().pixel(0, 0) == 0xFF000000, "The capture should not be copied"
+            assert copied.toImage().pixel(0, 0) == screenshot.toImage().pixel(0, 0)
+            
+            # Closing a window unmaps its session file
+            reopened.close()
+            plain.close()
+            assert reopened.session is None and plain.screenshot is None
+            assert session._map is None and plain_session._map is None and plain_session._file.closed
+            del plain
+            
+            # Damaged files are reported as ValueError, whatever is wrong with them
+            with open(file_path, 'rb') as file:
+                data = file.read()
+            header = b'{"width": 300}'
+            for damaged in (data[:10], data[:40], data[:-1000], b'SCSESS01' + struct.pack('<I', len(header)) + header):
+                with open(file_path, 'wb') as file:
+                    file.write(damaged)
+                try:
+                    Session(file_path)
+                    raise AssertionError("A damaged session should not open")
+                except ValueError as e:
+                    assert str(e).startswith("not a session file"), e
+        
+        print("✓ Sessions reopen with editable annotations")
+        
+        window.close()
+        return True
+    except Exception as e:
+        print(f"✗ Session round-trip test error: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_capture_history():
+    """Test that the capture history dedups identical captures and prunes old ones."""
+    try:
+        app = get_app()
+        import time
+        import tempfile
+        from PyQt5.QtCore import Qt, QPoint
+        from PyQt5.QtGui import QColor, QPixmap
+        from capture_history import CaptureHistory, HistoryModel
+        
+        def capture(color):
+            pixmap = QPixmap(200, 100)
+            pixmap.fill(color)
+            return pixmap
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            history = CaptureHistory(tmp_dir, max_entries=3)
+            history.add(capture(QColor(255, 0, 0)), QPoint(10, 20))
+            history.add(capture(QColor(255, 0, 0)), QPoint(30, 40))
+            history.flush()
+            
+            entries = history.entries()
+            assert len(entries) == 2
+            assert entries[0].digest == entries[1].digest
+            assert len(os.listdir(history.images_dir)) == 1, "Identical captures should be stored once"
+            assert os.path.exists(history.thumbnail_path(entries[0].digest))
+            
+            for color in (QColor(0, 255, 0), QColor(0, 0, 255)):
+                history.add(capture(color))
+            history.flush()
+            assert len(history.entries()) == 3
+            assert len(os.listdir(history.images_dir)) == 3
+            
+            # A new history over the same directory sees the same entries
+            reopened = CaptureHistory(tmp_dir, max_entries=3)
+            assert [e.digest for e in reopened.entries()] == [e.digest for e in history.entries()]
+            loaded = reopened.load(reopened.entries()[-1])
+            assert loaded.toImage() == capture(QColor(0, 0, 255)).toImage()
+            
+            # Thumbnails load lazily, in the background
+            model = HistoryModel(reopened)
+            index = model.index(0)
+            assert model.data(index, Qt.DecorationRole) is None
+            for _ in range(100):
+                app.processEvents()
+                if model.data(index, Qt.DecorationRole) is not None:
+                    break
+                time.sleep(0.01)
+            assert model.data(index, Qt.DecorationRole) is not None
+            reopened.flush()
+        
+        print("✓ Capture history stores identical captures once and loads thumbnails lazily")
+        return True
+    except Exception as e:
+        print(f"✗ Capture history test error: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_lazy_clipboard():
+    """Test that copying defers encoding until a format is requested."""
+    try:
+        get_app()
+        from PyQt5.QtCore import QPoint, QUrl
+        from PyQt5.QtGui import QColor, QImage, QPixmap
+        from PyQt5.QtWidgets import QApplication
+        from annotation_window import AnnotationWindow
+        
+        screenshot = QPixmap(400, 300)
+        screenshot.fill(QColor(30, 120, 200))
+        window = AnnotationWindow(screenshot, QPoint(0, 0))
+        window.copy_to_clipboard()
+        
+        mime_data = QApplication.clipboard().mimeData()
+        assert mime_data.hasImage()
+        for mime_type in ('image/png', 'image/jpeg', 'image/bmp', 'text/uri-list'):
+            assert mime_data.hasFormat(mime_type), f"{mime_type} not offered"
+        
+        if hasattr(mime_data, 'encoded'):
+            # Same process: the clipboard hands back our own object
+            assert not mime_data.encoded, "Nothing should be encoded before it is requested"
+            decoded = QImage.fromData(mime_data.data('image/png'), 'PNG')
+            assert list(mime_data.encoded) == ['image/png'], "Only the requested format should be encoded"
+            assert decoded == screenshot.toImage().convertToFormat(decoded.format())
+            
+            path = QUrl(bytes(mime_data.data('text/uri-list')).decode().strip()).toLocalFile()
+            assert os.path.exists(path)
+            
+            # The exported file goes once the clipboard holds something else
+            window.copy_to_clipboard()
+            QApplication.processEvents()
+            assert not os.path.exists(path), "The previous export should be deleted"
+        
+        print("✓ Clipboard formats are encoded on request")
+        window.close()
+        return True
+    except Exception as e:
+        print(f"✗ Lazy clipboard test error: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_shared_frame():
+    """Test that crops share the captured frame's pixels until painted on."""
+    try:
+        get_app()
+        from PyQt5.QtCore import QRect, QPoint
+        from PyQt5.QtGui import QColor, QPixmap
+        from annotation_window import AnnotationWindow
+        from annotation_model import RectangleAnnotation
+        from image_buffer import SharedFrame
+        
+        screenshot = QPixmap(800, 600)
+        screenshot.setDevicePixelRatio(2.0)
+        screenshot.fill(QColor(90, 90, 90))
+        frame = SharedFrame(screenshot, QRect(-400, 0, 400, 300))
+        
+        whole = frame.crop(QRect(0, 0, 400, 300))
+        assert whole.cacheKey() == screenshot.cacheKey(), "A full-frame crop should share pixels"
+        part = frame.crop(QRect(10, 20, 100, 50))
+        assert part.size() == QRect(0, 0, 200, 100).size() and part.devicePixelRatio() == 2.0
+        assert frame.position(QRect(10, 20, 100, 50)) == QPoint(-390, 20)
+        
+        # Annotating detaches the window's layer from the frame
+        window = AnnotationWindow(whole, QPoint(0, 0))
+        assert window.base_layer.cacheKey() == screenshot.cacheKey()
+        window.commit_annotation(RectangleAnnotation(QColor(255, 0, 0), 4, QPoint(5, 5), QPoint(100, 100)))
+        assert window.base_layer.cacheKey() != screenshot.cacheKey()
+        assert screenshot.toImage().pixelColor(20, 20) == QColor(90, 90, 90)
+        
+        frame.release()
+        assert frame.is_released and frame.nbytes == 0
+        print("✓ Crops share the captured frame until painted on")
+        window.close()
+        return True
+    except Exception as e:
+        print(f"✗ Shared frame test error: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_capture_scheduler():
+    """Test that overlapping and repeated capture requests are dropped."""
+    try:
+        app = get_app()
+        import time
+        import threading
+        from capture_scheduler import CaptureScheduler
+        
+        scheduler = CaptureScheduler()
+        started = []
+        modes = []
+        scheduler.triggered.connect(lambda requested_at, mode: (started.append(requested_at), modes.append(mode)))
+        
+        # A burst of requests from another thread, as key repeat would send
+        burst = threading.Thread(target=lambda: [scheduler.request('scroll') for _ in range(20)])
+        burst.start()
+        burst.join()
+        app.processEvents()
+        assert len(started) == 1, f"Expected one capture, got {len(started)}"
+        assert scheduler.stats()['dropped'] == 19
+        
+        # The mode travels with its request, so a dropped one changes nothing
+        scheduler.request('record')
+        app.processEvents()
+        assert modes == ['scroll'] and scheduler.stats()['dropped'] == 20
+        
+        # While busy, delayed captures wait for the current one to finish
+        scheduler.schedule(0)
+        scheduler.schedule(0)
+        deadline = time.monotonic() + 1
+        while time.monotonic() < deadline:
+            app.processEvents()
+        assert len(started) == 1 and scheduler.stats()['queue_depth'] == 2
+        
+        for expected in (2, 3):
+            scheduler.finish()
+            deadline = time.monotonic() + 1
+            while len(started) < expected and time.monotonic() < deadline:
+                app.processEvents()
+            assert len(started) == expected
+        assert scheduler.stats()['queue_depth'] == 0
+        assert modes == ['scroll', None, None], "Delayed captures are plain captures"
+        
+        print("✓ Capture scheduler drops duplicate requests and queues delayed captures")
+        return True
+    except Exception as e:
+        print(f"✗ Capture scheduler test error: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_scrolling_capture():
+    """Test that scrolled frames are stitched back into the full content."""
+    try:
+        app = get_app()
+        import time
+        import numpy as np
+        from PyQt5.QtGui import QPixmap
+        from scroll_capture import ScrollingCapture, array_to_image, image_to_array
+        
+        # A long page with a fixed header, viewed through a 200-row window
+        rng = np.random.default_rng(7)
+        page = rng.integers(0, 1 << 24, size=(900, 160), dtype=np.uint32)
+        header = np.full((20, 160), 0x303030, dtype=np.uint32)
+        offsets = [0, 0, 37, 90, 90, 200, 333, 480, 620]
+        frames = iter(np.concatenate([header, page[y:y + 180]]) for y in offsets)
+        
+        def grab():
+            frame = next(frames, None)
+            return None if frame is None else QPixmap.fromImage(array_to_image(frame))
+        
+        results = []
+        capture = ScrollingCapture(grab, interval_ms=1)
+        capture.finished.connect(results.append)
+        capture.start()
+        deadline = time.monotonic() + 5
+        while capture.stitcher.frames < 7 and time.monotonic() < deadline:
+            app.processEvents()
+        capture.stop()
+        while not results and time.monotonic() < deadline:
+            app.processEvents()
+        
+        stitched = image_to_array(results[0]) & 0xFFFFFF
+        expected = np.concatenate([header, page[:800]])
+        assert stitched.shape == expected.shape, f"Got {stitched.shape}, expected {expected.shape}"
+        assert np.array_equal(stitched, expected)
+        
+        print("✓ Scrolling capture stitches frames into the full content")
+        return True
+    except Exception as e:
+        print(f"✗ Scrolling capture test error: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_region_recording():
+    """Test that recordings keep only changed tiles and encode to animated images."""
+    try:
+        app = get_app()
+        import time
+        import tempfile
+        import numpy as np
+        from PIL import Image
+        from PyQt5.QtGui import QPixmap
+        from image_saver import ImageSaver
+        from recording import RegionRecorder, TileFrames, encode_recording, to_pil
+        from scroll_capture import array_to_image
+        
+        # A static 320x240 UI with a small blinking cursor
+        background = np.full((240, 320), 0xFFEEEEEE, dtype=np.uint32)
+        frames = []
+        for i in range(12):
+            frame = background.copy()
+            if i % 4 < 2:
+                frame[100:116, 50:52] = 0xFF000000
+            frames.append(frame)
+        
+        tiles = TileFrames()
+        stored = [tiles.add(frame, i * 0.1) for i, frame in enumerate(frames)]
+        assert stored.count(True) == 6, "Unchanged frames should not be stored"
+        assert tiles.nbytes < 2 * background.nbytes, "Only the changed tiles should be stored"
+        replayed = [pixels.copy() for _, pixels in tiles.replay()]
+        assert np.array_equal(replayed[1], frames[2]) and np.array_equal(replayed[2], frames[4])
+        
+        grabs = iter(frames)
+        
+        def grab():
+            frame = next(grabs, None)
+            return None if frame is None else QPixmap.fromImage(array_to_image(frame))
+        
+        recorder = RegionRecorder(grab, fps=100, max_seconds=0.3)
+        stopped = []
+        recorder.stopped.connect(lambda: stopped.append(True))
+        recorder.start()
+        deadline = time.monotonic() + 5
+        while not stopped and time.monotonic() < deadline:
+            app.processEvents()
+        assert stopped, "Recording should stop at its time limit"
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            saver = ImageSaver()
+            for name in ('clip.webp', 'clip.gif'):
+                file_path = os.path.join(tmp_dir, name)
+                recorder.save(saver, file_path).result(timeout=30)
+                with Image.open(file_path) as clip:
+                    assert clip.is_animated and clip.size == (320, 240)
+                    assert clip.n_frames == len(recorder.frames)
+            
+            # Frames reach the encoder in order and intact, rebuilt one at a time
+            file_path = os.path.join(tmp_dir, 'cursor.webp')
+            encode_recording(tiles, 1.2, file_path)
+            with Image.open(file_path) as clip:
+                for index, frame in enumerate(frames[::2]):
+                    clip.seek(index)
+                    assert np.array_equal(np.asarray(clip.convert('RGB')), np.asarray(to_pil(frame)))
+                assert clip.info['duration'] == 200
+        
+        print("✓ Region recording stores changed tiles and encodes WebP/GIF")
+        return True
+    except Exception as e:
+        print(f"✗ Region recording test error: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_element_snapping():
+    """Test that the overlay highlights, and clicks select, detected elements."""
+    try:
+        app = get_app()
+        import time
+        from PyQt5.QtCore import Qt, QRect, QPoint, QPointF, QEvent
+        from PyQt5.QtGui import QColor, QPainter, QPen, QPixmap, QMouseEvent
+        from screen_capture import SelectionOverlay
+        
+        # A window-like panel holding two buttons
+        screenshot = QPixmap(640, 480)
+        screenshot.fill(QColor(250, 250, 250))
+        painter = QPainter(screenshot)
+        painter.fillRect(QRect(100, 80, 400, 300), QColor(225, 225, 230))
+        painter.setPen(QPen(QColor(60, 60, 60), 1))
+        painter.drawRect(QRect(100, 80, 399, 299))
+        button = QRect(140, 300, 120, 40)
+        painter.fillRect(button, QColor(0, 120, 215))
+        painter.fillRect(QRect(300, 300, 120, 40), QColor(0, 120, 215))
+        painter.end()
+        
+        overlay = SelectionOverlay()
+        selections = []
+        overlay.selection_made.connect(selections.append)
+        overlay.start(screenshot, QRect(0, 0, 640, 480))
+        deadline = time.monotonic() + 5
+        while overlay.element_map is None and time.monotonic() < deadline:
+            app.processEvents()
+            time.sleep(0.005)
+        element_map = overlay.element_map
+        assert element_map is not None, "Element analysis should finish in the background"
+        
+        assert element_map.element_at(QPoint(200, 320)) == button
+        assert element_map.element_at(QPoint(120, 100)) == QRect(100, 80, 400, 300)
+        assert element_map.snap(QRect(143, 297, 114, 46), 6) == button
+        # Lookup latency is budgeted in benchmark.py (overlay.element_at)
+        
+        # Hover highlights the button; a click selects it
+        def send(event_type, pos, button=Qt.NoButton, buttons=Qt.NoButton):
+            app.sendEvent(overlay, QMouseEvent(event_type, QPointF(pos), button, buttons, Qt.NoModifier))
+        
+        send(QEvent.MouseMove, QPoint(200, 320))
+        assert overlay.highlight_rect == button
+        send(QEvent.MouseButtonPress, QPoint(200, 320), Qt.LeftButton, Qt.LeftButton)
+        send(QEvent.MouseButtonRelease, QPoint(201, 321), Qt.LeftButton)
+        assert selections == [button], f"Got {selections}"
+        
+        print("✓ Overlay snaps selections to detected elements")
+        overlay.close()
+        return True
+    except Exception as e:
+        print(f"✗ Element snapping test error: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_redaction():
+    """Test that pixelate and blur replace region pixels and reuse cached work."""
+    try:
+        get_app()
+        import time
+        import numpy as np
+        from PyQt5.QtCore import QPoint
+        from annotation_model import PixelateAnnotation, BlurAnnotation, deserialize, serialize
+        from annotation_window import AnnotationWindow
+        from scroll_capture import image_to_array, array_to_image
+        from PyQt5.QtGui import QColor, QPixmap
+        
+        rng = np.random.default_rng(7)
+        noise = rng.integers(0, 2 ** 24, size=(300, 400), dtype=np.uint32) | np.uint32(0xFF000000)
+        window = AnnotationWindow(QPixmap.fromImage(array_to_image(noise)))
+        
+        # Pixelate: every block inside the region is one averaged colour
+        pixelate = PixelateAnnotation(QColor('red'), 3, QPoint(36, 24), QPoint(155, 119))
+        window.commit_annotation(pixelate)
+        pixels = image_to_array(window.rendered_pixmap().toImage())
+        block = pixelate.strength
+        region = pixels[24:120, 36:156]
+        assert (region[:, :, None] != noise[24:120, 36:156][:, :, None]).mean() > 0.99
+        blocks = region.reshape(region.shape[0] // block, block, region.shape[1] // block, block)
+        assert (blocks == blocks[:, :1, :, :1]).all(), "Pixelated blocks should be uniform"
+        expected = noise[24:36, 36:48].view(np.uint8).reshape(12, 12, 4).reshape(-1, 4).sum(axis=0) // 144
+        assert (region[:1, :1].view(np.uint8).reshape(4) == expected).all()
+        assert (pixels[:24] == noise[:24]).all(), "Pixels outside the region must not change"
+        
+        # Blur: far less variation than the noise it replaced
+        blur = BlurAnnotation(QColor('red'), 3, QPoint(300, 250), QPoint(200, 150))
+        window.commit_annotation(blur)
+        pixels = image_to_array(window.rendered_pixmap().toImage())
+        green = lambda array: ((array >> 8) & 0xFF).astype(float)
+        assert green(pixels[150:251, 200:301]).std() < green(noise[150:251, 200:301]).std() / 4
+        
+        # Re-rendering reuses both layers and both finished regions
+        layers = dict(window.redactions.layers)
+        regions = list(window.redactions.regions)
+        window.update_image()
+        assert window.redactions.layers == layers and list(window.redactions.regions) == regions
+        assert len(regions) == 2
+        
+        assert [a.name for a in deserialize(serialize(window.annotations))] == ['pixelate', 'blur']
+        
+        # A failed layer build is left out of the memory estimate rather than raised from it
+        from concurrent.futures import Future
+        failed = Future()
+        failed.set_exception(MemoryError())
+        window.redactions.layers['broken', 1] = failed
+        assert window.redactions.nbytes > 0
+        print("✓ Pixelate and blur replace the region's pixels")
+        window.close()
+        
+        # Live preview on a 4K capture: each mouse move re-renders the region only
+        screenshot = QPixmap(3840, 2160)
+        screenshot.fill(QColor(90, 120, 150))
+        window = AnnotationWindow(screenshot)
+        for annotation_type in (PixelateAnnotation, BlurAnnotation):
+            window.current_annotation = annotation_type(QColor('red'), 3, QPoint(10, 10), QPoint(20, 20))
+            window.rendered_pixmap()  # Builds the layer once
+            start = time.perf_counter()
+            for step in range(5):
+                window.current_annotation.end = QPoint(3000 + step * 100, 1600 + step * 100)
+                window.rendered_pixmap()
+            elapsed = (time.perf_counter() - start) / 5
+            assert not window.redactions.regions, "Previews should not be cached"
+            print(f"✓ {annotation_type.name} preview on 4K: {elapsed * 1000:.0f} ms per move")
+        window.current_annotation = None
+        window.close()
+        return True
+    except Exception as e:
+        print(f"✗ Redaction test error: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_cli_capture():
+    """Test that a command-line capture works without importing the GUI modules."""
+    try:
+        import tempfile
+        import argparse
+        import cli
+        from benchmark import import_profile
+        
+        assert cli.parse_region('10,-20,300,200') == (10, -20, 300, 200)
+        for text in ('10,20,300', '0,0,0,5', 'a,b,c,d'):
+            try:
+                cli.parse_region(text)
+                assert False, f"{text!r} should be rejected"
+            except argparse.ArgumentTypeError:
+                pass
+        assert cli.output_format('-') == 'PNG'
+        assert cli.output_format('shot.JPG') == 'JPEG'
+        assert cli.output_format('shot.png', 'webp') == 'WEBP'
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            out = os.path.join(tmp_dir, 'shot.png')
+            argv = ['capture', '--region', '0,0,64,48', '--out', out]
+            import_seconds, modules, process = import_profile(argv)
+            
+            # The offscreen platform has nothing to grab; anything else should write the file
+            assert process.returncode in (0, 1), process.stderr
+            assert process.returncode == 1 or os.path.getsize(out) > 0
+            heavy = [name for name in cli.HEAVY_MODULES if name in modules]
+            assert not heavy, f"Capture imported {heavy}"
+        
+        # The import time budget is checked by benchmark.py (cli.capture.imports)
+        print(f"✓ CLI capture imports in {import_seconds * 1000:.0f} ms without the GUI modules")
+        return True
+    except Exception as e:
+        print(f"✗ CLI capture test error: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_single_instance():
+    """Test that later invocations forward commands to the running instance."""
+    try:
+        app = get_app()
+        import time
+        import socket
+        import tempfile
+        import threading
+        import subprocess
+        from PyQt5.QtCore import QDir
+        from PyQt5.QtGui import QPixmap
+        from instance import InstanceServer, send_command, NAME_ENV
+        
+        name = f'screen-capture-test-{os.getpid()}'
+        server = InstanceServer(name)
+        assert server.listen()
+        assert not InstanceServer(name).listen(), "A second instance must not start listening"
+        
+        received = []
+        def pin_file(args):
+            if not os.path.exists(args[0]):
+                raise ValueError(f"Could not open {args[0]}")
+            received.append(('pin-file', args))
+        server.handlers['pin-file'] = pin_file
+        server.handlers['open-history'] = lambda args: received.append(('open-history', args))
+        server.handlers['broken'] = lambda args: args[0].lower()
+        
+        def wait_for(done, timeout=10):
+            deadline = time.monotonic() + timeout
+            while not done() and time.monotonic() < deadline:
+                app.processEvents()
+                time.sleep(0.001)
+        
+        # Clients block on their reply, so they run off the GUI thread here
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            image_path = os.path.join(tmp_dir, 'pin.png')
+            QPixmap(8, 8).save(image_path)
+            replies = []
+            client = threading.Thread(target=lambda: replies.extend([
+                send_command('pin-file', [image_path], name=name),
+                send_command('pin-file', [os.path.join(tmp_dir, 'missing.png')], name=name),
+                send_command('bogus', name=name),
+                send_command('broken', [123], name=name),
+                send_command('ping', name=name)]))
+            client.start()
+            wait_for(lambda: not client.is_alive())
+            assert replies[0] == {'ok': True}, replies
+            assert not replies[1]['ok'] and 'missing.png' in replies[1]['error']
+            assert replies[2] == {'ok': False, 'error': "Unknown command: bogus"}
+            assert not replies[3]['ok'] and replies[4] == {'ok': True}, "A failing handler must not stop the instance"
+            assert received == [('pin-file', [image_path])]
+        
+        # A real invocation exits as soon as the instance has replied
+        main_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, main_path, 'open-history'],
+                                   env=dict(os.environ, **{NAME_ENV: name}), stderr=subprocess.PIPE)
+        wait_for(lambda: process.poll() is not None)
+        elapsed = time.perf_counter() - start
+        assert process.wait() == 0, process.stderr.read()
+        assert received[-1] == ('open-history', [])
+        assert send_command('ping', name=f'{name}-absent') is None
+        server.close()
+        
+        # A socket left behind by a crashed instance is replaced
+        if os.name == 'posix':
+            stale = socket.socket(socket.AF_UNIX)
+            stale.bind(os.path.join(QDir.tempPath(), name))
+            stale.close()
+            server = InstanceServer(name)
+            assert server.listen(), "A stale socket should be replaced"
+            server.close()
+        
+        print(f"✓ Commands reach the running instance ({elapsed * 1000:.0f} ms per invocation)")
+        return True
+    except Exception as e:
+        print(f"✗ Single instance test error: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_zoom_pan():
+    """Test that the zoomed view maps the mouse to image space and pans a tall image quickly."""
+    try:
+        app = get_app()
+        import time
+        import numpy as np
+        from PyQt5.QtCore import Qt, QPoint, QPointF, QEvent
+        from PyQt5.QtGui import QMouseEvent, QPixmap
+        from annotation_model import AnnotationTool
+        from annotation_window import AnnotationWindow
+        from scroll_capture import image_to_array, array_to_image
+        
+        # A 20000-pixel-tall capture whose rows can be told apart
+        rows = np.arange(20000, dtype=np.uint32)
+        column = np.uint32(0xFF000000) | ((rows % 256) << 16) | (((rows // 256) % 256) << 8)
+        pixels = np.repeat(column[:, None], 400, axis=1)
+        window = AnnotationWindow(QPixmap.fromImage(array_to_image(pixels)))
+        window.show()
+        app.processEvents()
+        canvas = window.canvas
+        assert canvas.height() < 20000, "The canvas should be capped to the screen"
+        
+        # Every tool maps canvas pixels through zoom and scroll
+        canvas.set_zoom(2.0, QPoint(0, 0))
+        canvas.pan_by(QPoint(100, 5000))
+        assert canvas.scroll_pos == QPoint(100, 5000), canvas.scroll_pos
+        
+        def send(event_type, pos, button=Qt.LeftButton, buttons=Qt.LeftButton):
+            pos = canvas.mapTo(window, pos)
+            app.sendEvent(window, QMouseEvent(event_type, QPointF(pos), button, buttons, Qt.NoModifier))
+        
+        window.set_tool(AnnotationTool.RECTANGLE)
+        send(QEvent.MouseButtonPress, QPoint(20, 40))
+        send(QEvent.MouseMove, QPoint(120, 240), Qt.NoButton)
+        send(QEvent.MouseButtonRelease, QPoint(120, 240), buttons=Qt.NoButton)
+        rectangle = window.annotations[-1]
+        assert (rectangle.start, rectangle.end) == (QPoint(60, 2520), QPoint(110, 2620)), \
+            f"Got {rectangle.start}, {rectangle.end}"
+        
+        window.set_tool(AnnotationTool.PEN)
+        send(QEvent.MouseButtonPress, QPoint(21, 41))
+        send(QEvent.MouseMove, QPoint(41, 61), Qt.NoButton)
+        send(QEvent.MouseButtonRelease, QPoint(41, 61), buttons=Qt.NoButton)
+        stroke = window.annotations[-1].point_list()
+        assert stroke[0] == (60.5, 2520.5) and stroke[-1] == (70.5, 2530.5), f"Got {stroke}"
+        
+        # Zoomed out, only the tiles in view are rendered, from the pyramid
+        canvas.set_zoom(0.25, QPoint(0, 0))
+        canvas.repaint()
+        columns, rows_range = canvas.tiles.tile_range(canvas.rect().translated(canvas.scroll_pos))
+        assert canvas.tiles.rendered <= len(columns) * len(rows_range), canvas.tiles.rendered
+        shown = image_to_array(canvas.grab().toImage())
+        expected = pixels[(canvas.scroll_pos.y() + 300) * 4, 200]
+        x = 50 - canvas.scroll_pos.x()  # The narrow image is centred
+        assert abs(int(shown[300, x] >> 8 & 0xFF) - int(expected >> 8 & 0xFF)) <= 1, \
+            "Tiles should show the reduced image"
+        
+        # Panning repaints only the strip that comes into view
+        painted = [0]
+        paint_event = canvas.paintEvent
+        
+        def counted_paint(event):
+            painted[0] += 1
+            paint_event(event)
+        canvas.paintEvent = counted_paint
+        
+        for zoom in (1.0, 0.5):
+            canvas.set_zoom(zoom, QPoint(0, 0))
+            canvas.pan_by(QPoint(0, -canvas.scroll_pos.y()))
+            canvas.repaint()
+            painted[0] = 0
+            frames = 75
+            start = time.perf_counter()
+            for _ in range(frames):
+                canvas.pan_by(QPoint(0, 120))  # One wheel notch
+                canvas.repaint()
+            elapsed = (time.perf_counter() - start) / frames
+            assert canvas.scroll_pos.y() == frames * 120 and painted[0] >= frames
+            print(f"✓ Panning a 20000 px capture at {zoom:.0%}: {elapsed * 1000:.2f} ms per frame")
+        
+        print("✓ Zoomed views map the mouse to image space and render visible tiles only")
+        window.close()
+        return True
+    except Exception as e:
+        print(f"✗ Zoom and pan test error: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_encoder_presets():
+    """Test encoder presets, parallel export and the auto mode."""
+    try:
+        app = get_app()
+        import os
+        import time
+        import tempfile
+        from PyQt5.QtCore import QRect
+        from PyQt5.QtGui import QColor, QImage, QPainter
+        import encoders
+        
+        # A UI-like capture with few colours, so the palette preset is exact too
+        image = QImage(640, 400, QImage.Format_RGB32)
+        image.fill(QColor(240, 240, 240))
+        painter = QPainter(image)
+        for index in range(40):
+            painter.fillRect(QRect(16 * index, 10 * index, 120, 24), QColor(20 * (index % 12), 90, 200))
+        painter.end()
+        
+        results = encoders.encode_all(image)
+        assert [result.preset.name for result in results] == list(encoders.PRESETS)
+        for result in results:
+            assert result.error is None, result.describe()
+            decoded = QImage.fromData(result.data)
+            assert decoded.size() == image.size(), result.preset.name
+            if result.preset.lossless or result.preset.name == 'png-palette':
+                assert decoded.convertToFormat(QImage.Format_RGB32) == image, \
+                    f"{result.preset.name} should be exact"
+        sizes = {result.preset.name: result.size for result in results}
+        assert sizes['png-max'] <= sizes['png-fast']
+        
+        # Auto picks the smallest lossless output, or the first one done when out of time
+        best = encoders.encode_auto(image)
+        assert best.preset.lossless
+        assert best.size == min(result.size for result in results if result.preset.lossless)
+        assert encoders.encode_auto(image, budget=0).data
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            written = encoders.save_with_preset(image, os.path.join(tmp_dir, 'shot.png'), 'jpeg', 50)
+            assert written.endswith('shot.jpg') and os.path.exists(written)
+            written = encoders.save_with_preset(image, os.path.join(tmp_dir, 'auto'), encoders.AUTO)
+            assert written == os.path.join(tmp_dir, 'auto.' + best.preset.extension)
+            
+            # Export all writes one file per preset and reports each
+            exporter = encoders.Exporter()
+            reports = []
+            exporter.exported.connect(lambda base, results: reports.append(results))
+            exporter.export(image, os.path.join(tmp_dir, 'shot.png'))
+            deadline = time.monotonic() + 10
+            while not reports and time.monotonic() < deadline:
+                app.processEvents()
+                time.sleep(0.005)
+            assert reports, "Export should report back"
+            for result in reports[0]:
+                assert os.path.getsize(result.path) == result.size, result.describe()
+            assert os.path.exists(os.path.join(tmp_dir, 'shot-webp-lossless.webp'))
+        
+        print("✓ Encoder presets: " + ", ".join(f"{name} {size // 1024} KB" for name, size in sizes.items()))
+        return True
+    except Exception as e:
+        print(f"✗ Encoder preset test error: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_annotation_selection():
+    """Test selecting, moving, restyling and deleting annotations through the spatial index."""
+    try:
+        app = get_app()
+        import time
+        import random
+        import numpy as np
+        from PyQt5.QtCore import Qt, QPoint, QPointF, QEvent
+        from PyQt5.QtGui import QColor, QMouseEvent, QPixmap
+        from annotation_model import (AnnotationTool, RectangleAnnotation, EllipseAnnotation,
+                                      ArrowAnnotation, PenStroke, TextAnnotation)
+        from annotation_window import AnnotationWindow
+        from scroll_capture import image_to_array
+        
+        # Thousands of annotations on the left, two isolated ones on the right
+        rng = random.Random(5)
+        annotations = []
+        for index in range(3000):
+            x, y = rng.randrange(480), rng.randrange(480)
+            color = QColor(rng.randrange(256), 60, 90)
+            kind = index % 5
+            if kind == 0:
+                annotations.append(RectangleAnnotation(color, 2, QPoint(x, y), QPoint(x + 40, y + 30)))
+            elif kind == 1:
+                annotations.append(EllipseAnnotation(color, 3, QPoint(x, y), QPoint(x + 30, y + 50)))
+            elif kind == 2:
+                annotations.append(ArrowAnnotation(color, 2, QPoint(x, y), QPoint(x + 60, y + 10)))
+            elif kind == 3:
+                annotations.append(PenStroke(color, 3, [(x, y), (x + 10, y + 20), (x + 30, y + 5)]))
+            else:
+                annotations.append(TextAnnotation(color, 2, QPoint(x, y), "note"))
+        box = RectangleAnnotation(QColor('blue'), 3, QPoint(600, 100), QPoint(700, 160))
+        ring = EllipseAnnotation(QColor('green'), 3, QPoint(600, 300), QPoint(680, 380))
+        annotations += [box, ring]
+        
+        screenshot = QPixmap(800, 520)
+        screenshot.fill(QColor(230, 230, 230))
+        window = AnnotationWindow(screenshot, annotations=annotations)
+        window.show()
+        app.processEvents()
+        canvas = window.canvas
+        window.set_tool(AnnotationTool.SELECT)
+        
+        def send(event_type, pos, button=Qt.LeftButton, buttons=Qt.LeftButton):
+            pos = canvas.mapTo(window, pos)
+            app.sendEvent(window, QMouseEvent(event_type, QPointF(pos), button, buttons, Qt.NoModifier))
+        
+        def drag(start, end):
+            send(QEvent.MouseButtonPress, start)
+            for step in range(1, 11):
+                send(QEvent.MouseMove, start + (end - start) * step / 10, Qt.NoButton)
+            send(QEvent.MouseButtonRelease, end, buttons=Qt.NoButton)
+        
+        def layer_matches_full_render():
+            pixels = image_to_array(window.base_layer.toImage())
+            window.update_image()
+            full = image_to_array(window.base_layer.toImage())
+            # Clipped antialiasing may differ by a level or two
+            difference = np.abs(pixels.view(np.uint8).astype(int) - full.view(np.uint8).astype(int))
+            return difference.max() <= 4
+        
+        # Hover and hit tests look only at the index's candidates
+        send(QEvent.MouseMove, QPoint(650, 101), Qt.NoButton, Qt.NoButton)
+        assert window.hover_annotation is box
+        send(QEvent.MouseMove, QPoint(650, 130), Qt.NoButton, Qt.NoButton)
+        assert window.hover_annotation is None, "The inside of an outline is not part of it"
+        points = [QPointF(rng.uniform(0, 520), rng.uniform(0, 520)) for _ in range(2000)]
+        start = time.perf_counter()
+        for point in points:
+            window.annotation_at(point)
+        elapsed = (time.perf_counter() - start) / len(points)
+        
+        # Drag the box; undo puts it back
+        drag(QPoint(600, 130), QPoint(640, 150))
+        assert window.selection == [box]
+        assert (box.start, box.end) == (QPoint(640, 120), QPoint(740, 180)), (box.start, box.end)
+        assert window.annotation_at(QPointF(740, 150)) is box, "The index should follow the move"
+        assert layer_matches_full_render()
+        window.undo()
+        assert (box.start, box.end) == (QPoint(600, 100), QPoint(700, 160))
+        
+        # Band-select both isolated annotations, restyle and delete them
+        drag(QPoint(590, 90), QPoint(760, 400))
+        assert window.selection == [box, ring], window.selection
+        window.width_spinner.setValue(8)
+        assert (box.width, ring.width) == (8, 8)
+        window.delete_selection()
+        assert len(window.annotations) == 3000 and len(window.index) == 3000
+        assert window.annotation_at(QPointF(600, 130)) is None
+        window.undo()
+        window.undo()
+        assert window.annotations[-2:] == [box, ring] and (box.width, ring.width) == (3, 3)
+        assert layer_matches_full_render()
+        
+        # Deleting from the middle of the list and undoing keeps the stacking order
+        middle = annotations[1000:1010]
+        window.set_selection(middle)
+        window.delete_selection()
+        window.undo()
+        assert window.annotations == annotations
+        orders = [window.index.order(annotation) for annotation in window.annotations]
+        assert orders == sorted(orders)
+        
+        print(f"✓ Annotations select, move, restyle and delete ({elapsed * 1e6:.0f} µs per hit test "
+              f"among {len(annotations)})")
+        window.close()
+        return True
+    except Exception as e:
+        print(f"✗ Annotation selection test error: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_annotation_renderers():
+    """Test the per-tool renderer registry and its cached drawing resources."""
+    try:
+        get_app()
+        from PyQt5.QtCore import QPoint, QPointF
+        from PyQt5.QtGui import QColor, QPixmap
+        from annotation_model import (AnnotationTool, ShapeAnnotation, RectangleAnnotation, ArrowAnnotation,
+                                      TextAnnotation, PenStroke, PixelateAnnotation)
+        from annotation_renderers import RENDERERS, ShapeRenderer, register, renderer_for
+        from annotation_window import AnnotationWindow
+        
+        box = RectangleAnnotation(QColor('red'), 3, QPoint(20, 20), QPoint(120, 80))
+        arrow = ArrowAnnotation(QColor('blue'), 2, QPoint(200, 40), QPoint(300, 40))
+        text = TextAnnotation(QColor('black'), 2, QPoint(40, 200), "<b>plain</b>", font_size=14)
+        stroke = PenStroke(QColor('green'), 4, [(150, 150), (200, 180), (260, 150)])
+        redaction = PixelateAnnotation(QColor('red'), 2, QPoint(300, 200), QPoint(360, 260))
+        
+        screenshot = QPixmap(400, 300)
+        screenshot.fill(QColor(230, 230, 230))
+        window = AnnotationWindow(screenshot, annotations=[box, arrow, text, stroke, redaction])
+        
+        # Resources are built once per annotation and reused by later redraws
+        prepared = [annotation._resources for annotation in window.annotations[:4]]
+        assert all(resources is not None for resources in prepared)
+        window.update_image()
+        assert [annotation._resources for annotation in window.annotations[:4]] == prepared
+        assert all(a._resources is b for a, b in zip(window.annotations, prepared))
+        
+        # Restyling and moving rebuild only what changed
+        image = window.base_layer.toImage()
+        assert image.pixelColor(20, 50) == QColor('red')
+        window.restyle_annotations([box], [(QColor('magenta'), 3)])
+        assert box._resources is not prepared[0]
+        assert window.base_layer.toImage().pixelColor(20, 50) == QColor('magenta')
+        head = renderer_for(arrow).resources(arrow)[1]
+        window.move_annotations([arrow], QPoint(0, 30))
+        moved_head = renderer_for(arrow).resources(arrow)[1]
+        assert moved_head is not head and moved_head.boundingRect().center().y() == head.boundingRect().center().y() + 30
+        assert window.annotation_at(QPointF(296, 70)) is arrow
+        text.text = "a much longer line of text"
+        assert renderer_for(text).bounds(text).width() > window.index.rect(text).width()
+        
+        # New tools plug in by registering a renderer
+        class HighlightAnnotation(ShapeAnnotation):
+            tool = 'highlight'
+            __slots__ = ()
+        
+        try:
+            @register('highlight')
+            class HighlightRenderer(ShapeRenderer):
+                def prepare(self, annotation):
+                    color = QColor(annotation.color)
+                    color.setAlpha(255)
+                    return color
+                
+                def draw(self, painter, annotation, window):
+                    painter.fillRect(self.rect(annotation), self.resources(annotation))
+            
+            highlight = HighlightAnnotation(QColor('yellow'), 1, QPoint(150, 250), QPoint(250, 290))
+            window.commit_annotation(highlight)
+            assert window.base_layer.toImage().pixelColor(200, 270) == QColor('yellow')
+            assert window.annotation_at(QPointF(200, 270)) is highlight, "Filled tools are picked inside"
+            window.undo()
+            assert window.base_layer.toImage().pixelColor(200, 270) == QColor(230, 230, 230)
+        finally:
+            RENDERERS.pop('highlight', None)
+        
+        try:
+            renderer_for(HighlightAnnotation(QColor('yellow'), 1, QPoint(0, 0)))
+            raise AssertionError("An unregistered tool should be rejected")
+        except ValueError:
+            pass
+        assert AnnotationTool.SELECT not in RENDERERS
+        
+        print("✓ Renderers cache drawing resources per annotation and new tools register their own")
+        window.close()
+        return True
+    except Exception as e:
+        print(f"✗ Annotation renderer test error: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
 def main():
     """Run tests."""
     print("=" * 50)
@@ -58,6 +1268,69 @@ def main():
     if not test_class_definitions():
         success = False
     
+    if not test_layered_rendering():
+        success = False
+    
+    if not test_background_save():
+        success = False
+    
+    if not test_stroke_simplification():
+        success = False
+    
+    if not test_undo_redo():
+        success = False
+    
+    if not test_memory_demotion():
+        success = False
+    
+    if not test_annotation_serialization():
+        success = False
+    
+    if not test_session_round_trip():
+        success = False
+    
+    if not test_capture_history():
+        success = False
+    
+    if not test_lazy_clipboard():
+        success = False
+    
+    if not test_shared_frame():
+        success = False
+    
+    if not test_capture_scheduler():
+        success = False
+    
+    if not test_scrolling_capture():
+        success = False
+    
+    if not test_region_recording():
+        success = False
+    
+    if not test_element_snapping():
+        success = False
+    
+    if not test_redaction():
+        success = False
+    
+    if not test_cli_capture():
+        success = False
+    
+    if not test_single_instance():
+        success = False
+    
+    if not test_zoom_pan():
+        success = False
+    
+    if not test_encoder_presets():
+        success = False
+    
+    if not test_annotation_selection():
+        success = False
+    
+    if not test_annotation_renderers():
+        success = False
+    
     print("=" * 50)
     if success:
         print("All tests passed! Code structure is valid.")
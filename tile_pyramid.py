@@ -0,0 +1,156 @@
+"""
+Level-of-detail rendering for zoomed views of large images.
+
+An ImagePyramid keeps successively halved copies of a pixmap, each built
+once from the level above it and patched in place when a region of the
+pixmap is painted on. A TileCache cuts the view into fixed-size tiles at
+the current zoom and renders each one from the coarsest level that still
+has enough detail, so drawing a tile never scales more than about twice
+its own area of pixels. Tiles are rendered only when they come into view
+and are kept, least recently used first, within a byte budget.
+"""
+
+import math
+from collections import OrderedDict
+from PyQt5.QtCore import Qt, QRect, QRectF
+from PyQt5.QtGui import QPainter, QPixmap
+
+
+class ImagePyramid:
+    """Halved copies of a source pixmap; level 0 is the source itself."""
+
+    MIN_SIZE = 64  # Levels stop once either side would drop below this
+
+    def __init__(self, source):
+        self.source = source
+        self.levels = []  # QImage for levels 1, 2, ...; built on first use
+
+    @property
+    def nbytes(self):
+        return sum(image.sizeInBytes() for image in self.levels)
+
+    @property
+    def max_level(self):
+        width, height = self.source.width(), self.source.height()
+        levels = 0
+        while min(width, height) // 2 >= self.MIN_SIZE:
+            width, height = width // 2, height // 2
+            levels += 1
+        return levels
+
+    def level(self, index):
+        """Return level index (1 or more) as a QImage, building it and those above it if needed."""
+        while len(self.levels) < index:
+            finer = self.levels[-1] if self.levels else self.source.toImage()
+            self.levels.append(finer.scaled(max(1, finer.width() // 2), max(1, finer.height() // 2),
+                                            Qt.IgnoreAspectRatio, Qt.SmoothTransformation))
+        return self.levels[index - 1]
+
+    def update(self, device_rect):
+        """Rebuild the built levels under a rectangle of the source, in its device pixels."""
+        finer = None
+        for index, image in enumerate(self.levels, start=1):
+            if finer is None:
+                finer = self.source.toImage()
+            # Whole pixels of this level covering the rectangle, and the finer pixels under them
+            scale = 1 << index
+            left, top = device_rect.left() // scale, device_rect.top() // scale
+            right = min(image.width(), -(-(device_rect.right() + 1) // scale))
+            bottom = min(image.height(), -(-(device_rect.bottom() + 1) // scale))
+            if right <= left or bottom <= top:
+                break
+            region = finer.copy(left * 2, top * 2, (right - left) * 2, (bottom - top) * 2)
+            painter = QPainter(image)
+            painter.setCompositionMode(QPainter.CompositionMode_Source)
+            painter.drawImage(left, top, region.scaled(right - left, bottom - top, Qt.IgnoreAspectRatio,
+                                                       Qt.SmoothTransformation))
+            painter.end()
+            finer = image
+
+
+class TileCache:
+    """Tiles of a zoomed view, rendered from an ImagePyramid on demand.
+
+    Tiles are addressed by (zoom, column, row) in view pixels, where the
+    view is the source scaled by zoom / source_ratio and the tile grid
+    starts at the source's top-left corner.
+    """
+
+    TILE_SIZE = 256  # Logical view pixels
+    MAX_BYTES = 96 * 1024 * 1024
+
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.tiles = OrderedDict()  # (zoom, column, row) -> QPixmap
+        self.nbytes = 0
+        self.rendered = 0
+
+    def clear(self):
+        self.tiles = OrderedDict()
+        self.nbytes = 0
+
+    def tile_range(self, view_rect):
+        """Return (columns, rows) ranges of the tiles overlapping a view rectangle."""
+        size = self.TILE_SIZE
+        columns = range(view_rect.left() // size, view_rect.right() // size + 1)
+        rows = range(view_rect.top() // size, view_rect.bottom() // size + 1)
+        return columns, rows
+
+    def tile(self, pyramid, zoom, screen_ratio, column, row):
+        """Return the QPixmap of one tile, rendering it if it is not cached."""
+        key = (zoom, column, row)
+        pixmap = self.tiles.get(key)
+        if pixmap is not None:
+            self.tiles.move_to_end(key)
+            return pixmap
+
+        pixmap = self.render(pyramid, zoom, screen_ratio, column, row)
+        self.tiles[key] = pixmap
+        self.nbytes += pixmap.width() * pixmap.height() * pixmap.depth() // 8
+        self.rendered += 1
+        while self.nbytes > self.max_bytes and len(self.tiles) > 1:
+            _, evicted = self.tiles.popitem(last=False)
+            self.nbytes -= evicted.width() * evicted.height() * evicted.depth() // 8
+        return pixmap
+
+    def render(self, pyramid, zoom, screen_ratio, column, row):
+        """Render one tile at the screen's device pixel ratio."""
+        size = self.TILE_SIZE
+        source_ratio = pyramid.source.devicePixelRatio()
+        # Source device pixels per tile device pixel decides how coarse a level will do
+        reduction = source_ratio / (zoom * screen_ratio)
+        index = min(pyramid.max_level, max(0, int(math.floor(math.log2(reduction))))) if reduction >= 2 else 0
+        scale = 1 << index
+
+        view = QRectF(column * size, row * size, size, size)
+        source = QRectF(view.x() / zoom * source_ratio / scale, view.y() / zoom * source_ratio / scale,
+                        size / zoom * source_ratio / scale, size / zoom * source_ratio / scale)
+
+        pixmap = QPixmap(round(size * screen_ratio), round(size * screen_ratio))
+        pixmap.setDevicePixelRatio(screen_ratio)
+        pixmap.fill(Qt.transparent)
+        painter = QPainter(pixmap)
+        # Enlarged pixels stay crisp; reduced ones are filtered
+        painter.setRenderHint(QPainter.SmoothPixmapTransform, reduction > 1)
+        target = QRectF(0, 0, size, size)
+        if index == 0:
+            painter.drawPixmap(target, pyramid.source, source)
+        else:
+            painter.drawImage(target, pyramid.level(index), source)
+        painter.end()
+        return pixmap
+
+    def invalidate(self, view_rect_at):
+        """Drop the tiles that overlap a rectangle.
+
+        view_rect_at(zoom) returns the rectangle in view pixels at a zoom.
+        """
+        size = self.TILE_SIZE
+        rects = {}
+        for key in list(self.tiles):
+            zoom, column, row = key
+            if zoom not in rects:
+                rects[zoom] = view_rect_at(zoom)
+            if rects[zoom].intersects(QRect(column * size, row * size, size, size)):
+                pixmap = self.tiles.pop(key)
+                self.nbytes -= pixmap.width() * pixmap.height() * pixmap.depth() // 8